@@ -1,24 +1,25 @@
 from dash import Dash, dcc, html, Input, State, Output, dash_table, ctx
-import modules.dgt.electrolineras as electrolineras
-import modules.udala.ota as ota
-import modules.udala.zbe as zbe
-import modules.udala.parkings as parkings
-import modules.gasolineras.gasolineras as gasolineras
-import modules.attg.autobuses as autobuses
-import modules.dgt.incidencias as incidencias
-import modules.aemet.aemet as estaciones
-import modules.estaciones.aforo as aforo
-import modules.custom.mapa_custom as ia
-import modules.rsu.rsu as rsu
-import modules.dgt3.dgt3 as dgt3
+from modules.comun.registro import RegistroPaginas
+from modules.comun.cache_mapas import cache_mapas
+from modules.comun import artefactos, agrupacion, capas, cercania
+from modules.attg import isocronas, planificador, salidas
+from modules.comun.sondeo import sondeador
+from modules.comun.cliente_http import cliente
 import pandas as pd
 import os
 import smtplib
 from email.message import EmailMessage
-from flask import send_file
+from flask import send_file, jsonify
 
 app = Dash(__name__, suppress_callback_exceptions=True)
 server = app.server
+artefactos.registrar_rutas(server)
+agrupacion.registrar_rutas(server)
+capas.registrar_rutas(server)
+cercania.registrar_rutas(server)
+salidas.registrar_rutas(server)
+planificador.registrar_rutas(server)
+isocronas.registrar_rutas(server)
 
 # Tarjeta reutilizable
 def crear_tarjeta(titulo, descripcion, enlace, download_id, boton_id):
@@ -156,24 +157,36 @@ home_layout = html.Div([
 ])
 
 
-# Diccionario de layouts de mapas
-mapas = {
-    'electrolineras': electrolineras.layout,
-    'ota': ota.layout,
-    'zbe': zbe.layout,
-    'gasolineras': gasolineras.layout,
-    'incidencias': incidencias.layout,
-    'autobuses': autobuses.layout_fn(app),
-    'estaciones': estaciones.layout,
-    'aforo': aforo.layout,
-    'parkings': parkings.layout,
-    'ia': ia.layout
-}
-
-pages = {
-    "rsu": rsu.layout,
-    "dgt3": dgt3.layout
-}
+# Registro de páginas: cada módulo declara su RUTA y su fábrica de layout,
+# que solo se ejecuta en la primera visita (o en el precalentado opcional)
+registro = RegistroPaginas(app)
+
+MAPAS = [
+    "modules.dgt.electrolineras",
+    "modules.udala.ota",
+    "modules.udala.zbe",
+    "modules.gasolineras.gasolineras",
+    "modules.dgt.incidencias",
+    "modules.attg.autobuses",
+    "modules.aemet.aemet",
+    "modules.estaciones.aforo",
+    "modules.udala.parkings",
+    "modules.custom.mapa_custom",
+]
+
+PAGINAS = [
+    "modules.rsu.rsu",
+    "modules.dgt3.dgt3",
+]
+
+for modulo in MAPAS:
+    registro.registrar(modulo, volver="/app")
+for modulo in PAGINAS:
+    registro.registrar(modulo, volver="/excel")
+
+# Un único sondeador refresca las fuentes en vivo; los callbacks solo leen instantáneas
+if os.environ.get("SONDEO_ACTIVO", "1") == "1":
+    sondeador.iniciar()
 
 # Layout general
 app.layout = html.Div([
@@ -192,26 +205,10 @@ def display_page(pathname):
         return home_principal_layout
     elif pathname == '/app':
         return home_layout
+    elif pathname in registro.paginas:
+        return registro.render(pathname)
     elif pathname.startswith('/mapa/'):
-        mapa_key = pathname.split('/mapa/')[-1]
-        if mapa_key in mapas:
-            contenido = mapas[mapa_key]() if callable(mapas[mapa_key]) else mapas[mapa_key]
-            return html.Div([
-                html.A("← Volver", href="/app", className="volver"),
-                contenido
-            ], className="contenedor-mapa")
-        else:
-            return html.H3("Mapa no encontrado.")
-    elif pathname == '/pages/rsu':
-        return html.Div([
-            html.A("← Volver", href="/excel", className="volver"),
-            pages["rsu"] 
-        ], className="contenedor-mapa")
-    elif pathname == '/pages/dgt3':
-        return html.Div([
-            html.A("← Volver", href="/excel", className="volver"),
-            pages["dgt3"] 
-        ], className="contenedor-mapa")
+        return html.H3("Mapa no encontrado.")
     elif pathname == '/excel':
         ruta_excel = os.path.join("data/excel", "Espacios de datos.xlsx")
         df_excel = pd.read_excel(ruta_excel)
@@ -468,13 +465,20 @@ def toggle_modal(n_clicks_open, n_clicks_close, current_style):
         return {**current_style, "display": "none"}
     return current_style
 
-# Callbacks de módulos
-aforo.register_callbacks(app)
-parkings.register_callbacks(app)
-ia.register_callbacks(app)
-rsu.register_callbacks(app)
-dgt3.register_callbacks(app)
+@app.server.route("/estado/paginas")
+def estado_paginas():
+    return jsonify(registro.informe())
+
+@app.server.route("/estado/cache-mapas")
+def estado_cache_mapas():
+    return jsonify(cache_mapas.estadisticas())
+
+@app.server.route("/estado/fuentes")
+def estado_fuentes():
+    return jsonify({"fuentes": sondeador.estado(), "hosts": cliente.estado()})
 
 if __name__ == '__main__':
+    if os.environ.get("PRECALENTAR_PAGINAS") == "1":
+        registro.precalentar()
     port = int(os.environ.get("PORT", 8050))  
     app.run(debug=False, host='0.0.0.0', port=port)
@@ -0,0 +1,99 @@
+"""
+Compara las consultas de cercanía de modules.comun.cercania (KD-tree) con un
+recorrido completo del DataFrame, sobre las gasolineras de toda España.
+
+    python -m benchmarks.bench_cercania [--consultas 500] [--k 5]
+
+Sin el Excel del Ministerio se genera un conjunto sintético del mismo tamaño.
+"""
+import argparse
+import math
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from modules.comun.cercania import ArbolKD, RADIO_TIERRA_M
+
+EXCEL = os.path.join(os.path.dirname(__file__), "../data/gasolineras/preciosEESS_es.xlsx")
+
+
+def cargar_estaciones(n_sintetico=12000):
+    if os.path.exists(EXCEL):
+        df = pd.read_excel(EXCEL, skiprows=3)
+        df["lat"] = df["Latitud"].str.replace(",", ".").astype(float)
+        df["lon"] = df["Longitud"].str.replace(",", ".").astype(float)
+        df["GA"] = pd.to_numeric(df["Precio gasóleo A"].str.replace(",", "."), errors="coerce")
+        return df[["lat", "lon", "GA"]].dropna(subset=["lat", "lon"]).reset_index(drop=True)
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "lat": rng.uniform(36.0, 43.8, n_sintetico),
+        "lon": rng.uniform(-9.3, 3.3, n_sintetico),
+        "GA": rng.uniform(1.2, 1.7, n_sintetico),
+    })
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    h = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * RADIO_TIERRA_M * math.asin(math.sqrt(h))
+
+
+def escaneo_dataframe(df, lat, lon, k, precio_max=None):
+    # Lo que habría que hacer hoy con el DataFrame de cada módulo
+    candidatos = df if precio_max is None else df[df["GA"] <= precio_max]
+    distancias = candidatos.apply(lambda fila: haversine(lat, lon, fila["lat"], fila["lon"]), axis=1)
+    return distancias.nsmallest(k).index.to_numpy()
+
+
+def escaneo_numpy(lat_arr, lon_arr, lat, lon, k, mascara=None):
+    p1, p2 = np.radians(lat_arr), math.radians(lat)
+    h = np.sin((p2 - p1) / 2) ** 2 + np.cos(p1) * math.cos(p2) * np.sin(np.radians(lon - lon_arr) / 2) ** 2
+    d = 2 * RADIO_TIERRA_M * np.arcsin(np.sqrt(h))
+    if mascara is not None:
+        d = np.where(mascara, d, np.inf)
+    return np.argsort(d)[:k]
+
+
+def medir(nombre, funcion, consultas):
+    inicio = time.perf_counter()
+    for lat, lon in consultas:
+        funcion(lat, lon)
+    por_consulta = (time.perf_counter() - inicio) / len(consultas) * 1000
+    print(f"{nombre:>28}: {por_consulta:9.3f} ms/consulta")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--consultas", type=int, default=500)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    df = cargar_estaciones()
+    lat_arr, lon_arr = df["lat"].to_numpy(), df["lon"].to_numpy()
+    precio_max = float(df["GA"].quantile(0.25))
+    mascara = (df["GA"] <= precio_max).to_numpy()
+    print(f"Estaciones: {len(df)}  (filtro gasóleo A <= {precio_max:.3f} €/L: {mascara.sum()})")
+
+    inicio = time.perf_counter()
+    arbol = ArbolKD(lat_arr, lon_arr)
+    print(f"Construcción del árbol: {(time.perf_counter() - inicio) * 1000:.1f} ms")
+
+    rng = np.random.default_rng(1)
+    consultas = list(zip(rng.uniform(36.5, 43.5, args.consultas), rng.uniform(-8.5, 3.0, args.consultas)))
+    for lat, lon in consultas[:50]:
+        esperado = escaneo_numpy(lat_arr, lon_arr, lat, lon, args.k)
+        assert set(arbol.cercanos(lat, lon, args.k)[0]) == set(esperado)
+
+    k = args.k
+    medir("DataFrame.apply", lambda la, lo: escaneo_dataframe(df, la, lo, k), consultas[:20])
+    medir("numpy (todos los puntos)", lambda la, lo: escaneo_numpy(lat_arr, lon_arr, la, lo, k), consultas)
+    medir("KD-tree", lambda la, lo: arbol.cercanos(la, lo, k), consultas)
+    medir("DataFrame.apply + filtro", lambda la, lo: escaneo_dataframe(df, la, lo, k, precio_max), consultas[:20])
+    medir("KD-tree + filtro", lambda la, lo: arbol.cercanos(la, lo, k, mascara=mascara), consultas)
+    medir("KD-tree radio 2 km", lambda la, lo: arbol.en_radio(la, lo, 2000), consultas)
+
+
+if __name__ == "__main__":
+    main()
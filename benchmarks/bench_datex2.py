@@ -0,0 +1,133 @@
+"""
+Compara el parser DATEX2 en streaming (modules.comun.datex2) con el parser
+basado en árbol completo que usaba electrolineras.py.
+
+    python -m benchmarks.bench_datex2 [fichero.xml] [--sitios 60000]
+
+Sin fichero se genera una publicación EnergyInfrastructure sintética de
+ámbito nacional. Para usar un fichero real, grábalo con HTTP_GRABAR_DIR.
+"""
+import argparse
+import multiprocessing as mp
+import random
+import resource
+import time
+import xml.etree.ElementTree as ET
+
+import pandas as pd
+
+NS_D3 = "http://datex2.eu/schema/3/energyInfrastructure"
+NS_FAC = "http://datex2.eu/schema/3/facilities"
+NS_LOC = "http://datex2.eu/schema/3/locationReferencing"
+
+
+def generar_publicacion(n_sitios, semilla=0):
+    rnd = random.Random(semilla)
+    partes = [
+        f'<?xml version="1.0" encoding="UTF-8"?>'
+        f'<payload xmlns:d3="{NS_D3}" xmlns:fac="{NS_FAC}" xmlns:loc="{NS_LOC}"><d3:energyInfrastructureTable>'
+    ]
+    for i in range(n_sitios):
+        # ~2 % de los sitios caen en Gipuzkoa, el resto en toda la península
+        if rnd.random() < 0.02:
+            lat, lon = rnd.uniform(43.0, 43.4), rnd.uniform(-2.6, -1.8)
+        else:
+            lat, lon = rnd.uniform(36.0, 43.8), rnd.uniform(-9.3, 3.3)
+        conectores = "".join(
+            f"<d3:connector><d3:connectorType>iec62196T2</d3:connectorType><d3:maxPowerAtSocket>{rnd.choice([7400, 22000, 50000])}</d3:maxPowerAtSocket></d3:connector>"
+            for _ in range(rnd.randint(1, 4))
+        )
+        partes.append(
+            f'<d3:energyInfrastructureSite id="S{i}">'
+            f"<fac:name>Estación {i}</fac:name>"
+            f"<fac:locationReference><loc:coordinatesForDisplay>"
+            f"<loc:latitude>{lat:.6f}</loc:latitude><loc:longitude>{lon:.6f}</loc:longitude>"
+            f"</loc:coordinatesForDisplay></fac:locationReference>"
+            f"<d3:typeOfSite>{rnd.choice(['onstreet', 'openSpace', 'other'])}</d3:typeOfSite>"
+            f"<d3:energyInfrastructureStation><d3:refillPoint>{conectores}</d3:refillPoint></d3:energyInfrastructureStation>"
+            f"</d3:energyInfrastructureSite>"
+        )
+    partes.append("</d3:energyInfrastructureTable></payload>")
+    return "".join(partes).encode("utf-8")
+
+
+def parsear_arbol(contenido):
+    # Implementación anterior de electrolineras.obtener_electrolineras
+    root = ET.fromstring(contenido)
+    ns = {"d3": NS_D3, "fac": NS_FAC, "loc": NS_LOC}
+    data = []
+    for site in root.findall(".//d3:energyInfrastructureSite", ns):
+        tipo = site.find("d3:typeOfSite", ns)
+        tipo_text = tipo.text if tipo is not None else "NO TIPO"
+        loc_ref = site.find("fac:locationReference", ns)
+        if loc_ref is None:
+            continue
+        coords = loc_ref.find("loc:coordinatesForDisplay", ns)
+        if coords is None:
+            continue
+        lat = coords.find("loc:latitude", ns)
+        lon = coords.find("loc:longitude", ns)
+        if lat is None or lon is None:
+            continue
+        try:
+            lat_val = float(lat.text)
+            lon_val = float(lon.text)
+        except (TypeError, ValueError):
+            continue
+        if not (43.0 <= lat_val <= 43.4 and -2.8 <= lon_val <= -1.7):
+            continue
+        name = site.find("fac:name", ns)
+        nombre = name.text if name is not None else "Sin nombre"
+        data.append({"nombre": nombre, "lat": lat_val, "lon": lon_val, "tipo": tipo_text})
+    return pd.DataFrame(data)
+
+
+def parsear_streaming(contenido):
+    from modules.dgt.electrolineras import parsear_electrolineras
+    return parsear_electrolineras(contenido)
+
+
+def _medir(nombre, contenido, cola):
+    funcion = {"arbol": parsear_arbol, "streaming": parsear_streaming}[nombre]
+    if nombre == "streaming":
+        # Calienta las importaciones para no medirlas
+        parsear_streaming(b"<a/>")
+    rss_antes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    inicio = time.perf_counter()
+    df = funcion(contenido)
+    duracion = time.perf_counter() - inicio
+    rss_despues = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    cola.put((nombre, duracion, (rss_despues - rss_antes) / 1024, len(df)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fichero", nargs="?")
+    parser.add_argument("--sitios", type=int, default=60000)
+    parser.add_argument("--repeticiones", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.fichero:
+        with open(args.fichero, "rb") as f:
+            contenido = f.read()
+    else:
+        contenido = generar_publicacion(args.sitios)
+    print(f"Publicación: {len(contenido) / 1e6:.1f} MB")
+
+    # Cada medición en un proceso nuevo para que el pico de memoria sea comparable
+    ctx = mp.get_context("spawn")
+    for nombre in ("arbol", "streaming"):
+        tiempos, memoria = [], []
+        for _ in range(args.repeticiones):
+            cola = ctx.Queue()
+            p = ctx.Process(target=_medir, args=(nombre, contenido, cola))
+            p.start()
+            _, duracion, mb, filas = cola.get()
+            p.join()
+            tiempos.append(duracion)
+            memoria.append(mb)
+        print(f"{nombre:>10}: {min(tiempos) * 1000:8.1f} ms  pico +{max(memoria):7.1f} MB  filas={filas}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Tiempo de carga en frío de los feeds GTFS de data/attg: read_csv con
+inferencia de tipos (lo que hacía autobuses.py), el parseo a arrays de
+modules.attg.gtfs y los feeds compilados mapeados en memoria.
+
+    python -m benchmarks.bench_gtfs [--repeticiones 5]
+
+Cada medida se hace en un proceso nuevo (sin nada en memoria del proceso
+anterior); la caché de páginas del sistema sí se conserva.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+RAIZ = os.path.join(os.path.dirname(__file__), "..")
+
+MODOS = {
+    "read_csv (inferencia)": """
+import os, pandas as pd
+from modules.attg.gtfs import almacen
+for nombre in almacen.nombres():
+    for fichero in ("routes", "trips", "stop_times", "stops", "shapes"):
+        ruta = os.path.join(almacen.base, nombre, fichero + ".txt")
+        if os.path.exists(ruta):
+            pd.read_csv(ruta)
+""",
+    "parseo a arrays": """
+from modules.attg.gtfs import AlmacenGTFS
+AlmacenGTFS(compilado=False).feeds()
+""",
+    "compilado (mmap)": """
+from modules.attg.gtfs import almacen
+almacen.feeds()
+""",
+}
+
+PLANTILLA = """
+import json, time
+inicio = time.perf_counter()
+{codigo}
+print(json.dumps((time.perf_counter() - inicio) * 1000))
+"""
+
+
+def medir(codigo, entorno):
+    # Los imports del módulo quedan fuera de la medida: se hacen antes de empezar a contar
+    preparacion = "import pandas, numpy\nimport modules.attg.gtfs\n"
+    salida = subprocess.run(
+        [sys.executable, "-c", preparacion + PLANTILLA.format(codigo=codigo)],
+        cwd=RAIZ, env=entorno, capture_output=True, text=True, check=True,
+    )
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        entorno = dict(os.environ, GTFS_COMPILADO_DIR=directorio)
+        subprocess.run([sys.executable, "-m", "modules.attg.gtfs"], cwd=RAIZ, env=entorno,
+                       check=True, stdout=subprocess.DEVNULL)
+        tamaño = sum(e.stat().st_size for e in os.scandir(directorio))
+        print(f"Feeds compilados: {tamaño / 1024 / 1024:.1f} MB")
+
+        for nombre, codigo in MODOS.items():
+            tiempos = sorted(medir(codigo, entorno) for _ in range(args.repeticiones))
+            print(f"{nombre:>22}: mediana {tiempos[len(tiempos) // 2]:8.1f} ms   mínimo {tiempos[0]:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Tiempo por consulta del planificador de viajes (modules.attg.planificador)
+sobre la red de todos los operadores ATTG: llegada más temprana entre pares
+de paradas al azar y perfiles de salida en una ventana de tres horas.
+
+    python -m benchmarks.bench_planificador [--consultas 300]
+"""
+import argparse
+import time
+from datetime import datetime
+
+import numpy as np
+
+from modules.attg import planificador
+
+
+def medir(nombre, funcion, consultas):
+    tiempos = []
+    for consulta in consultas:
+        inicio = time.perf_counter()
+        funcion(*consulta)
+        tiempos.append(time.perf_counter() - inicio)
+    tiempos = np.array(tiempos) * 1000
+    print(f"{nombre:>18}: p50 {np.percentile(tiempos, 50):7.1f} ms   p90 {np.percentile(tiempos, 90):7.1f} ms   "
+          f"máx {tiempos.max():7.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--consultas", type=int, default=300)
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    red = planificador.red()
+    print(f"Red: {len(red.c_salida)} conexiones, {red.n_paradas} paradas "
+          f"({(time.perf_counter() - inicio) * 1000:.0f} ms)")
+    dia = datetime(2025, 6, 2)
+    inicio = time.perf_counter()
+    red.conexiones(planificador.a_dia(dia.date()))
+    print(f"Conexiones del día: {(time.perf_counter() - inicio) * 1000:.1f} ms")
+
+    # Pares de paradas con horarios, a horas repartidas por el día
+    rng = np.random.default_rng(0)
+    tabla = red.tabla
+    con_salidas = np.flatnonzero(np.diff(tabla.inicio) > 0)
+    pares = rng.choice(con_salidas, (args.consultas, 2))
+    consultas = [
+        ((float(tabla.parada_lat[a]), float(tabla.parada_lon[a])),
+         (float(tabla.parada_lat[b]), float(tabla.parada_lon[b])),
+         dia.replace(hour=int(rng.integers(6, 21))))
+        for a, b in pares
+    ]
+    encontrados = sum(planificador.planificar(*c) is not None for c in consultas)
+    print(f"Consultas: {len(consultas)} ({encontrados} con itinerario)")
+
+    medir("llegada temprana", planificador.planificar, consultas)
+    medir("perfil 3 h", lambda o, d, m: planificador.perfil(o, d, m, m.replace(hour=m.hour + 3)), consultas[:100])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Acceso a los conteos de las RSU (modules.rsu.datos) contra un PostgreSQL
+local con una tabla data_bluetooth sintética:
+
+- la consulta de conteos anterior (to_timestamp en el WHERE, LIKE sin índice
+  y CROSS JOIN con generate_series en la base de datos) frente a la actual
+  (epoch sin transformar, índice parcial y huecos rellenados en el cliente),
+  comprobando que devuelven lo mismo;
+- la caché: el mismo rango otra vez (Mostrar datos y luego Descargar CSV) y
+  un subrango, que debe coincidir con consultarlo directamente.
+
+    RSU_DB_HOST=localhost RSU_DB_NAME=rsu_pruebas \\
+        python -m benchmarks.bench_rsu --usuario postgres --contraseña postgres [--sembrar] [--filas 5000000]
+
+Con --sembrar se borra y se vuelve a crear public.data_bluetooth (con los
+índices de modules.rsu.datos); solo se permite con un servidor local.
+"""
+import argparse
+import io
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import psycopg2
+
+from modules.rsu import datos
+
+LOCALES = ("localhost", "127.0.0.1", "::1")
+INICIO = date(2025, 4, 7)
+CLASES = np.array(["5a0408", "200408", "5a020c", "240404", "7a020c"])
+
+# La consulta de conteos tal y como estaba antes, con parámetros
+CONSULTA_ANTERIOR = """
+WITH intervalos AS (
+  SELECT generate_series(%(desde)s::timestamp, %(ultimo)s::timestamp, interval '5 minutes') AS intervalo_5min
+),
+rsus AS (
+  SELECT DISTINCT rsu FROM public.data_bluetooth
+),
+conteos AS (
+  SELECT
+    rsu,
+    date_trunc('hour', to_timestamp(timestamp)) +
+      interval '5 minutes' * floor(extract(minute from to_timestamp(timestamp)) / 5) AS intervalo_5min,
+    COUNT(*) AS vehiculos_contados
+  FROM
+    public.data_bluetooth
+  WHERE
+    class_of_device::text LIKE '%%0408'
+    AND to_timestamp(timestamp) BETWEEN %(desde)s AND %(hasta)s
+  GROUP BY
+    rsu, intervalo_5min
+)
+SELECT
+  r.rsu,
+  i.intervalo_5min,
+  COALESCE(c.vehiculos_contados, 0) AS vehiculos_contados
+FROM
+  rsus r
+CROSS JOIN
+  intervalos i
+LEFT JOIN
+  conteos c ON c.rsu = r.rsu AND c.intervalo_5min = i.intervalo_5min
+ORDER BY
+  r.rsu, i.intervalo_5min;
+"""
+
+
+def sembrar(usuario, contraseña, filas, rsus, dias, semilla=0):
+    """Tabla data_bluetooth con `filas` detecciones repartidas entre `rsus` RSU y `dias` días desde INICIO."""
+    rng = np.random.default_rng(semilla)
+    epoch0 = int(time.mktime(INICIO.timetuple()))
+    # Más detecciones de día que de noche
+    hora = rng.choice(24, filas, p=np.r_[np.full(6, 0.2), np.full(16, 1.0), np.full(2, 0.5)] / 17.2)
+    instantes = epoch0 + rng.integers(0, dias, filas) * 86400 + hora * 3600 + rng.integers(0, 3600, filas)
+    rsu = rng.integers(1, rsus + 1, filas)
+    clase = CLASES[rng.choice(len(CLASES), filas, p=[0.4, 0.2, 0.2, 0.1, 0.1])]
+    texto = "".join(f"RSU{r:03d}\t{t}\t{c}\n" for r, t, c in zip(rsu.tolist(), instantes.tolist(), clase.tolist()))
+
+    conn = psycopg2.connect(host=datos.DB_HOST, port=datos.DB_PORT, dbname=datos.DB_NAME,
+                            user=usuario, password=contraseña)
+    try:
+        with conn, conn.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS public.data_bluetooth")
+            cursor.execute("CREATE TABLE public.data_bluetooth (rsu text, timestamp bigint, class_of_device text)")
+            cursor.copy_expert("COPY public.data_bluetooth (rsu, timestamp, class_of_device) FROM STDIN",
+                               io.StringIO(texto))
+            for sql in datos.INDICES:
+                cursor.execute(sql)
+            cursor.execute("ANALYZE public.data_bluetooth")
+    finally:
+        conn.close()
+
+
+def anterior(usuario, contraseña, inicio, fin):
+    desde = datetime.combine(inicio, datetime.min.time())
+    hasta = datetime.combine(fin, datetime.min.time()) + timedelta(days=1)
+    parametros = {"desde": desde, "ultimo": hasta - datos.INTERVALO, "hasta": hasta - timedelta(seconds=1)}
+    return datos.consultar(usuario, contraseña, CONSULTA_ANTERIOR, parametros)
+
+
+def medir(nombre, funcion, *args):
+    inicio = time.perf_counter()
+    resultado = funcion(*args)
+    print(f"{nombre:>28}: {(time.perf_counter() - inicio) * 1000:9.1f} ms   {len(resultado)} filas")
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--usuario", required=True)
+    parser.add_argument("--contraseña", required=True)
+    parser.add_argument("--sembrar", action="store_true", help="crea la tabla sintética (borra la existente)")
+    parser.add_argument("--filas", type=int, default=2_000_000)
+    parser.add_argument("--rsus", type=int, default=20)
+    parser.add_argument("--dias", type=int, default=14)
+    args = parser.parse_args()
+
+    if args.sembrar:
+        if datos.DB_HOST not in LOCALES:
+            parser.error(f"--sembrar solo contra un servidor local (RSU_DB_HOST={datos.DB_HOST})")
+        inicio = time.perf_counter()
+        sembrar(args.usuario, args.contraseña, args.filas, args.rsus, args.dias)
+        print(f"Sembradas {args.filas} filas ({time.perf_counter() - inicio:.1f} s)")
+
+    fin = INICIO + timedelta(days=args.dias - 1)
+    sub_inicio, sub_fin = INICIO + timedelta(days=2), INICIO + timedelta(days=4)
+    credenciales = (args.usuario, args.contraseña)
+    antes = medir("consulta anterior", anterior, *credenciales, INICIO, fin)
+    datos.rsus(*credenciales)
+    ahora = medir("consulta actual", datos._conteos, *credenciales, INICIO, fin)
+    antes["intervalo_5min"] = antes["intervalo_5min"].astype(ahora["intervalo_5min"].dtype)
+    antes["vehiculos_contados"] = antes["vehiculos_contados"].astype(ahora["vehiculos_contados"].dtype)
+    print("Misma respuesta:", antes.equals(ahora))
+
+    medir("rango completo (sin caché)", datos.conteos, INICIO, fin, *credenciales)
+    medir("mismo rango (caché)", datos.conteos, INICIO, fin, *credenciales)
+    subrango = medir("subrango (caché)", datos.conteos, sub_inicio, sub_fin, *credenciales)
+    directo = medir("subrango (consulta)", datos._conteos, *credenciales, sub_inicio, sub_fin)
+    directo["intervalo_5min"] = directo["intervalo_5min"].astype(subrango["intervalo_5min"].dtype)
+    print("Subrango de la caché igual a la consulta:", subrango.equals(directo))
+
+
+if __name__ == "__main__":
+    main()
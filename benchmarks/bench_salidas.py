@@ -0,0 +1,92 @@
+"""
+Consultas de próximas salidas (modules.attg.salidas) a volumen de kiosco:
+la API de Python y el endpoint HTTP, frente a filtrar los stop_times de todos
+los feeds con pandas en cada consulta.
+
+    python -m benchmarks.bench_salidas [--consultas 5000] [--n 10]
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from modules.attg.gtfs import almacen
+from modules.attg import salidas
+
+
+def horarios_pandas():
+    # Lo que habría que cargar sin la tabla: stop_times de todos los feeds con el servicio del viaje
+    tablas = []
+    for feed in almacen.feeds():
+        por_viaje = np.diff(feed.horario_inicio)
+        viaje = np.repeat(np.arange(len(por_viaje)), por_viaje)
+        tablas.append(pd.DataFrame({
+            "operador": feed.nombre,
+            "stop_id": feed.parada_ids[np.maximum(feed.horario_parada, 0)],
+            "salida": feed.horario_salida,
+            "viaje": viaje,
+        }))
+    return pd.concat(tablas, ignore_index=True)
+
+
+def consulta_pandas(df, operador, stop_id, momento, n):
+    feed = almacen.feed(operador)
+    activos = feed.viajes_activos(momento.date())
+    t = momento.hour * 3600 + momento.minute * 60
+    filas = df[(df["operador"] == operador) & (df["stop_id"] == stop_id) & (df["salida"] >= t)]
+    filas = filas[activos[filas["viaje"].to_numpy()]]
+    return filas.nsmallest(n, "salida")
+
+
+def medir(nombre, funcion, consultas):
+    tiempos = []
+    for consulta in consultas:
+        inicio = time.perf_counter()
+        funcion(*consulta)
+        tiempos.append(time.perf_counter() - inicio)
+    tiempos = np.array(tiempos) * 1000
+    print(f"{nombre:>18}: {len(consultas) / tiempos.sum() * 1000 * 60:10.0f} consultas/min   "
+          f"p50 {np.percentile(tiempos, 50):7.3f} ms   p99 {np.percentile(tiempos, 99):7.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--consultas", type=int, default=5000)
+    parser.add_argument("--n", type=int, default=10)
+    args = parser.parse_args()
+
+    almacen.feeds()
+    inicio = time.perf_counter()
+    tabla = salidas.tabla()
+    print(f"Tabla de salidas: {len(tabla.salida)} salidas en {len(tabla.parada_ids)} paradas "
+          f"({(time.perf_counter() - inicio) * 1000:.1f} ms)")
+
+    # Paradas con salidas, a horas repartidas por un día laborable
+    rng = np.random.default_rng(0)
+    con_salidas = np.flatnonzero(np.diff(tabla.inicio) > 0)
+    paradas = rng.choice(con_salidas, args.consultas)
+    base = datetime(2025, 6, 2)
+    consultas = [
+        (tabla.feeds[tabla.parada_feed[p]].nombre, str(tabla.parada_ids[p]),
+         base + timedelta(seconds=int(rng.integers(5 * 3600, 23 * 3600))), args.n)
+        for p in paradas
+    ]
+
+    df = horarios_pandas()
+    medir("pandas", lambda o, s, m, n: consulta_pandas(df, o, s, m, n), consultas[:200])
+    medir("API", lambda o, s, m, n: salidas.proximas_salidas(o, s, m, n, radio=0), consultas)
+    medir("API (75 m)", salidas.proximas_salidas, consultas)
+
+    from flask import Flask
+    servidor = Flask(__name__)
+    salidas.registrar_rutas(servidor)
+    cliente = servidor.test_client()
+    medir("HTTP", lambda o, s, m, n: cliente.get(
+        salidas.PREFIJO, query_string={"operador": o, "parada": s, "momento": m.isoformat(), "n": n}
+    ), consultas)
+
+
+if __name__ == "__main__":
+    main()
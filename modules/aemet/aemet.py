@@ -3,10 +3,17 @@ import dash
 from dash import dcc, html, Input, Output
 import pandas as pd
 import folium
-import requests
 import json
-import time
 from branca.element import Figure
+from modules.comun.cache_mapas import cachear_mapa
+from modules.comun.sondeo import sondeador
+from modules.comun.cliente_http import cliente
+from modules.comun.capa_puntos import CapaPuntos
+from modules.comun.capas import registrar_capa
+
+RUTA = "/mapa/estaciones"
+# Los datos son en tiempo real: el layout se reconstruye en cada visita
+CACHEAR_LAYOUT = False
 
 ruta_ubicacion = os.path.join(os.path.dirname(__file__), "../../data/aemet/ubicacion.txt")
 
@@ -67,16 +74,19 @@ def obtener_datos_estaciones():
     headers = {"api_key": API_KEY}
     
     try:
-        response_url = requests.get(url_api_todas, headers=headers, timeout=15) 
-        response_url.raise_for_status()
+        # La API devuelve una URL de datos distinta en cada llamada: sin revalidación.
+        # Los reintentos con espera (p. ej. ante un 429) los gestiona el cliente.
+        response_url = cliente.get(url_api_todas, headers=headers, condicional=False)
+        if response_url.estado != 200:
+            raise ValueError(f"HTTP {response_url.estado}")
         r_url = response_url.json()
         datos_obs_url = r_url.get("datos")
         if not datos_obs_url:
             print("No se obtuvo URL de datos de la API.")
             return pd.DataFrame()
-        time.sleep(0.5)
-        response_obs = requests.get(datos_obs_url, timeout=30)
-        response_obs.raise_for_status()
+        response_obs = cliente.get(datos_obs_url, condicional=False)
+        if response_obs.estado != 200:
+            raise ValueError(f"HTTP {response_obs.estado}")
         all_observations = response_obs.json()
     except Exception as e:
         print(f"Error al obtener datos de AEMET: {e}")
@@ -118,13 +128,17 @@ def obtener_datos_estaciones():
             "pres": ultima_obs.get("pres", "nd"),
             "hum": ultima_obs.get("hr", "nd"),
         })
-        time.sleep(0.1)
 
     print("\n--- Fin de obtención de datos ---")
     return pd.DataFrame(datos)
 
+sondeador.registrar("aemet", obtener_datos_estaciones, intervalo=5 * 60)
+registrar_capa("aemet", lambda: sondeador.leer("aemet"), version=lambda: sondeador.version("aemet"))
+
+# Las observaciones se piden a /api/layers/aemet: el mapa solo cambia al pasar de sin datos a con datos
+@cachear_mapa("aemet", version=lambda: sondeador.version("aemet") is not None)
 def generar_mapa():
-    df = obtener_datos_estaciones()
+    df = sondeador.leer("aemet", por_defecto=pd.DataFrame(), espera=10)
     fig = Figure(width=1000, height=800)
     m = folium.Map(location=[43.3183, -1.9812], zoom_start=9)
     fig.add_child(m)
@@ -137,24 +151,21 @@ def generar_mapa():
             icon=folium.Icon(color="blue", icon="info", prefix='fa')
         ).add_to(m)
     else:
-        for _, row in df.iterrows():
-            popup = f"""
-            <b>{row['nombre']}</b><br>
-            Altitud: {row['altitud']} m<br>
-            Fecha: {row['fecha']}<br><br>
-            🌡 Temp: {row['t']} °C<br>
-            💨 Viento: {row['v']} km/h<br>
-            🌬 Racha: {row['r']} km/h<br>
-            🌧 Precip.: {row['prec']} mm<br>
-            📈 Presión: {row['pres']} hPa<br>
-            💧 Humedad: {row['hum']} %
-            """
-            folium.Marker(
-                location=[row["lat"], row["lon"]],
-                tooltip=row["nombre"],
-                popup=folium.Popup(popup, max_width=250),
-                icon=folium.Icon(color="red", icon="cloud", prefix='fa')
-            ).add_to(m)
+        popup = """
+        <b>{nombre}</b><br>
+        Altitud: {altitud} m<br>
+        Fecha: {fecha}<br><br>
+        🌡 Temp: {t} °C<br>
+        💨 Viento: {v} km/h<br>
+        🌬 Racha: {r} km/h<br>
+        🌧 Precip.: {prec} mm<br>
+        📈 Presión: {pres} hPa<br>
+        💧 Humedad: {hum} %
+        """
+        CapaPuntos(
+            capa="aemet", popup=popup, tooltip="{nombre}", ancho_popup=250,
+            color="red", icono="cloud", prefijo="fa", refresco=5 * 60
+        ).add_to(m)
     return m.get_root().render()
 
 
@@ -198,7 +209,7 @@ def layout():
             children=[
                 html.Iframe(
                     id='mapa',
-                    srcDoc=generar_mapa(),
+                    src=generar_mapa.url(),
                     width='100%',
                     height='1000px',
                     style={'border': 'none'}
@@ -215,9 +226,9 @@ def layout():
 
 def registrar_callbacks(app):
     @app.callback(
-        Output('mapa', 'srcDoc'),
+        Output('mapa', 'src'),
         Input('interval-component', 'n_intervals')
     )
     def update_map_live(n_intervals):
         print(f"\n--- Actualizando mapa (intervalo: {n_intervals}) ---")
-        return generar_mapa()
+        return generar_mapa.url()
@@ -1,11 +1,38 @@
-from dash import dcc, html, Output, Input
+from datetime import date, datetime
+from dash import dcc, html, Output, Input, State
+import numpy as np
 import pandas as pd
-import os
 import folium
-from branca.element import Figure
+from branca.element import Figure, MacroElement
+from jinja2 import Template
+from html import escape as html_escape
+from urllib.parse import quote
+from modules.comun.cache_mapas import cachear_mapa
+from modules.comun.artefactos import publicar
+from modules.comun.capa_puntos import CapaPuntos, json_script
+from modules.comun.capas import registrar_capa
+from modules.attg.gtfs import almacen
+from modules.attg.salidas import PREFIJO as PREFIJO_SALIDAS, ahora
+from modules.attg import isocronas, planificador
+from modules.attg.frecuencias import TIPOS_DIA, frecuencias
+from modules.attg.red_provincial import red_provincial
 
-BASE_PATH = os.path.join(os.path.dirname(__file__), "../../data/attg")
-carpetas = [d for d in os.listdir(BASE_PATH) if d.startswith("l_") or d == "dbus"]
+RUTA = "/mapa/autobuses"
+carpetas = almacen.nombres()
+
+def cargar_paradas():
+    paradas = [feed.paradas().assign(localidad=feed.nombre) for feed in almacen.feeds()]
+    return pd.concat(paradas, ignore_index=True) if paradas else pd.DataFrame()
+
+registrar_capa(
+    "paradas",
+    cargar_paradas,
+    # Firmas de los feeds ya cargados: solo se vuelven a comprobar cada COMPROBAR_CADA segundos
+    version=lambda: tuple(f.firma for f in almacen.feeds()),
+    lat="stop_lat",
+    lon="stop_lon",
+    zoom_min=13,
+)
 
 layout = html.Div(style={
     'margin': '0',
@@ -47,7 +74,12 @@ layout = html.Div(style={
             "marginTop": "15px",
         }
     ),
+        html.Label("Buscar parada:", style={'fontWeight': 'bold'}),
+        dcc.Dropdown(id='buscar-parada', placeholder="Nombre de la parada, de cualquier operador",
+                     style={'marginBottom': '10px'}),
         html.Label("Localidad:", style={'fontWeight': 'bold'}),
+        html.Button("Ver toda la red de Gipuzkoa", id='btn-red', n_clicks=0, style={'marginBottom': '10px'}),
+        html.Br(),
         dcc.Dropdown(
             id='dropdown-localidad',
             options=[{'label': carpeta, 'value': carpeta} for carpeta in carpetas],
@@ -58,6 +90,28 @@ layout = html.Div(style={
         dcc.Dropdown(id='dropdown-linea'),
         html.Label("Dirección:", style={'fontWeight': 'bold'}),
         dcc.Dropdown(id='dropdown-direccion'),
+        html.Label("Fecha:", style={'fontWeight': 'bold'}),
+        # Sin fecha se usa la del día (el layout puede quedar cacheado de un día para otro)
+        dcc.DatePickerSingle(id='fecha-autobuses', placeholder="Hoy", display_format="DD/MM/YYYY",
+                             first_day_of_week=1, clearable=True, style={'display': 'block'}),
+        html.Details([
+            html.Summary("Planificar viaje", style={'fontWeight': 'bold', 'cursor': 'pointer', 'marginTop': '10px'}),
+            html.Label("Origen:"),
+            dcc.Dropdown(id='itinerario-origen', placeholder="Escribe el nombre de la parada"),
+            html.Label("Destino:"),
+            dcc.Dropdown(id='itinerario-destino', placeholder="Escribe el nombre de la parada"),
+            html.Label("Hora de salida (vacío: ahora):"),
+            dcc.Input(id='itinerario-hora', type='time', style={'display': 'block', 'marginBottom': '8px'}),
+            html.Button("Buscar itinerario", id='btn-itinerario', n_clicks=0),
+        ]),
+        html.Details([
+            html.Summary("Isócronas", style={'fontWeight': 'bold', 'cursor': 'pointer', 'marginTop': '10px'}),
+            html.P("Zonas a las que se llega en autobús y a pie en 15, 30 y 45 minutos desde el punto del mapa "
+                   "en el que hagas clic.", style={'fontSize': '13px', 'margin': '4px 0'}),
+            html.Label("Hora de salida (vacío: ahora):"),
+            dcc.Input(id='isocronas-hora', type='time', style={'display': 'block', 'marginBottom': '8px'}),
+            html.Button("Mostrar mapa de isócronas", id='btn-isocronas', n_clicks=0),
+        ]),
     ], style={
         'position': 'absolute',
         'top': '20px',
@@ -80,6 +134,254 @@ layout = html.Div(style={
     })
 ])
 
+@cachear_mapa("autobuses", version=lambda localidad, linea, direccion, fecha: almacen.feed(localidad).firma)
+def generar_mapa_ruta(localidad, linea, direccion, fecha):
+    feed = almacen.feed(localidad)
+    viajes = feed.viajes(linea, direccion)
+    if len(viajes) == 0:
+        return "<p>No hay datos para esa línea y dirección.</p>"
+
+    # Se muestra el recorrido habitual de los viajes que circulan en la fecha;
+    # si ese día no hay servicio, el del día más próximo que sí lo tenga
+    aviso = None
+    viaje = feed.viaje_representativo(linea, direccion, fecha)
+    if viaje is None:
+        alternativa = feed.fecha_con_servicio(fecha, viajes)
+        if alternativa is None:
+            aviso = f"Sin servicio en el calendario el {date.fromisoformat(fecha):%d/%m/%Y}."
+            viaje = int(viajes[0])
+        else:
+            aviso = (f"Sin servicio el {date.fromisoformat(fecha):%d/%m/%Y}: "
+                     f"se muestra el recorrido del {alternativa:%d/%m/%Y}.")
+            viaje = feed.viaje_representativo(linea, direccion, alternativa)
+    lat, lon = feed.forma_viaje(viaje)
+    lat_lon_shape = list(zip(np.round(lat.astype(float), 6).tolist(), np.round(lon.astype(float), 6).tolist()))
+    codigos = feed.paradas_viaje(viaje)
+    # Sin stop_times.txt no se sabe qué paradas sirve el viaje: se muestran las del operador
+    stops_df = feed.paradas(codigos) if len(codigos) else feed.paradas()
+
+    centro_mapa = lat_lon_shape[len(lat_lon_shape)//2] if lat_lon_shape else (43.3, -1.98)
+    fig = Figure(width=1000, height=800)
+    m = folium.Map(location=centro_mapa, zoom_start=13)
+    fig.add_child(m)
+
+    if lat_lon_shape:
+        folium.PolyLine(lat_lon_shape, color="blue", weight=5, opacity=0.8).add_to(m)
+
+    # Al abrir una parada se piden sus próximas salidas (de todos los operadores) para la fecha del mapa
+    CapaPuntos(
+        stops_df.drop_duplicates("stop_id"), tooltip="{stop_name}", lat="stop_lat", lon="stop_lon",
+        color="green", icono="bus", prefijo="fa",
+        popup_url=f"{PREFIJO_SALIDAS}?operador={quote(localidad)}&parada={{stop_id}}&nombre={{stop_name}}"
+                  f"&fecha={fecha}&formato=html",
+    ).add_to(m)
+
+    if aviso:
+        m.get_root().html.add_child(folium.Element(
+            '<div style="position: fixed; bottom: 20px; left: 20px; z-index: 1000; background: #fff3cd; '
+            'padding: 8px 12px; border-radius: 6px; box-shadow: 0 2px 6px rgba(0,0,0,0.2); '
+            f'font-family: Arial, sans-serif; font-size: 14px;">{html_escape(aviso)}</div>'
+        ))
+
+    return m.get_root().render()
+
+COLORES_TRAMOS = ["#007BFF", "#E8590C", "#2B8A3E", "#862E9C", "#C92A2A"]
+
+
+def buscar_paradas(texto, limite=30):
+    """Opciones de parada (de cualquier operador) con alguna palabra del nombre que empieza por `texto`."""
+    if len((texto or "").strip()) < 2:
+        return []
+    opciones = []
+    for parada in almacen.buscar_paradas(texto, limite):
+        rutas = f" · {', '.join(parada['rutas'])}" if parada["rutas"] else ""
+        opciones.append({"label": f"{parada['stop_name']} ({parada['operador']}){rutas}",
+                         "value": f"{parada['operador']}:{parada['stop_id']}"})
+    return opciones
+
+
+@cachear_mapa("parada", version=lambda valor: almacen.feed(valor.split(":", 1)[0]).firma)
+def generar_mapa_parada(valor):
+    operador, stop_id = valor.split(":", 1)
+    feed = almacen.feed(operador)
+    codigo = np.flatnonzero(feed.parada_ids == stop_id)
+    if len(codigo) == 0:
+        return "<p>No se ha encontrado la parada.</p>"
+    parada = feed.paradas(codigo[:1]).assign(
+        rutas=", ".join(str(feed.ruta_nombre[r]) for r in feed.rutas_parada(int(codigo[0])).tolist()) or "-"
+    )
+    fig = Figure(width=1000, height=800)
+    m = folium.Map(location=(float(parada["stop_lat"].iloc[0]), float(parada["stop_lon"].iloc[0])), zoom_start=17)
+    fig.add_child(m)
+    CapaPuntos(
+        parada, tooltip="<b>{stop_name}</b><br>{rutas}", lat="stop_lat", lon="stop_lon",
+        color="green", icono="bus", prefijo="fa",
+        popup_url=f"{PREFIJO_SALIDAS}?operador={quote(operador)}&parada={{stop_id}}&nombre={{stop_name}}&formato=html",
+    ).add_to(m)
+    return m.get_root().render()
+
+
+@cachear_mapa("itinerario", version=lambda origen, destino, momento: planificador.red().tabla.firma)
+def generar_mapa_itinerario(origen, destino, momento):
+    itinerario = planificador.planificar(
+        planificador.leer_extremo(origen), planificador.leer_extremo(destino), datetime.fromisoformat(momento)
+    )
+    if itinerario is None:
+        return "<p>No hay ningún itinerario en autobús entre esas paradas ese día a partir de esa hora.</p>"
+
+    fig = Figure(width=1000, height=800)
+    m = folium.Map(location=itinerario["tramos"][0]["puntos"][0], zoom_start=12)
+    fig.add_child(m)
+    puntos, lineas, color = [], [], 0
+    for tramo in itinerario["tramos"]:
+        puntos.extend(tramo["puntos"])
+        salida = tramo["desde"]["hora"][11:16]
+        if tramo["tipo"] == "bus":
+            folium.PolyLine(tramo["puntos"], color=COLORES_TRAMOS[color % len(COLORES_TRAMOS)], weight=6, opacity=0.85,
+                            tooltip=f"{tramo['linea']} → {tramo['destino']}").add_to(m)
+            folium.Marker(tramo["puntos"][0], tooltip=f"{salida} {tramo['desde']['nombre']}",
+                          icon=folium.Icon(color="blue", icon="bus", prefix="fa")).add_to(m)
+            lineas.append(f"<b>{salida}</b> 🚌 {html_escape(tramo['linea'])}<br>"
+                          f"&nbsp;&nbsp;{html_escape(tramo['desde']['nombre'])} → {html_escape(tramo['hasta']['nombre'])}")
+            color += 1
+        else:
+            folium.PolyLine(tramo["puntos"], color="gray", weight=3, dash_array="6 8").add_to(m)
+            lineas.append(f"<b>{salida}</b> 🚶 {round(tramo['segundos'] / 60)} min a pie")
+    folium.Marker(puntos[-1], tooltip=f"Llegada {itinerario['llegada'][11:16]}",
+                  icon=folium.Icon(color="red", icon="flag", prefix="fa")).add_to(m)
+    m.fit_bounds([[min(p[0] for p in puntos), min(p[1] for p in puntos)],
+                  [max(p[0] for p in puntos), max(p[1] for p in puntos)]])
+
+    resumen = (f"<b>{itinerario['salida'][11:16]} → {itinerario['llegada'][11:16]}</b> "
+               f"({itinerario['minutos']} min, {itinerario['transbordos']} transbordos)<br>" + "<br>".join(lineas))
+    m.get_root().html.add_child(folium.Element(
+        '<div style="position: fixed; bottom: 20px; left: 20px; z-index: 1000; background: white; '
+        'padding: 8px 12px; border-radius: 6px; box-shadow: 0 2px 6px rgba(0,0,0,0.2); max-width: 420px; '
+        f'font-family: Arial, sans-serif; font-size: 13px;">{resumen}</div>'
+    ))
+    return m.get_root().render()
+
+
+@cachear_mapa("red_autobuses", version=lambda: almacen.version())
+def generar_mapa_red():
+    paradas, lineas = red_provincial()
+    fig = Figure(width=1000, height=800)
+    m = folium.Map(location=(43.2, -2.1), zoom_start=10)
+    fig.add_child(m)
+    folium.GeoJson(lineas, name="Recorridos",
+                   style_function=lambda f: {"color": "#0B5394", "weight": 3, "opacity": 0.8}).add_to(m)
+    _, tramos = frecuencias()
+    for tipo in TIPOS_DIA:
+        capa_frecuencias(tramos[tramos["tipo_dia"] == tipo], tipo).add_to(m)
+    # Paradas ya agrupadas entre operadores; al abrirlas, próximas salidas de todas ellas
+    CapaPuntos(
+        paradas, tooltip="{nombre}", popup="<b>{nombre}</b><br>{operadores}<br>Cargando salidas…",
+        popup_url=f"{PREFIJO_SALIDAS}?lat={{lat}}&lon={{lon}}&formato=html",
+        color="green", icono="bus", prefijo="fa", agrupar=True,
+    ).add_to(m)
+    folium.LayerControl(collapsed=False).add_to(m)
+    return m.get_root().render()
+
+
+# (salidas por hora desde, color, grosor) de la capa de frecuencias
+ESCALA_FRECUENCIAS = ((0, "#FEE5D9", 2), (1, "#FCAE91", 3), (2, "#FB6A4A", 4), (4, "#DE2D26", 6), (8, "#A50F15", 8))
+
+
+def _estilo_frecuencia(por_hora):
+    for desde, color, grosor in reversed(ESCALA_FRECUENCIAS):
+        if por_hora >= desde:
+            return {"color": color, "weight": grosor, "opacity": 0.9}
+
+
+def capa_frecuencias(tramos, tipo):
+    """Tramos entre paradas coloreados y con grosor según las salidas por hora (oculta salvo la de laborables)."""
+    features = [{
+        "type": "Feature",
+        "properties": {
+            "operador": t.operador, "salidas": int(t.salidas), "por_hora": float(t.por_hora),
+            "intervalo": "" if pd.isna(t.intervalo_min) else f"{t.intervalo_min:g} min",
+            "horario": f"{t.primera}–{t.ultima}", "fecha": t.fecha,
+        },
+        "geometry": {"type": "LineString",
+                     "coordinates": [[t.lon_desde, t.lat_desde], [t.lon_hasta, t.lat_hasta]]},
+    } for t in tramos.sort_values("por_hora").itertuples()]
+    # La fecha común del tipo de día es la de la mayoría de los tramos; la de cada tramo va en su tooltip
+    fecha = tramos["fecha"].mode().iloc[0] if len(tramos) else "-"
+    grupo = folium.FeatureGroup(name=f"Frecuencia ({tipo}, {fecha})", show=tipo == "laborable")
+    if features:
+        folium.GeoJson(
+            {"type": "FeatureCollection", "features": features},
+            style_function=lambda f: _estilo_frecuencia(f["properties"]["por_hora"]),
+            tooltip=folium.GeoJsonTooltip(
+                fields=["operador", "fecha", "salidas", "por_hora", "intervalo", "horario"],
+                aliases=["Operador", "Fecha", "Salidas", "Por hora", "Intervalo medio", "Horario"],
+            ),
+        ).add_to(grupo)
+    return grupo
+
+
+COLORES_ISOCRONAS = {15: "#1A9850", 30: "#FEE08B", 45: "#F46D43"}
+
+
+class CapaIsocronas(MacroElement):
+    """
+    Isócronas del punto en el que se hace clic: se piden a /api/isocronas y
+    se dibujan como una sola capa GeoJSON (un MultiPolygon por banda).
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = (function() {
+            var o = {{ this.opciones }};
+            var mapa = {{ this._parent.get_name() }};
+            var capa = null, marcador = null, peticion = 0;
+            mapa.on("click", function(e) {
+                var actual = ++peticion;
+                if (marcador) mapa.removeLayer(marcador);
+                marcador = L.marker(e.latlng).addTo(mapa).bindTooltip("Calculando…").openTooltip();
+                fetch(o.url + "?lat=" + e.latlng.lat.toFixed(5) + "&lon=" + e.latlng.lng.toFixed(5) +
+                      "&momento=" + encodeURIComponent(o.momento))
+                    .then(function(r) { return r.json(); })
+                    .then(function(datos) {
+                        if (actual !== peticion) return;
+                        if (capa) mapa.removeLayer(capa);
+                        capa = L.geoJSON(datos, {style: function(f) {
+                            return {stroke: false, fillColor: o.colores[f.properties.minutos] || "#999999", fillOpacity: 0.5};
+                        }}).addTo(mapa);
+                        marcador.setTooltipContent(datos.paradas + " paradas alcanzables");
+                    });
+            });
+            return mapa;
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, momento):
+        super().__init__()
+        self._name = "CapaIsocronas"
+        self.opciones = json_script({"url": isocronas.PREFIJO, "momento": momento, "colores": COLORES_ISOCRONAS})
+
+
+@cachear_mapa("isocronas")
+def generar_mapa_isocronas(momento):
+    fig = Figure(width=1000, height=800)
+    m = folium.Map(location=(43.2, -2.1), zoom_start=11)
+    fig.add_child(m)
+    CapaIsocronas(momento).add_to(m)
+    bandas = "".join(
+        f'<div><span style="display: inline-block; width: 14px; height: 14px; margin-right: 6px; '
+        f'background: {color}; opacity: 0.7;"></span>{minutos} min</div>'
+        for minutos, color in COLORES_ISOCRONAS.items()
+    )
+    m.get_root().html.add_child(folium.Element(
+        '<div style="position: fixed; bottom: 20px; left: 20px; z-index: 1000; background: white; '
+        'padding: 8px 12px; border-radius: 6px; box-shadow: 0 2px 6px rgba(0,0,0,0.2); '
+        f'font-family: Arial, sans-serif; font-size: 13px;"><b>Salida {datetime.fromisoformat(momento):%d/%m/%Y %H:%M}</b>'
+        f'<br>Haz clic en el mapa para elegir el origen{bandas}</div>'
+    ))
+    return m.get_root().render()
+
+
 def register_callbacks(app):
     @app.callback(
         Output('dropdown-linea', 'options'),
@@ -87,12 +389,11 @@ def register_callbacks(app):
         Input('dropdown-localidad', 'value')
     )
     def actualizar_lineas(localidad):
-        ruta = os.path.join(BASE_PATH, localidad, 'routes.txt')
-        if os.path.exists(ruta):
-            df = pd.read_csv(ruta)
-            opciones = [{'label': f"{row['route_short_name']} - {row['route_long_name']}", 'value': row['route_id']} for _, row in df.iterrows()]
-            return opciones, opciones[0]['value'] if opciones else None
-        return [], None
+        try:
+            opciones = almacen.feed(localidad).opciones_lineas
+        except KeyError:
+            return [], None
+        return opciones, opciones[0]['value'] if opciones else None
     @app.callback(
         Output('dropdown-direccion', 'options'),
         Output('dropdown-direccion', 'value'),
@@ -102,16 +403,12 @@ def register_callbacks(app):
     def actualizar_direcciones(localidad, linea):
         if not linea:
             return [], None
-        ruta_base = os.path.join(BASE_PATH, localidad)
-        trips_path = os.path.join(ruta_base, "trips.txt")
-        if not os.path.exists(trips_path):
+        try:
+            direcciones_unicas = almacen.feed(localidad).direcciones(str(linea))
+        except KeyError:
             return [], None
-
-        trips = pd.read_csv(trips_path)
-        trips_filtrados = trips[trips['route_id'] == int(linea)]
-        direcciones_unicas = trips_filtrados['direction_id'].dropna().unique()
         opciones = []
-        for d in sorted(direcciones_unicas):
+        for d in direcciones_unicas:
             if int(d) == 0:
                 label = "Dirección Ida"
             elif int(d) == 1:
@@ -126,58 +423,96 @@ def register_callbacks(app):
             return [{'label': 'Dirección Ida', 'value': 0}], 0
 
     @app.callback(
-        Output('mapa', 'srcDoc'),
+        Output('mapa', 'src'),
         Input('dropdown-localidad', 'value'),
         Input('dropdown-linea', 'value'),
-        Input('dropdown-direccion', 'value')
+        Input('dropdown-direccion', 'value'),
+        Input('fecha-autobuses', 'date')
     )
-    def actualizar_mapa(localidad, linea, direccion):
+    def actualizar_mapa(localidad, linea, direccion, fecha):
         if not linea or direccion is None:
-            return ""
-
-        ruta_base = os.path.join(BASE_PATH, localidad)
+            return "about:blank"
 
         try:
-            routes = pd.read_csv(os.path.join(ruta_base, "routes.txt"))
-            trips = pd.read_csv(os.path.join(ruta_base, "trips.txt"))
-            stop_times = pd.read_csv(os.path.join(ruta_base, "stop_times.txt"))
-            stops = pd.read_csv(os.path.join(ruta_base, "stops.txt"))
-            shapes = pd.read_csv(os.path.join(ruta_base, "shapes.txt"))
-
-            trips_filtrados = trips[(trips['route_id'] == int(linea)) & (trips['direction_id'] == int(direccion))]
-            if trips_filtrados.empty:
-                return "<p>No hay datos para esa línea y dirección.</p>"
-
-            trip_id = trips_filtrados.iloc[0]['trip_id']
-            shape_id = trips_filtrados.iloc[0]['shape_id']
-
-            shape_df = shapes[shapes['shape_id'] == shape_id].sort_values("shape_pt_sequence")
-            lat_lon_shape = list(zip(shape_df["shape_pt_lat"], shape_df["shape_pt_lon"]))
-
-            stop_times_df = stop_times[stop_times["trip_id"] == trip_id]
-            stop_ids = stop_times_df["stop_id"].unique()
-            stops_df = stops[stops["stop_id"].isin(stop_ids)]
+            fecha = date.fromisoformat(fecha[:10]) if fecha else date.today()
+            return generar_mapa_ruta.url(localidad, str(linea), int(direccion), fecha.isoformat())
+        except Exception as e:
+            return publicar(f"<p>Error cargando el mapa: {str(e)}</p>")
 
-            centro_mapa = lat_lon_shape[len(lat_lon_shape)//2] if lat_lon_shape else (43.3, -1.98)
-            fig = Figure(width=1000, height=800)
-            m = folium.Map(location=centro_mapa, zoom_start=13)
-            fig.add_child(m)
+    for extremo in ('buscar-parada', 'itinerario-origen', 'itinerario-destino'):
+        @app.callback(
+            Output(extremo, 'options'),
+            Input(extremo, 'search_value'),
+            State(extremo, 'value'),
+            State(extremo, 'options'),
+        )
+        def actualizar_paradas(texto, valor, opciones):
+            # Se conserva la opción elegida aunque ya no coincida con lo escrito
+            elegida = [o for o in opciones or [] if o['value'] == valor]
+            return elegida + [o for o in buscar_paradas(texto) if o['value'] != valor]
 
-            if lat_lon_shape:
-                folium.PolyLine(lat_lon_shape, color="blue", weight=5, opacity=0.8).add_to(m)
+    @app.callback(
+        Output('mapa', 'src', allow_duplicate=True),
+        Input('buscar-parada', 'value'),
+        prevent_initial_call=True,
+    )
+    def mostrar_parada(valor):
+        if not valor:
+            return "about:blank"
+        try:
+            return generar_mapa_parada.url(valor)
+        except Exception as e:
+            return publicar(f"<p>Error cargando la parada: {str(e)}</p>")
 
-            for _, stop in stops_df.iterrows():
-                folium.Marker(
-                    location=[stop["stop_lat"], stop["stop_lon"]],
-                    tooltip=stop["stop_name"],
-                    icon=folium.Icon(color='green', icon='bus', prefix='fa')
-                ).add_to(m)
+    @app.callback(
+        Output('mapa', 'src', allow_duplicate=True),
+        Input('btn-itinerario', 'n_clicks'),
+        State('itinerario-origen', 'value'),
+        State('itinerario-destino', 'value'),
+        State('fecha-autobuses', 'date'),
+        State('itinerario-hora', 'value'),
+        prevent_initial_call=True,
+    )
+    def mostrar_itinerario(n_clicks, origen, destino, fecha, hora):
+        if not origen or not destino:
+            return publicar("<p>Elige una parada de origen y otra de destino.</p>")
+        try:
+            momento = ahora().replace(second=0, microsecond=0)
+            if fecha:
+                momento = datetime.combine(date.fromisoformat(fecha[:10]), momento.time())
+            if hora:
+                momento = datetime.combine(momento.date(), datetime.strptime(hora[:5], "%H:%M").time())
+            return generar_mapa_itinerario.url(origen, destino, momento.isoformat())
+        except Exception as e:
+            return publicar(f"<p>Error calculando el itinerario: {str(e)}</p>")
 
-            return m.get_root().render()
+    @app.callback(
+        Output('mapa', 'src', allow_duplicate=True),
+        Input('btn-isocronas', 'n_clicks'),
+        State('fecha-autobuses', 'date'),
+        State('isocronas-hora', 'value'),
+        prevent_initial_call=True,
+    )
+    def mostrar_isocronas(n_clicks, fecha, hora):
+        try:
+            momento = ahora().replace(second=0, microsecond=0)
+            # Misma granularidad que la caché de isócronas: un mapa por tramo de minutos
+            momento = momento.replace(minute=momento.minute - momento.minute % isocronas.TRAMO_MINUTOS)
+            if fecha:
+                momento = datetime.combine(date.fromisoformat(fecha[:10]), momento.time())
+            if hora:
+                momento = datetime.combine(momento.date(), datetime.strptime(hora[:5], "%H:%M").time())
+            return generar_mapa_isocronas.url(momento.isoformat())
+        except Exception as e:
+            return publicar(f"<p>Error cargando el mapa de isócronas: {str(e)}</p>")
 
+    @app.callback(
+        Output('mapa', 'src', allow_duplicate=True),
+        Input('btn-red', 'n_clicks'),
+        prevent_initial_call=True,
+    )
+    def mostrar_red(n_clicks):
+        try:
+            return generar_mapa_red.url()
         except Exception as e:
-            return f"<p>Error cargando el mapa: {str(e)}</p>"
-        
-def layout_fn(app):
-    register_callbacks(app)
-    return layout
+            return publicar(f"<p>Error cargando la red de autobuses: {str(e)}</p>")
@@ -0,0 +1,272 @@
+"""
+Frecuencias de paso por parada y por tramo entre paradas consecutivas.
+
+Las fechas de los tres tipos de día (laborable, sábado, domingo) salen de
+una misma semana de referencia, común a todos los feeds:
+
+- Días típicos de un feed: los de cada tipo con al menos la mediana de viajes
+  de ese tipo, lo que deja fuera festivos y días con servicio reducido. Las
+  vísperas de VISPERAS (24 y 31 de diciembre, 5 de enero) no cuentan nunca.
+- Semana de referencia (de lunes a domingo, sin vísperas): la que tiene más
+  pares (feed, tipo de día con servicio regular en el feed) con algún día
+  típico en ella; a igualdad, la más reciente. Se puede fijar con FRECUENCIAS_SEMANA (una fecha de esa semana,
+  YYYY-MM-DD) o con --semana.
+- En esa semana, el sábado, el domingo y, como laborable, el día típico en
+  más feeds (a igualdad, el más cercano al miércoles).
+
+Un feed en el que la fecha común de un tipo no es típica (fuera de su
+calendario, festivo local...) usa su día típico más reciente de ese tipo; la
+fecha de cada fila queda en la columna `fecha`.
+Sobre los arrays de stop_times de los viajes que circulan ese día se calcula
+por parada y por tramo: salidas, salidas por hora de servicio, máximo en una
+hora, intervalo medio y primera y última salida. Todo se agrupa con
+ordenaciones y bincount, sin recorrer filas.
+
+La tabla se guarda comprimida en ARTEFACTOS_DIR con la versión de los feeds
+en el nombre; se regenera al cambiar algún feed o con
+
+    python -m modules.attg.frecuencias [--semana 2025-06-02]
+"""
+import argparse
+import hashlib
+import io
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from modules.attg.gtfs import a_dia, almacen, de_dia
+from modules.comun.artefactos import ARTEFACTOS_DIR, escribir_atomico
+
+# Días de la semana (lunes = 0) de cada tipo de día
+TIPOS_DIA = {"laborable": (0, 1, 2, 3, 4), "sabado": (5,), "domingo": (6,)}
+# Días con servicio de víspera aunque caigan en laborable: nunca son de referencia (mes, día)
+VISPERAS = ((12, 24), (12, 31), (1, 5))
+# Semana de referencia fija (cualquier fecha de la semana); vacía = la elegida con los calendarios
+SEMANA = os.environ.get("FRECUENCIAS_SEMANA") or None
+# Cambia con el criterio de elección de días: invalida las tablas guardadas
+FORMATO = 3
+
+
+def _lunes(dias):
+    # El 1970-01-01 fue jueves: (día + 3) % 7 es el día de la semana con lunes = 0
+    return dias - (dias + 3) % 7
+
+
+def _es_vispera(dias):
+    fechas = np.asarray(dias).astype("datetime64[D]")
+    mes = fechas.astype("datetime64[M]")
+    numero_mes = mes.astype(np.int64) % 12 + 1
+    dia_mes = (fechas - mes.astype("datetime64[D]")).astype(np.int64) + 1
+    return np.isin(numero_mes * 100 + dia_mes, [m * 100 + d for m, d in VISPERAS])
+
+
+def dias_tipicos(feed, dias_semana):
+    """
+    Días (desde 1970-01-01, ordenados) del tipo dado con al menos la mediana
+    de viajes de los días de ese tipo con servicio en el calendario del feed,
+    sin vísperas.
+    """
+    dia0, n_dias = feed.calendario_rango.tolist()
+    if n_dias == 0 or len(feed.viaje_servicio) == 0:
+        return np.zeros(0, dtype=np.int64)
+    viajes_por_servicio = np.bincount(feed.viaje_servicio, minlength=len(feed.servicio_ids))
+    activos = np.unpackbits(feed.calendario_bits, axis=1, count=n_dias).astype(np.int64)
+    viajes = viajes_por_servicio @ activos
+    dias = np.arange(dia0, dia0 + n_dias)
+    validos = np.isin((dias + 3) % 7, dias_semana) & (viajes > 0) & ~_es_vispera(dias)
+    if not validos.any():
+        return np.zeros(0, dtype=np.int64)
+    return dias[validos & (viajes >= np.median(viajes[validos]))]
+
+
+def semana_referencia(tipicos):
+    """
+    Lunes (día desde 1970-01-01) de la semana con más pares (feed, tipo de
+    día) con algún día típico en ella, o None; a igualdad, la más reciente.
+    `tipicos` es {operador: {tipo: días típicos}}. Los tipos de día que un
+    feed solo tiene de forma ocasional (en menos de la mitad de semanas que su
+    tipo más frecuente, como un domingo suelto de fiestas) no cuentan, y las
+    semanas con una víspera no se eligen.
+    """
+    semanas = []
+    for por_tipo in tipicos.values():
+        por_tipo = [np.unique(_lunes(dias)) for dias in por_tipo.values()]
+        regular = max(len(lunes) for lunes in por_tipo) / 2
+        semanas.extend(lunes for lunes in por_tipo if len(lunes) and len(lunes) >= regular)
+    if not semanas:
+        return None
+    candidatas, cubiertos = np.unique(np.concatenate(semanas), return_counts=True)
+    sin_visperas = ~_es_vispera(candidatas[:, None] + np.arange(7)).any(axis=1)
+    candidatas, cubiertos = candidatas[sin_visperas], cubiertos[sin_visperas]
+    if len(candidatas) == 0:
+        return None
+    return int(candidatas[np.lexsort((candidatas, cubiertos))[-1]])
+
+
+def dias_representativos(feeds, semana=SEMANA):
+    """
+    {tipo de día: (día común, {operador: día})} con los días comunes de la
+    semana de referencia (`semana`: una fecha de esa semana para fijarla).
+    Cada feed usa el día común si también es típico en él o, si no, su día
+    típico más reciente de ese tipo.
+    """
+    tipicos = {f.nombre: {tipo: dias_tipicos(f, dias_semana) for tipo, dias_semana in TIPOS_DIA.items()} for f in feeds}
+    lunes = _lunes(a_dia(semana)) if semana is not None else semana_referencia(tipicos)
+    resultado = {}
+    for tipo, dias_semana in TIPOS_DIA.items():
+        por_feed = {nombre: por_tipo[tipo] for nombre, por_tipo in tipicos.items() if len(por_tipo[tipo])}
+        comun = None
+        if lunes is not None:
+            candidatos = lunes + np.array(dias_semana)
+            feeds_con_dia = sum(np.isin(candidatos, dias).astype(int) for dias in por_feed.values())
+            # Más feeds y, a igualdad, el más cercano al miércoles
+            comun = int(candidatos[np.lexsort((-np.abs(candidatos - lunes - 2), feeds_con_dia))[-1]])
+        resultado[tipo] = (comun, {
+            nombre: comun if comun is not None and np.isin(comun, dias) else int(dias[-1])
+            for nombre, dias in por_feed.items()
+        })
+    return resultado
+
+
+def estadisticas(clave, salida):
+    """
+    Estadísticas por valor de `clave` de las salidas (segundos) dadas.
+    Devuelve la clave de cada grupo y un dict de columnas.
+    """
+    orden = np.lexsort((salida, clave))
+    clave, salida = clave[orden], salida[orden]
+    grupos, inicio, salidas = np.unique(clave, return_index=True, return_counts=True)
+    primera = salida[inicio]
+    ultima = salida[inicio + salidas - 1]
+    # Salidas por hora de reloj: horas con servicio y máximo en una hora
+    hora = salida // 3600
+    nueva_hora = np.ones(len(hora), dtype=bool)
+    nueva_hora[1:] = (clave[1:] != clave[:-1]) | (hora[1:] != hora[:-1])
+    inicio_hora = np.flatnonzero(nueva_hora)
+    por_hora = np.diff(np.append(inicio_hora, len(hora)))
+    grupo_hora = np.searchsorted(inicio, inicio_hora, side="right") - 1
+    horas = np.bincount(grupo_hora, minlength=len(grupos))
+    pico = np.zeros(len(grupos), dtype=np.int64)
+    np.maximum.at(pico, grupo_hora, por_hora)
+    # La media de los intervalos entre salidas consecutivas es (última - primera) / (n - 1)
+    intervalo = np.where(salidas > 1, (ultima - primera) / np.maximum(salidas - 1, 1) / 60, np.nan)
+    return grupos, {
+        "salidas": salidas,
+        "por_hora": np.round(salidas / np.maximum(horas, 1), 2),
+        "pico_hora": pico,
+        "intervalo_min": np.round(intervalo, 1),
+        "primera": primera,
+        "ultima": ultima,
+    }
+
+
+def _hora(segundos):
+    segundos = np.asarray(segundos)
+    return [f"{s // 3600:02d}:{s % 3600 // 60:02d}" for s in segundos.tolist()]
+
+
+def calcular(feeds=None, semana=SEMANA):
+    """(paradas, tramos): DataFrames con una fila por feed, tipo de día y parada o tramo."""
+    feeds = almacen.feeds() if feeds is None else feeds
+    feeds = [f for f in feeds if len(f.horario_parada)]
+    dias = dias_representativos(feeds, semana)
+    paradas, tramos = [], []
+    for feed in feeds:
+        por_viaje = np.diff(feed.horario_inicio)
+        viaje = np.repeat(np.arange(len(por_viaje)), por_viaje)
+        siguiente = np.append(viaje[1:] == viaje[:-1], False)
+        validas = (feed.horario_parada >= 0) & (feed.horario_salida >= 0) & siguiente
+        for tipo in TIPOS_DIA:
+            dia = dias[tipo][1].get(feed.nombre)
+            if dia is None:
+                continue
+            filas = np.flatnonzero(validas & feed.viajes_activos(de_dia(dia))[viaje])
+            if len(filas) == 0:
+                continue
+            salida = feed.horario_salida[filas].astype(np.int64)
+            comunes = {"operador": feed.nombre, "tipo_dia": tipo, "fecha": de_dia(dia).isoformat()}
+
+            grupos, columnas = estadisticas(feed.horario_parada[filas].astype(np.int64), salida)
+            paradas.append(pd.DataFrame({
+                **comunes,
+                "stop_id": feed.parada_ids[grupos],
+                "stop_name": feed.parada_nombre[grupos],
+                "lat": feed.parada_lat[grupos],
+                "lon": feed.parada_lon[grupos],
+                **columnas,
+            }))
+
+            # Tramo = (parada, parada siguiente del viaje), identificado por un solo entero
+            n = len(feed.parada_ids)
+            desde, hasta = feed.horario_parada[filas].astype(np.int64), feed.horario_parada[filas + 1].astype(np.int64)
+            con_hasta = hasta >= 0
+            grupos, columnas = estadisticas((desde * n + hasta)[con_hasta], salida[con_hasta])
+            desde, hasta = grupos // n, grupos % n
+            tramos.append(pd.DataFrame({
+                **comunes,
+                "desde": feed.parada_ids[desde],
+                "hasta": feed.parada_ids[hasta],
+                "lat_desde": feed.parada_lat[desde],
+                "lon_desde": feed.parada_lon[desde],
+                "lat_hasta": feed.parada_lat[hasta],
+                "lon_hasta": feed.parada_lon[hasta],
+                **columnas,
+            }))
+
+    paradas = pd.concat(paradas, ignore_index=True) if paradas else pd.DataFrame()
+    tramos = pd.concat(tramos, ignore_index=True) if tramos else pd.DataFrame()
+    for df in (paradas, tramos):
+        if len(df):
+            df["primera"], df["ultima"] = _hora(df["primera"]), _hora(df["ultima"])
+    return paradas, tramos
+
+
+def _ruta(version, tabla):
+    # `version` lleva la de los feeds y la semana fijada
+    digest = hashlib.sha1(repr((FORMATO, version)).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(ARTEFACTOS_DIR, f"frecuencias_{tabla}-{digest}.csv.gz")
+
+
+_frecuencias = (None, None)
+_lock = threading.Lock()
+
+
+def frecuencias(semana=SEMANA):
+    """(paradas, tramos) de la versión actual de los feeds: de disco si ya están calculadas."""
+    global _frecuencias
+    version = (almacen.version(), semana)
+    if _frecuencias[0] == version:
+        return _frecuencias[1]
+    with _lock:
+        if _frecuencias[0] == version:
+            return _frecuencias[1]
+        tipos = {"stop_id": str, "desde": str, "hasta": str}
+        try:
+            resultado = tuple(pd.read_csv(_ruta(version, t), dtype=tipos) for t in ("paradas", "tramos"))
+        except (OSError, ValueError):
+            resultado = calcular(semana=semana)
+            try:
+                os.makedirs(ARTEFACTOS_DIR, exist_ok=True)
+                for df, tabla in zip(resultado, ("paradas", "tramos")):
+                    buffer = io.BytesIO()
+                    df.to_csv(buffer, index=False, compression={"method": "gzip", "mtime": 0})
+                    escribir_atomico(_ruta(version, tabla), buffer.getvalue())
+            except OSError as e:
+                print(f"No se pudieron guardar las frecuencias: {e}")
+        _frecuencias = (version, resultado)
+    return resultado
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calcula y guarda las frecuencias de paso de los feeds ATTG")
+    parser.add_argument("--semana", default=SEMANA, help="fecha (YYYY-MM-DD) de la semana de referencia")
+    args = parser.parse_args()
+    inicio = time.perf_counter()
+    paradas, tramos = frecuencias(args.semana)
+    print(f"{len(paradas)} filas de paradas y {len(tramos)} de tramos ({time.perf_counter() - inicio:.2f} s)")
+    for tipo, filas in paradas.groupby("tipo_dia", sort=False):
+        fechas = filas.drop_duplicates("operador")["fecha"].value_counts()
+        print(f"{tipo}: " + ", ".join(f"{fecha} ({n} feeds)" for fecha, n in fechas.items()))
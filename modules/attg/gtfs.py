@@ -0,0 +1,574 @@
+"""
+Almacén en memoria de los feeds GTFS de data/attg.
+
+Cada feed (una carpeta por operador) se lee una vez y se vuelve a leer solo
+cuando cambia algún fichero. Los identificadores GTFS se convierten en
+enteros (su posición en la tabla de ids) y las tablas grandes se guardan como
+arrays ordenados con desplazamientos, así que las consultas de los
+desplegables y del mapa son cortes de arrays:
+
+    ruta -> viajes por dirección -> puntos de la forma / paradas en orden
+
+Los ficheros opcionales (shapes.txt, stop_times.txt) pueden faltar; las
+tablas correspondientes quedan vacías.
+
+Al cargar cada feed se construye también un índice de prefijos de los
+nombres de parada (sin tildes ni mayúsculas, desde cada palabra) y las rutas
+que pasan por cada parada, para el buscador de paradas.
+
+Para arrancar rápido, cada feed se compila a un fichero binario de arrays (ids
+internados como UTF-8 de ancho fijo, horas en segundos, coordenadas de las
+formas en float32)
+que se mapea en memoria:
+
+    python -m modules.attg.gtfs [--forzar]
+"""
+import argparse
+import hashlib
+import heapq
+import json
+import mmap
+import os
+import tempfile
+import threading
+import time
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+from modules.comun.artefactos import ARTEFACTOS_DIR
+
+BASE_PATH = os.path.join(os.path.dirname(__file__), "../../data/attg")
+# Feeds compilados (python -m modules.attg.gtfs)
+COMPILADO_DIR = os.environ.get("GTFS_COMPILADO_DIR", os.path.join(ARTEFACTOS_DIR, "gtfs"))
+MAGIA = b"GTFSNPY1"
+# Se incrementa al cambiar COLUMNAS: los ficheros compilados antes dejan de usarse
+FORMATO = 2
+DIAS_SEMANA = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+# Segundos entre comprobaciones de mtime de un mismo feed
+COMPROBAR_CADA = float(os.environ.get("GTFS_COMPROBAR_CADA", 5))
+
+
+def es_feed(nombre):
+    return nombre.startswith("l_") or nombre == "dbus"
+
+
+def segundos(horas):
+    """'HH:MM:SS' (admite horas >= 24 y 'H:MM:SS') -> segundos desde medianoche; -1 si falta o no es válida."""
+    texto = pd.Series(horas, dtype=object).fillna("").astype(str).str.strip().to_numpy(dtype=str)
+    if len(texto) == 0:
+        return np.zeros(0, dtype=np.int32)
+    texto = np.char.rjust(texto, 8, "0")
+    # Se trabaja sobre los bytes: 8 caracteres por fila, dígitos en 0-1, 3-4 y 6-7
+    digitos = np.char.encode(texto, "ascii", errors="replace").astype("S8").view(np.uint8).reshape(-1, 8).astype(np.int32) - 48
+    validos = (np.char.str_len(texto) == 8) & (digitos[:, 2] == 10) & (digitos[:, 5] == 10)
+    validos &= ((digitos[:, [0, 1, 3, 4, 6, 7]] >= 0) & (digitos[:, [0, 1, 3, 4, 6, 7]] <= 9)).all(axis=1)
+    total = (digitos[:, 0] * 10 + digitos[:, 1]) * 3600 + (digitos[:, 3] * 10 + digitos[:, 4]) * 60 + digitos[:, 6] * 10 + digitos[:, 7]
+    return np.where(validos, total, -1).astype(np.int32)
+
+
+def a_dia(fecha):
+    """Fecha (date, datetime, 'YYYYMMDD' o 'YYYY-MM-DD') -> días desde 1970-01-01."""
+    if isinstance(fecha, str):
+        fecha = fecha.replace("-", "")
+        fecha = f"{fecha[:4]}-{fecha[4:6]}-{fecha[6:8]}"
+    return int(np.datetime64(fecha, "D").astype(np.int64))
+
+
+def de_dia(dia):
+    return np.datetime64(int(dia), "D").astype(object)
+
+
+def plegar(texto):
+    """Texto para comparar nombres: sin tildes, en minúsculas y solo letras y números separados por un espacio."""
+    texto = unicodedata.normalize("NFKD", str(texto)).casefold()
+    texto = "".join(c if c.isalnum() else " " for c in texto if not unicodedata.combining(c))
+    return " ".join(texto.split())
+
+
+def _dias(fechas):
+    # 'YYYYMMDD' -> días desde 1970-01-01; -1 si no es una fecha
+    fechas = pd.to_datetime(pd.Series(fechas, dtype=object), format="%Y%m%d", errors="coerce")
+    dias = fechas.to_numpy(dtype="datetime64[D]").astype(np.int64)
+    return np.where(fechas.notna().to_numpy(), dias, -1)
+
+
+# Columnas numéricas: las convierte el parser de C; el resto se lee como texto
+_NUMERICAS = {
+    "direction_id", "stop_lat", "stop_lon", "shape_pt_lat", "shape_pt_lon", "shape_pt_sequence", "stop_sequence",
+    "exception_type", *DIAS_SEMANA,
+}
+
+
+def _leer(ruta, columnas, obligatorias=()):
+    # Ids como texto (evita que "007" y "7" se confundan)
+    if not os.path.exists(ruta):
+        return pd.DataFrame({c: pd.Series(dtype=object) for c in columnas})
+    cabecera = pd.read_csv(ruta, nrows=0).columns
+    faltan = [c for c in obligatorias if c not in cabecera]
+    if faltan:
+        raise ValueError(f"{os.path.basename(ruta)} no tiene las columnas {faltan}")
+    presentes = [c for c in columnas if c in cabecera]
+    df = pd.read_csv(ruta, usecols=presentes, dtype={c: str for c in presentes if c not in _NUMERICAS})
+    for c in columnas:
+        if c not in df:
+            df[c] = np.nan if c in _NUMERICAS else ""
+        elif c not in _NUMERICAS:
+            df[c] = df[c].fillna("")
+    return df
+
+
+def _tramos(clave, n):
+    """Desplazamientos de cada clave 0..n-1 en un array ordenado por clave."""
+    return np.searchsorted(clave, np.arange(n + 1)).astype(np.int64)
+
+
+# Arrays de un feed (y de su fichero compilado)
+COLUMNAS = (
+    "ruta_ids", "ruta_nombre", "viaje_ids", "parada_ids", "parada_nombre", "parada_lat", "parada_lon",
+    "servicio_ids", "forma_ids", "viaje_ruta", "viaje_direccion", "viaje_servicio", "viaje_forma",
+    "viajes_orden", "grupo_ruta", "grupo_direccion", "grupo_inicio",
+    "forma_lat", "forma_lon", "forma_inicio",
+    "horario_parada", "horario_llegada", "horario_salida", "horario_inicio",
+    "calendario_rango", "calendario_bits",
+)
+# Tablas de texto: UTF-8 de ancho fijo. Las pequeñas se decodifican al cargar;
+# los ids de viaje y de forma se quedan en bytes
+TEXTOS = ("ruta_ids", "ruta_nombre", "viaje_ids", "parada_ids", "parada_nombre", "servicio_ids", "forma_ids")
+DECODIFICADOS = ("ruta_ids", "ruta_nombre", "parada_ids", "parada_nombre", "servicio_ids")
+
+
+def _textos(valores):
+    return np.asarray(pd.Series(valores, dtype=object).fillna("").astype(str).to_numpy(dtype=str))
+
+
+def parsear(ruta):
+    """Lee los .txt de un feed y devuelve sus tablas como arrays indexados por enteros."""
+    rutas = _leer(os.path.join(ruta, "routes.txt"), ["route_id", "route_short_name", "route_long_name"], ["route_id"])
+    viajes = _leer(os.path.join(ruta, "trips.txt"), ["route_id", "service_id", "trip_id", "direction_id", "shape_id"],
+                   ["route_id", "trip_id"])
+    paradas = _leer(os.path.join(ruta, "stops.txt"), ["stop_id", "stop_name", "stop_lat", "stop_lon"], ["stop_id"])
+    formas = _leer(os.path.join(ruta, "shapes.txt"), ["shape_id", "shape_pt_lat", "shape_pt_lon", "shape_pt_sequence"])
+    horarios = _leer(os.path.join(ruta, "stop_times.txt"),
+                     ["trip_id", "arrival_time", "departure_time", "stop_id", "stop_sequence"])
+    t = {}
+
+    # Tablas de ids: el código entero de un id es su posición
+    t["ruta_ids"] = _textos(rutas["route_id"])
+    t["ruta_nombre"] = _textos(rutas["route_short_name"] + " - " + rutas["route_long_name"])
+    t["viaje_ids"] = _textos(viajes["trip_id"])
+    t["parada_ids"] = _textos(paradas["stop_id"])
+    t["parada_nombre"] = _textos(paradas["stop_name"])
+    t["parada_lat"] = pd.to_numeric(paradas["stop_lat"], errors="coerce").to_numpy(dtype=float)
+    t["parada_lon"] = pd.to_numeric(paradas["stop_lon"], errors="coerce").to_numpy(dtype=float)
+    t["servicio_ids"], servicio = np.unique(_textos(viajes["service_id"]), return_inverse=True)
+    t["forma_ids"] = _textos(pd.unique(formas["shape_id"].to_numpy(dtype=object)))
+
+    # Viajes: ruta, dirección, servicio y forma como enteros (-1 si no hay)
+    t["viaje_ruta"] = pd.Index(t["ruta_ids"]).get_indexer(viajes["route_id"]).astype(np.int32)
+    t["viaje_direccion"] = pd.to_numeric(viajes["direction_id"], errors="coerce").fillna(0).to_numpy(dtype=np.int8)
+    t["viaje_servicio"] = servicio.astype(np.int32)
+    t["viaje_forma"] = pd.Index(t["forma_ids"]).get_indexer(viajes["shape_id"]).astype(np.int32)
+
+    # Viajes de cada (ruta, dirección), en el orden del fichero
+    clave = t["viaje_ruta"].astype(np.int64) * 256 + t["viaje_direccion"]
+    t["viajes_orden"] = np.argsort(clave, kind="stable").astype(np.int32)
+    claves, inicios = np.unique(clave[t["viajes_orden"]], return_index=True)
+    t["grupo_ruta"] = (claves // 256).astype(np.int32)
+    t["grupo_direccion"] = (claves % 256).astype(np.int8)
+    t["grupo_inicio"] = np.append(inicios, len(clave)).astype(np.int64)
+
+    # Formas: puntos ordenados por (forma, secuencia)
+    forma = pd.Index(t["forma_ids"]).get_indexer(formas["shape_id"])
+    secuencia = pd.to_numeric(formas["shape_pt_sequence"], errors="coerce").fillna(0).to_numpy()
+    orden = np.lexsort((secuencia, forma))
+    t["forma_lat"] = pd.to_numeric(formas["shape_pt_lat"], errors="coerce").to_numpy(dtype=np.float32)[orden]
+    t["forma_lon"] = pd.to_numeric(formas["shape_pt_lon"], errors="coerce").to_numpy(dtype=np.float32)[orden]
+    t["forma_inicio"] = _tramos(forma[orden], len(t["forma_ids"]))
+
+    # Horarios: paradas de cada viaje ordenadas por stop_sequence, horas en segundos
+    viaje = pd.Index(t["viaje_ids"]).get_indexer(horarios["trip_id"])
+    secuencia = pd.to_numeric(horarios["stop_sequence"], errors="coerce").fillna(0).to_numpy()
+    validos = viaje >= 0
+    orden = np.lexsort((secuencia[validos], viaje[validos]))
+    t["horario_parada"] = pd.Index(t["parada_ids"]).get_indexer(horarios["stop_id"])[validos][orden].astype(np.int32)
+    t["horario_llegada"] = segundos(horarios["arrival_time"])[validos][orden]
+    t["horario_salida"] = segundos(horarios["departure_time"])[validos][orden]
+    t["horario_inicio"] = _tramos(viaje[validos][orden], len(t["viaje_ids"]))
+
+    t["calendario_rango"], t["calendario_bits"] = _calendario(ruta, t["servicio_ids"])
+
+    for columna in TEXTOS:
+        t[columna] = np.char.encode(t[columna], "utf-8")
+    return t
+
+
+def _calendario(ruta, servicio_ids):
+    """
+    Días de servicio de cada servicio (calendar.txt con las excepciones de
+    calendar_dates.txt aplicadas) como bitset: una fila por código de
+    servicio y un bit por día desde el primer día del rango.
+    """
+    calendario = _leer(os.path.join(ruta, "calendar.txt"), ["service_id", *DIAS_SEMANA, "start_date", "end_date"])
+    excepciones = _leer(os.path.join(ruta, "calendar_dates.txt"), ["service_id", "date", "exception_type"])
+    inicio, fin = _dias(calendario["start_date"]), _dias(calendario["end_date"])
+    fechas = _dias(excepciones["date"])
+    extremos = np.concatenate([inicio, fin, fechas])
+    extremos = extremos[extremos >= 0]
+    if len(extremos) == 0:
+        return np.array([0, 0], dtype=np.int64), np.zeros((len(servicio_ids), 0), dtype=np.uint8)
+    dia0, n_dias = int(extremos.min()), int(extremos.max() - extremos.min() + 1)
+
+    dias = np.arange(dia0, dia0 + n_dias)
+    semana = (dias + 3) % 7  # 1970-01-01 fue jueves; lunes = 0
+    semanal = calendario[list(DIAS_SEMANA)].fillna(0).to_numpy(dtype=float) > 0
+    activos_cal = semanal[:, semana] & (dias >= inicio[:, None]) & (dias <= fin[:, None])
+    fila = pd.Index(servicio_ids).get_indexer(calendario["service_id"])
+    activos = np.zeros((len(servicio_ids), n_dias), dtype=bool)
+    np.logical_or.at(activos, fila[fila >= 0], activos_cal[fila >= 0])
+
+    # Excepciones: 1 añade el día, 2 lo quita
+    codigo = pd.Index(servicio_ids).get_indexer(excepciones["service_id"])
+    dia = fechas - dia0
+    tipo = pd.to_numeric(excepciones["exception_type"], errors="coerce").to_numpy()
+    validas = (codigo >= 0) & (fechas >= 0)
+    activos[codigo[validas & (tipo == 1)], dia[validas & (tipo == 1)]] = True
+    activos[codigo[validas & (tipo == 2)], dia[validas & (tipo == 2)]] = False
+    return np.array([dia0, n_dias], dtype=np.int64), np.packbits(activos, axis=1)
+
+
+class Feed:
+    def __init__(self, nombre, ruta, firma, tablas):
+        self.nombre = nombre
+        self.ruta = ruta
+        self.firma = firma
+        for columna in COLUMNAS:
+            setattr(self, columna, tablas[columna])
+        for columna in DECODIFICADOS:
+            setattr(self, columna, np.char.decode(tablas[columna], "utf-8"))
+
+        # Índices pequeños en diccionarios; los arrays grandes se quedan como están (o mapeados)
+        self._ruta = {r: i for i, r in enumerate(self.ruta_ids.tolist())}
+        self._viajes = {}
+        self._direcciones = {}
+        grupos = zip(self.grupo_ruta.tolist(), self.grupo_direccion.tolist(),
+                     self.grupo_inicio[:-1].tolist(), self.grupo_inicio[1:].tolist())
+        for r, d, inicio, fin in grupos:
+            self._viajes[(r, d)] = (inicio, fin)
+            if r >= 0:
+                self._direcciones.setdefault(r, []).append(d)
+        self.opciones_lineas = [
+            {"label": nombre, "value": route_id} for route_id, nombre in zip(self.ruta_ids.tolist(), self.ruta_nombre.tolist())
+        ]
+
+        # Buscador: una clave por palabra de cada nombre (el nombre plegado desde esa palabra), ordenadas
+        self.parada_plegado = [plegar(nombre) for nombre in self.parada_nombre.tolist()]
+        claves, codigos = [], []
+        for p, plegado in enumerate(self.parada_plegado):
+            palabras = plegado.split(" ")
+            for i in range(len(palabras)):
+                claves.append(" ".join(palabras[i:]))
+                codigos.append(p)
+        claves = np.array(claves, dtype=str)
+        orden = np.argsort(claves, kind="stable")
+        self.indice_claves, self.indice_parada = claves[orden], np.array(codigos, dtype=np.int32)[orden]
+        # Rutas que paran en cada parada (según stop_times.txt), por desplazamientos
+        viaje = np.repeat(np.arange(len(self.horario_inicio) - 1), np.diff(self.horario_inicio))
+        parada, ruta = self.horario_parada, self.viaje_ruta[viaje]
+        validos = (parada >= 0) & (ruta >= 0)
+        n_rutas = max(len(self.ruta_ids), 1)
+        pares = np.unique(parada[validos].astype(np.int64) * n_rutas + ruta[validos])
+        self.parada_rutas = (pares % n_rutas).astype(np.int32)
+        self.parada_rutas_inicio = _tramos(pares // n_rutas, len(self.parada_ids))
+
+    def viaje_id(self, viaje):
+        return self.viaje_ids[viaje].decode("utf-8")
+
+    def direcciones(self, route_id):
+        return sorted(self._direcciones.get(self._ruta.get(route_id, -1), []))
+
+    def viajes(self, route_id, direccion):
+        """Códigos de los viajes de la ruta en esa dirección, en el orden de trips.txt."""
+        tramo = self._viajes.get((self._ruta.get(route_id, -1), int(direccion)))
+        if tramo is None:
+            return self.viajes_orden[:0]
+        return self.viajes_orden[tramo[0]:tramo[1]]
+
+    def servicios_activos(self, fecha):
+        """Máscara por código de servicio de los que circulan en `fecha` (un bit del bitset por servicio)."""
+        dia0, n_dias = self.calendario_rango.tolist()
+        d = a_dia(fecha) - dia0
+        if not 0 <= d < n_dias:
+            return np.zeros(len(self.servicio_ids), dtype=bool)
+        return ((self.calendario_bits[:, d >> 3] >> (7 - (d & 7))) & 1).astype(bool)
+
+    def viajes_activos(self, fecha):
+        """Máscara por código de viaje de los que circulan en `fecha`."""
+        return self.servicios_activos(fecha)[self.viaje_servicio]
+
+    def viaje_representativo(self, route_id, direccion, fecha):
+        """
+        Viaje de la ruta y dirección que circula en `fecha` con la forma más
+        repetida ese día (el recorrido habitual, no una variante). None si no hay.
+        """
+        viajes = self.viajes(route_id, direccion)
+        viajes = viajes[self.servicios_activos(fecha)[self.viaje_servicio[viajes]]]
+        if len(viajes) == 0:
+            return None
+        formas = self.viaje_forma[viajes]
+        if (formas >= 0).any():
+            habitual = np.bincount(formas[formas >= 0]).argmax()
+            return int(viajes[np.argmax(formas == habitual)])
+        return int(viajes[0])
+
+    def fecha_con_servicio(self, fecha, viajes):
+        """
+        Día más próximo a `fecha` en que circula alguno de `viajes`, a ser
+        posible el mismo día de la semana. None si no circulan nunca.
+        """
+        dia0, n_dias = self.calendario_rango.tolist()
+        servicios = np.unique(self.viaje_servicio[np.asarray(viajes)])
+        if len(servicios) == 0 or n_dias == 0:
+            return None
+        dias = np.flatnonzero(np.unpackbits(self.calendario_bits[servicios], axis=1, count=n_dias).any(axis=0))
+        if len(dias) == 0:
+            return None
+        objetivo = a_dia(fecha) - dia0
+        mismo_dia = dias[(dias - objetivo) % 7 == 0]
+        candidatos = mismo_dia if len(mismo_dia) else dias
+        return de_dia(dia0 + candidatos[np.argmin(np.abs(candidatos - objetivo))])
+
+    def buscar_paradas(self, texto):
+        """Códigos de las paradas con alguna palabra del nombre que empieza por `texto` (ya plegado), sin repetir."""
+        inicio = np.searchsorted(self.indice_claves, texto, side="left")
+        fin = np.searchsorted(self.indice_claves, texto + "\U0010ffff", side="left")
+        codigos = self.indice_parada[inicio:fin]
+        return codigos[np.sort(np.unique(codigos, return_index=True)[1])]
+
+    def rutas_parada(self, parada):
+        """Códigos de las rutas con algún viaje que para en la parada."""
+        return self.parada_rutas[self.parada_rutas_inicio[parada]:self.parada_rutas_inicio[parada + 1]]
+
+    def paradas_viaje(self, viaje):
+        """Códigos de las paradas del viaje en orden (vacío sin stop_times.txt)."""
+        return self.horario_parada[self.horario_inicio[viaje]:self.horario_inicio[viaje + 1]]
+
+    def forma_viaje(self, viaje):
+        """(lat, lon) del recorrido; sin shapes.txt se une la secuencia de paradas."""
+        forma = self.viaje_forma[viaje]
+        if forma >= 0:
+            inicio, fin = self.forma_inicio[forma], self.forma_inicio[forma + 1]
+            if fin > inicio:
+                return self.forma_lat[inicio:fin], self.forma_lon[inicio:fin]
+        paradas = self.paradas_viaje(viaje)
+        paradas = paradas[paradas >= 0]
+        return self.parada_lat[paradas], self.parada_lon[paradas]
+
+    def paradas(self, codigos=None):
+        """DataFrame de paradas (todas o las de `codigos`, en ese orden)."""
+        codigos = np.arange(len(self.parada_ids)) if codigos is None else np.asarray(codigos)
+        codigos = codigos[codigos >= 0]
+        return pd.DataFrame({
+            "stop_id": self.parada_ids[codigos],
+            "stop_name": self.parada_nombre[codigos],
+            "stop_lat": self.parada_lat[codigos],
+            "stop_lon": self.parada_lon[codigos],
+        })
+
+
+def _firma(ruta):
+    # Ficheros .txt de la carpeta con su tamaño y mtime: cambia si se actualiza el feed
+    try:
+        with os.scandir(ruta) as it:
+            return tuple(sorted(
+                (e.name, e.stat().st_mtime_ns, e.stat().st_size) for e in it if e.name.endswith(".txt")
+            ))
+    except OSError:
+        return None
+
+
+def ruta_compilado(nombre, firma, directorio=None):
+    # El nombre lleva la firma de los .txt: un feed modificado nunca usa arrays viejos
+    digest = hashlib.sha1(repr((FORMATO, firma)).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(directorio or COMPILADO_DIR, f"{nombre}-{digest}.gtfs")
+
+
+def compilar(nombre, ruta, firma, tablas=None, directorio=None):
+    """
+    Guarda las tablas del feed en un único fichero: cabecera JSON con el tipo,
+    la forma y la posición de cada array, y los arrays alineados a 64 bytes.
+    Devuelve su ruta.
+    """
+    directorio = directorio or COMPILADO_DIR
+    destino = ruta_compilado(nombre, firma, directorio)
+    if os.path.exists(destino):
+        return destino
+    tablas = tablas if tablas is not None else parsear(ruta)
+    arrays = {c: np.ascontiguousarray(tablas[c]) for c in COLUMNAS}
+    cabecera, posicion = {}, 0
+    for columna, array in arrays.items():
+        cabecera[columna] = [array.dtype.str, list(array.shape), posicion]
+        posicion += -(-array.nbytes // 64) * 64
+    texto = json.dumps(cabecera).encode("utf-8")
+    inicio_datos = -(-(len(MAGIA) + 8 + len(texto)) // 64) * 64
+
+    os.makedirs(directorio, exist_ok=True)
+    fd, temporal = tempfile.mkstemp(dir=directorio, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(MAGIA + len(texto).to_bytes(8, "little") + texto)
+        for columna, array in arrays.items():
+            f.seek(inicio_datos + cabecera[columna][2])
+            f.write(array.tobytes())
+        f.truncate(inicio_datos + posicion)
+    os.replace(temporal, destino)
+    # Versiones anteriores del mismo feed
+    for entrada in os.listdir(directorio):
+        if entrada.startswith(f"{nombre}-") and entrada.endswith(".gtfs") and os.path.join(directorio, entrada) != destino:
+            try:
+                os.remove(os.path.join(directorio, entrada))
+            except OSError:
+                pass
+    return destino
+
+
+def cargar_compilado(ruta):
+    """
+    Mapea en memoria un feed compilado. Los arrays son vistas de solo lectura
+    sobre el mmap: las páginas se comparten entre procesos y solo se leen las
+    que se usan.
+    """
+    with open(ruta, "rb") as f:
+        memoria = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if memoria[:len(MAGIA)] != MAGIA:
+        raise ValueError("no es un feed compilado")
+    largo = int.from_bytes(memoria[len(MAGIA):len(MAGIA) + 8], "little")
+    cabecera = json.loads(memoria[len(MAGIA) + 8:len(MAGIA) + 8 + largo])
+    inicio_datos = -(-(len(MAGIA) + 8 + largo) // 64) * 64
+    tablas = {}
+    for columna in COLUMNAS:
+        tipo, forma, posicion = cabecera[columna]
+        tipo = np.dtype(tipo)
+        n = int(np.prod(forma))
+        tablas[columna] = np.frombuffer(memoria, dtype=tipo, count=n, offset=inicio_datos + posicion).reshape(forma)
+    return tablas
+
+
+class AlmacenGTFS:
+    """
+    Feeds cargados bajo demanda y recargados cuando cambian sus ficheros.
+    Si existe la versión compilada del feed se mapea en memoria; si no, se
+    leen los .txt y se compila para los siguientes arranques.
+    """
+
+    def __init__(self, base=BASE_PATH, compilado=True):
+        self.base = base
+        self.compilado = compilado
+        self._feeds = {}
+        self._locks = {}
+        self._comprobado = {}
+        self._todos = False
+        self._lock = threading.Lock()
+
+    def nombres(self):
+        return sorted(d for d in os.listdir(self.base) if es_feed(d) and os.path.isdir(os.path.join(self.base, d)))
+
+    def feed(self, nombre):
+        if not es_feed(nombre):
+            raise KeyError(nombre)
+        actual = self._feeds.get(nombre)
+        ahora = time.monotonic()
+        if actual is not None and ahora - self._comprobado.get(nombre, 0) < COMPROBAR_CADA:
+            return actual
+        ruta = os.path.join(self.base, nombre)
+        firma = _firma(ruta)
+        if firma is None:
+            raise KeyError(nombre)
+        self._comprobado[nombre] = ahora
+        if actual is not None and actual.firma == firma:
+            return actual
+        with self._lock:
+            lock = self._locks.setdefault(nombre, threading.Lock())
+        # Un feed se carga una sola vez aunque lo pidan varios callbacks a la vez
+        with lock:
+            actual = self._feeds.get(nombre)
+            if actual is None or actual.firma != firma:
+                actual = Feed(nombre, ruta, firma, self._tablas(nombre, ruta, firma))
+                self._feeds[nombre] = actual
+        return actual
+
+    def _tablas(self, nombre, ruta, firma):
+        if not self.compilado:
+            return parsear(ruta)
+        destino = ruta_compilado(nombre, firma)
+        if not os.path.exists(destino):
+            tablas = parsear(ruta)
+            try:
+                compilar(nombre, ruta, firma, tablas)
+            except OSError as e:
+                print(f"No se pudo compilar el feed GTFS {nombre}: {e}")
+            return tablas
+        try:
+            return cargar_compilado(destino)
+        except (OSError, ValueError) as e:
+            print(f"Feed GTFS compilado ilegible ({destino}), se leen los .txt: {e}")
+            return parsear(ruta)
+
+    def feeds(self):
+        feeds = [self.feed(nombre) for nombre in self.nombres()]
+        self._todos = True
+        return feeds
+
+    def cargados(self):
+        """Feeds ya cargados, sin volver a comprobar sus ficheros (la primera vez se cargan todos)."""
+        if not self._todos:
+            return self.feeds()
+        return [feed for _, feed in sorted(self._feeds.items())]
+
+    def buscar_paradas(self, texto, limite=20):
+        """
+        Paradas de todos los feeds cuyo nombre tiene una palabra que empieza
+        por `texto` (sin distinguir tildes ni mayúsculas). Primero las que
+        empiezan así, luego por orden alfabético.
+        """
+        texto = plegar(texto)
+        if not texto:
+            return []
+        encontradas = []
+        for feed in self.cargados():
+            plegados = feed.parada_plegado
+            candidatas = [(not plegados[p].startswith(texto), plegados[p], p) for p in feed.buscar_paradas(texto).tolist()]
+            # De cada feed bastan sus `limite` primeras para el orden global
+            if len(candidatas) > limite:
+                candidatas = heapq.nsmallest(limite, candidatas)
+            encontradas.extend((prefijo, plegado, feed, p) for prefijo, plegado, p in candidatas)
+        encontradas.sort(key=lambda e: e[:2])
+        return [{
+            "operador": feed.nombre,
+            "stop_id": str(feed.parada_ids[p]),
+            "stop_name": str(feed.parada_nombre[p]),
+            "lat": float(feed.parada_lat[p]),
+            "lon": float(feed.parada_lon[p]),
+            "rutas": [str(feed.ruta_nombre[r]).split(" - ")[0] for r in feed.rutas_parada(p).tolist()],
+        } for _, _, feed, p in encontradas[:limite]]
+
+    def version(self):
+        return tuple((nombre, _firma(os.path.join(self.base, nombre))) for nombre in self.nombres())
+
+
+almacen = AlmacenGTFS()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compila los feeds GTFS de data/attg a arrays NumPy")
+    parser.add_argument("--forzar", action="store_true", help="recompila aunque los .txt no hayan cambiado")
+    args = parser.parse_args()
+    for nombre in almacen.nombres():
+        ruta = os.path.join(almacen.base, nombre)
+        firma = _firma(ruta)
+        if args.forzar and os.path.exists(ruta_compilado(nombre, firma)):
+            os.remove(ruta_compilado(nombre, firma))
+        inicio = time.perf_counter()
+        destino = compilar(nombre, ruta, firma)
+        tamaño = os.path.getsize(destino)
+        print(f"{nombre}: {destino} ({tamaño / 1024:.0f} KB, {time.perf_counter() - inicio:.2f} s)")
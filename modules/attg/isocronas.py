@@ -0,0 +1,197 @@
+"""
+Isócronas de accesibilidad en autobús sobre una rejilla hexagonal.
+
+Desde las paradas a pie del origen se hace una pasada del CSA a todas las
+paradas (modules.attg.planificador) y, para cada parada alcanzada, se marcan
+las celdas a las que se llega andando con el tiempo que queda. Todo el
+rasterizado es vectorial: cada parada suma un "núcleo" fijo de celdas
+vecinas (con su distancia precalculada) y por celda se queda el mínimo.
+
+La rejilla es hexagonal (coordenadas axiales, como H3 pero plana): se
+proyecta en metros con una equirectangular centrada en Gipuzkoa, que a esta
+escala deforma menos que el tamaño de celda.
+"""
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+from flask import Response, abort, request
+
+from modules.attg import planificador, salidas
+from modules.comun.cercania import RADIO_TIERRA_M
+
+PREFIJO = "/api/isocronas"
+# Radio de celda (centro a vértice) en metros
+TAMAÑO_CELDA = float(os.environ.get("ISOCRONAS_CELDA", 150))
+# Lo más que se anda desde una parada (o desde el origen) para llegar a una celda
+PIE_MAXIMO = float(os.environ.get("ISOCRONAS_PIE_MAXIMO", 1200))
+MINUTOS = (15, 30, 45)
+# Las consultas se agrupan en tramos de hora de estos minutos (y por celda de origen)
+TRAMO_MINUTOS = 5
+MAX_CACHE = 256
+LAT0 = 43.15
+_COS_LAT0 = math.cos(math.radians(LAT0))
+_RAIZ3 = math.sqrt(3)
+
+
+def proyectar(lat, lon):
+    lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+    return RADIO_TIERRA_M * np.radians(lon) * _COS_LAT0, RADIO_TIERRA_M * np.radians(lat)
+
+
+def desproyectar(x, y):
+    return np.degrees(np.asarray(y) / RADIO_TIERRA_M), np.degrees(np.asarray(x) / (RADIO_TIERRA_M * _COS_LAT0))
+
+
+def celdas(x, y, tamaño=TAMAÑO_CELDA):
+    """Celda axial (q, r) de cada punto (hexágonos con un vértice arriba)."""
+    q = (_RAIZ3 / 3 * np.asarray(x) - np.asarray(y) / 3) / tamaño
+    r = (2 / 3 * np.asarray(y)) / tamaño
+    # Redondeo en coordenadas cúbicas: se corrige la componente con más error
+    s = -q - r
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    corregir_q = (dq > dr) & (dq > ds)
+    corregir_r = ~corregir_q & (dr > ds)
+    rq = np.where(corregir_q, -rr - rs, rq)
+    rr = np.where(corregir_r, -rq - rs, rr)
+    return rq.astype(np.int64), rr.astype(np.int64)
+
+
+def centros(q, r, tamaño=TAMAÑO_CELDA):
+    return tamaño * _RAIZ3 * (q + r / 2), tamaño * 1.5 * r
+
+
+def _nucleo(radio, tamaño=TAMAÑO_CELDA):
+    # Desplazamientos (dq, dr) de las celdas a menos de `radio` del centro y su distancia
+    k = int(math.ceil(radio / (tamaño * _RAIZ3))) + 1
+    dq, dr = np.meshgrid(np.arange(-k, k + 1), np.arange(-k, k + 1))
+    dq, dr = dq.ravel(), dr.ravel()
+    x, y = centros(dq, dr, tamaño)
+    metros = np.hypot(x, y)
+    dentro = metros <= radio
+    return dq[dentro], dr[dentro], metros[dentro]
+
+
+_NUCLEO = _nucleo(PIE_MAXIMO)
+
+
+def rasterizar(lat, lon, segundos_restantes):
+    """
+    Celdas alcanzables andando desde cada punto con el tiempo que le queda:
+    (q, r, segundos que sobran al llegar a la celda), una fila por celda.
+    """
+    x, y = proyectar(lat, lon)
+    q, r = celdas(x, y)
+    dq, dr, metros = _NUCLEO
+    # Puntos x núcleo de una vez
+    restante = segundos_restantes[:, None] - metros[None, :] / planificador.VELOCIDAD_PIE
+    validas = restante >= 0
+    cq = (q[:, None] + dq[None, :])[validas]
+    cr = (r[:, None] + dr[None, :])[validas]
+    restante = restante[validas]
+    if len(restante) == 0:
+        return cq, cr, restante
+    # Máximo tiempo sobrante por celda
+    clave = (cq << 32) + (cr & 0xFFFFFFFF)
+    orden = np.lexsort((-restante, clave))
+    primera = np.ones(len(orden), dtype=bool)
+    primera[1:] = clave[orden][1:] != clave[orden][:-1]
+    elegidas = orden[primera]
+    return cq[elegidas], cr[elegidas], restante[elegidas]
+
+
+def _hexagonos(q, r, tamaño=TAMAÑO_CELDA):
+    # Anillos (lon, lat) de cada celda, con el primer vértice repetido al final
+    cx, cy = centros(q, r, tamaño)
+    angulos = np.radians(30 + 60 * np.arange(7))
+    vx = cx[:, None] + tamaño * np.cos(angulos)[None, :]
+    vy = cy[:, None] + tamaño * np.sin(angulos)[None, :]
+    lat, lon = desproyectar(vx, vy)
+    return np.round(np.stack([lon, lat], axis=-1), 5)
+
+
+def calcular(lat, lon, momento, minutos=MINUTOS):
+    """
+    FeatureCollection con un MultiPolygon por banda de `minutos`: las celdas
+    a las que se llega antes de cada límite (y no antes del anterior).
+    """
+    limite = max(minutos) * 60
+    red = planificador.red()
+    llegada = red.alcance((lat, lon), momento, limite)
+    t0 = momento.hour * 3600 + momento.minute * 60 + momento.second
+    alcanzadas = np.flatnonzero(llegada - t0 < limite)
+    # El origen cuenta como una parada más, alcanzada al salir
+    puntos_lat = np.append(red.tabla.parada_lat[alcanzadas], lat)
+    puntos_lon = np.append(red.tabla.parada_lon[alcanzadas], lon)
+    restante = np.append(limite - (llegada[alcanzadas] - t0), limite)
+    q, r, sobra = rasterizar(puntos_lat, puntos_lon, restante)
+    tiempo = (limite - sobra) / 60
+    anillos = _hexagonos(q, r)
+
+    features, anterior = [], -1
+    for m in sorted(minutos):
+        banda = (tiempo > anterior) & (tiempo <= m) if anterior >= 0 else tiempo <= m
+        features.append({
+            "type": "Feature",
+            "properties": {"minutos": m, "celdas": int(banda.sum())},
+            "geometry": {"type": "MultiPolygon", "coordinates": [[a] for a in anillos[banda].tolist()]},
+        })
+        anterior = m
+    return {"type": "FeatureCollection", "features": features, "paradas": int(len(alcanzadas))}
+
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def isocronas(lat, lon, momento, minutos=MINUTOS):
+    """
+    `calcular` con caché por (celda del origen, tramo de hora): el origen se
+    lleva al centro de su celda y la hora al inicio de su tramo de minutos.
+    """
+    q, r = celdas(*proyectar(lat, lon))
+    x, y = centros(q, r)
+    lat, lon = (float(v) for v in desproyectar(x, y))
+    momento = momento.replace(minute=momento.minute - momento.minute % TRAMO_MINUTOS, second=0, microsecond=0)
+    clave = (int(q), int(r), momento, tuple(minutos), planificador.red().tabla.firma)
+    with _lock:
+        resultado = _cache.get(clave)
+        if resultado is not None:
+            _cache.move_to_end(clave)
+            return resultado
+    resultado = calcular(lat, lon, momento, minutos)
+    resultado["origen"] = [lat, lon]
+    resultado["momento"] = momento.isoformat()
+    with _lock:
+        _cache[clave] = resultado
+        while len(_cache) > MAX_CACHE:
+            _cache.popitem(last=False)
+    return resultado
+
+
+def registrar_rutas(server):
+    @server.route(PREFIJO)
+    def servir_isocronas():
+        # ?lat=43.05&lon=-2.18&momento=2025-06-02T08:00[&minutos=15,30,45]
+        try:
+            lat, lon = float(request.args["lat"]), float(request.args["lon"])
+            # float() acepta "nan" e "inf": darían celdas inventadas (y se guardarían en la caché)
+            if not (math.isfinite(lat) and math.isfinite(lon)):
+                raise ValueError("coordenadas no finitas")
+            momento = salidas.ahora()
+            if "momento" in request.args:
+                momento = datetime.fromisoformat(request.args["momento"]).replace(tzinfo=None)
+            minutos = tuple(sorted({int(m) for m in request.args.get("minutos", "15,30,45").split(",")}))
+            if not minutos or minutos[0] <= 0 or minutos[-1] > 120:
+                raise ValueError("minutos fuera de rango")
+        except (KeyError, ValueError):
+            abort(400)
+        cuerpo = json.dumps(isocronas(lat, lon, momento, minutos), separators=(",", ":"))
+        return Response(cuerpo, mimetype="application/json", headers={"Cache-Control": "public, max-age=300"})
+
+    return servir_isocronas
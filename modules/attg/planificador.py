@@ -0,0 +1,412 @@
+"""
+Planificador de viajes sobre la red de autobuses de toda Gipuzkoa.
+
+Todos los feeds con stop_times.txt se unen en un único array de conexiones
+(tramo de un viaje entre dos paradas consecutivas) ordenado por hora de
+salida, y se recorren con el Connection Scan Algorithm: llegada más temprana
+(una pasada hacia delante que se corta en cuanto las salidas superan la mejor
+llegada) y perfiles de salida/llegada en una ventana (una pasada hacia atrás).
+Los transbordos a pie entre paradas cercanas, también entre operadores, salen
+del KD-tree de paradas de la tabla de salidas.
+"""
+import json
+import math
+import os
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+
+import numpy as np
+from flask import Response, abort, request
+
+from modules.attg import salidas
+from modules.attg.gtfs import a_dia
+from modules.comun.cercania import RADIO_TIERRA_M
+
+PREFIJO = "/api/itinerario"
+# Distancia máxima de un transbordo a pie entre paradas y del origen/destino a una parada
+RADIO_TRANSBORDO = float(os.environ.get("ITINERARIO_RADIO_TRANSBORDO", 300))
+RADIO_ACCESO = float(os.environ.get("ITINERARIO_RADIO_ACCESO", 800))
+VELOCIDAD_PIE = 1.2  # m/s, en línea recta
+# Tiempo mínimo para cambiar de autobús en la misma parada
+CAMBIO = 60
+# Duración máxima de un viaje en las consultas de perfil
+DURACION_MAXIMA = 4 * 3600
+DIA = salidas.DIA
+INF = float("inf")
+
+
+def a_pie(metros):
+    return int(math.ceil(metros / VELOCIDAD_PIE))
+
+
+def distancia(lat1, lon1, lat2, lon2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    h = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * RADIO_TIERRA_M * math.asin(math.sqrt(h))
+
+
+class Red:
+    """
+    Conexiones de todos los feeds. Las paradas y los viajes usan los códigos
+    globales de la tabla de salidas; `c_horario` apunta a la fila de
+    stop_times (concatenada) donde empieza cada conexión, para pintar las
+    paradas intermedias de un tramo.
+    """
+
+    def __init__(self, tabla):
+        self.tabla = tabla
+        self.n_paradas = len(tabla.parada_ids)
+        self.n_viajes = len(tabla.viaje_linea)
+        horario_parada, conexiones = [], []
+        desfase_parada = desfase_viaje = desfase_horario = 0
+        for f in tabla.feeds:
+            por_viaje = np.diff(f.horario_inicio)
+            viaje = np.repeat(np.arange(len(por_viaje)), por_viaje)
+            # Fila i -> i + 1 del mismo viaje
+            i = np.flatnonzero(viaje[:-1] == viaje[1:]) if len(viaje) else np.zeros(0, dtype=int)
+            validas = ((f.horario_parada[i] >= 0) & (f.horario_parada[i + 1] >= 0)
+                       & (f.horario_salida[i] >= 0) & (f.horario_llegada[i + 1] >= 0))
+            i = i[validas]
+            conexiones.append(np.column_stack([
+                f.horario_salida[i], f.horario_llegada[i + 1],
+                f.horario_parada[i] + desfase_parada, f.horario_parada[i + 1] + desfase_parada,
+                viaje[i] + desfase_viaje, i + desfase_horario,
+            ]).astype(np.int64))
+            horario_parada.append(np.where(f.horario_parada >= 0, f.horario_parada + desfase_parada, -1))
+            desfase_parada += len(f.parada_ids)
+            desfase_viaje += len(f.viaje_ids)
+            desfase_horario += len(f.horario_parada)
+        c = np.concatenate(conexiones) if conexiones else np.zeros((0, 6), dtype=np.int64)
+        c = c[np.lexsort((c[:, 1], c[:, 0]))]
+        self.c_salida, self.c_llegada, self.c_desde, self.c_hasta, self.c_viaje, self.c_horario = c.T
+        self.horario_parada = np.concatenate(horario_parada) if horario_parada else np.zeros(0, dtype=np.int64)
+
+        # Transbordos a pie: por parada, lista de (parada, segundos)
+        self.pasos = [[] for _ in range(self.n_paradas)]
+        for p in range(self.n_paradas):
+            if np.isnan(tabla.parada_lat[p]):
+                continue
+            idx, metros = tabla.arbol.en_radio(tabla.parada_lat[p], tabla.parada_lon[p], RADIO_TRANSBORDO)
+            self.pasos[p] = [(q, a_pie(m)) for q, m in zip(idx.tolist(), metros.tolist()) if q != p]
+        self._dias = {}
+        self._lock = threading.Lock()
+
+    def conexiones(self, dia):
+        """
+        Conexiones que circulan el día `dia`, como listas ordenadas por salida
+        (segundos desde la medianoche). Incluye las de viajes del día anterior
+        que pasan de las 24:00, con la hora rebajada un día.
+        """
+        c = self._dias.get(dia)
+        if c is not None:
+            return c
+        del_dia = np.flatnonzero(self.tabla.activos(dia)[self.c_viaje])
+        anterior = np.flatnonzero(self.tabla.activos(dia - 1)[self.c_viaje] & (self.c_salida >= DIA))
+        base = np.concatenate([del_dia, anterior])
+        salida = np.concatenate([self.c_salida[del_dia], self.c_salida[anterior] - DIA])
+        llegada = np.concatenate([self.c_llegada[del_dia], self.c_llegada[anterior] - DIA])
+        # Los viajes del día anterior son otros viajes a efectos del algoritmo
+        viaje = np.concatenate([self.c_viaje[del_dia], self.c_viaje[anterior] + self.n_viajes])
+        orden = np.lexsort((llegada, salida))
+        c = {
+            "salida": salida[orden].tolist(),
+            "llegada": llegada[orden].tolist(),
+            "desde": self.c_desde[base[orden]].tolist(),
+            "hasta": self.c_hasta[base[orden]].tolist(),
+            "viaje": viaje[orden].tolist(),
+            "base": base[orden],
+        }
+        with self._lock:
+            if len(self._dias) > 8:
+                self._dias.clear()
+            self._dias[dia] = c
+        return c
+
+    def accesos(self, extremo):
+        """
+        {parada: segundos a pie} de un extremo del viaje: una parada
+        (operador, stop_id) o un punto (lat, lon) con las paradas a menos de
+        RADIO_ACCESO (la parada incluye las de transbordo a pie). KeyError si
+        la parada no existe.
+        """
+        if isinstance(extremo[0], str):
+            parada = self.tabla.parada(*extremo)
+            if parada is None:
+                raise KeyError(extremo[1])
+            return {parada: 0, **dict(self.pasos[parada])}
+        idx, metros = self.tabla.arbol.en_radio(extremo[0], extremo[1], RADIO_ACCESO)
+        return {q: a_pie(m) for q, m in zip(idx.tolist(), metros.tolist())}
+
+    def lugar(self, extremo):
+        # Código de parada o punto (lat, lon), como los aceptan los tramos
+        if isinstance(extremo[0], str):
+            return self.tabla.parada(*extremo)
+        return float(extremo[0]), float(extremo[1])
+
+    def llegada_temprana(self, origen, destino, momento):
+        """
+        Itinerario que llega antes al destino saliendo del origen a partir de
+        `momento`, o None si no hay ninguno ese día. Entre los que llegan a
+        la misma hora se elige el que sale más tarde (sin esperas inútiles).
+        """
+        dia = a_dia(momento.date())
+        t0 = momento.hour * 3600 + momento.minute * 60 + momento.second
+        salidas_origen, llegadas = self.accesos(origen), self.accesos(destino)
+        c = self.conexiones(dia)
+        lugar_o, lugar_d = self.lugar(origen), self.lugar(destino)
+        directo = a_pie(distancia(*self._coordenadas(lugar_o), *self._coordenadas(lugar_d)))
+        directo = t0 + directo if directo <= RADIO_ACCESO / VELOCIDAD_PIE else INF
+
+        mejor, final, previo, _ = self._escanear(c, t0, salidas_origen, llegadas, directo)
+        if mejor == INF:
+            return None
+        medianoche = datetime.combine(momento.date(), datetime.min.time())
+        if final is None:
+            return self._itinerario([self._tramo_pie(lugar_o, lugar_d, t0, mejor, medianoche)])
+
+        # Última salida que llega igual de pronto: perfil en [t0, mejor] y segunda pasada desde ahí
+        opciones = [s for s, a in self._perfil(c, t0, mejor, mejor, salidas_origen, llegadas) if a <= mejor]
+        if opciones and opciones[-1] > t0:
+            t0 = opciones[-1]
+            mejor, final, previo, _ = self._escanear(c, t0, salidas_origen, llegadas, mejor + 1)
+
+        # Reconstrucción hacia atrás: tramo en autobús, y antes el transbordo a pie si lo hubo
+        salida, llegada, desde = c["salida"], c["llegada"], c["desde"]
+        tramos = []
+        entrada, i, h = final
+        tramos.append(self._tramo_pie(h, lugar_d, llegada[i], mejor, medianoche))
+        while True:
+            tramos.append(self._tramo_bus(c, entrada, i, medianoche))
+            p = desde[entrada]
+            if previo[p] is None:
+                tramos.append(self._tramo_pie(lugar_o, p, salida[entrada] - salidas_origen[p], salida[entrada], medianoche))
+                break
+            anterior_entrada, anterior_i, a_pie_desde = previo[p]
+            if a_pie_desde >= 0:
+                t = llegada[anterior_i]
+                tramos.append(self._tramo_pie(a_pie_desde, p, t, t + dict(self.pasos[a_pie_desde])[p], medianoche))
+            entrada, i = anterior_entrada, anterior_i
+        return self._itinerario([t for t in reversed(tramos) if t["tipo"] == "bus" or t["segundos"] > 0])
+
+    def _escanear(self, c, t0, salidas_origen, llegadas, mejor=INF):
+        """
+        Pasada hacia delante del CSA desde t0. Devuelve la mejor llegada, la
+        última conexión del itinerario (entrada, salida, parada) y, por
+        parada, cómo se llegó a ella y la hora más temprana a la que se llega.
+        Sin `llegadas` recorre todas las conexiones que salen antes de `mejor`.
+        """
+        salida, llegada, desde, hasta, viaje = c["salida"], c["llegada"], c["desde"], c["hasta"], c["viaje"]
+        # disponible[p]: hora a la que se puede subir a un autobús en p
+        disponible = [INF] * self.n_paradas
+        previo = [None] * self.n_paradas
+        alcanzada = [INF] * self.n_paradas
+        for p, w in salidas_origen.items():
+            disponible[p] = alcanzada[p] = t0 + w
+        final = None
+        subido = {}
+        for i in range(bisect_left(salida, t0), len(salida)):
+            if salida[i] >= mejor:
+                break
+            v = viaje[i]
+            entrada = subido.get(v)
+            if entrada is None:
+                if disponible[desde[i]] > salida[i]:
+                    continue
+                subido[v] = entrada = i
+            a, h = llegada[i], hasta[i]
+            if h in llegadas and a + llegadas[h] < mejor:
+                mejor, final = a + llegadas[h], (entrada, i, h)
+            if a < alcanzada[h]:
+                alcanzada[h] = a
+            if a + CAMBIO < disponible[h]:
+                disponible[h], previo[h] = a + CAMBIO, (entrada, i, -1)
+            for q, w in self.pasos[h]:
+                if a + w < disponible[q]:
+                    disponible[q], previo[q] = a + w, (entrada, i, h)
+                    alcanzada[q] = min(alcanzada[q], a + w)
+        return mejor, final, previo, alcanzada
+
+    def alcance(self, origen, momento, segundos):
+        """
+        Hora de llegada (segundos desde la medianoche) a cada parada saliendo
+        del origen en `momento`, como array; inf si no se llega en `segundos`.
+        """
+        t0 = momento.hour * 3600 + momento.minute * 60 + momento.second
+        c = self.conexiones(a_dia(momento.date()))
+        alcanzada = self._escanear(c, t0, self.accesos(origen), {}, t0 + segundos)[3]
+        return np.array(alcanzada, dtype=float)
+
+    def perfil(self, origen, destino, desde, hasta):
+        """
+        Salidas no dominadas entre `desde` y `hasta` (mismo día): lista de
+        (salida del origen, llegada al destino) en segundos, sin opciones que
+        salgan antes y lleguen más tarde que otra.
+        """
+        t0 = desde.hour * 3600 + desde.minute * 60 + desde.second
+        t1 = t0 + int((hasta - desde).total_seconds())
+        c = self.conexiones(a_dia(desde.date()))
+        return self._perfil(c, t0, t1, t1 + DURACION_MAXIMA, self.accesos(origen), self.accesos(destino))
+
+    def _perfil(self, c, t0, t1, limite, salidas_origen, llegadas):
+        # Pasada hacia atrás del CSA por las conexiones que salen entre t0 y `limite`
+        salida, llegada, c_desde, c_hasta, viaje = c["salida"], c["llegada"], c["desde"], c["hasta"], c["viaje"]
+        # Perfil por parada: salidas (decrecientes, negadas para bisect) y llegadas al destino
+        perfil_salida = [[] for _ in range(self.n_paradas)]
+        perfil_llegada = [[] for _ in range(self.n_paradas)]
+
+        def evaluar(p, t):
+            # Mejor llegada saliendo de p a partir de t: la última opción con salida >= t
+            k = bisect_right(perfil_salida[p], -t) - 1
+            return perfil_llegada[p][k] if k >= 0 else INF
+
+        mejor_viaje = {}
+        for i in range(bisect_left(salida, limite) - 1, bisect_left(salida, t0) - 1, -1):
+            a, h = llegada[i], c_hasta[i]
+            tc = a + llegadas[h] if h in llegadas else INF
+            tc = min(tc, mejor_viaje.get(viaje[i], INF), evaluar(h, a + CAMBIO))
+            for q, w in self.pasos[h]:
+                tc = min(tc, evaluar(q, a + w))
+            if tc == INF:
+                continue
+            mejor_viaje[viaje[i]] = tc
+            p = c_desde[i]
+            if not perfil_llegada[p] or tc < perfil_llegada[p][-1]:
+                perfil_salida[p].append(-salida[i])
+                perfil_llegada[p].append(tc)
+
+        opciones = []
+        for p, w in salidas_origen.items():
+            for s, a in zip(perfil_salida[p], perfil_llegada[p]):
+                if t0 <= -s - w <= t1:
+                    opciones.append((-s - w, a))
+        opciones.sort(key=lambda o: (-o[0], o[1]))
+        frente, mejor = [], INF
+        for s, a in opciones:
+            if a < mejor:
+                frente.append((s, a))
+                mejor = a
+        return frente[::-1]
+
+    def _coordenadas(self, lugar):
+        if isinstance(lugar, int):
+            return float(self.tabla.parada_lat[lugar]), float(self.tabla.parada_lon[lugar])
+        return lugar
+
+    def _lugar(self, p, hora, medianoche, punto=None):
+        lat, lon = punto or self._coordenadas(p)
+        lugar = {"lat": lat, "lon": lon, "hora": (medianoche + timedelta(seconds=hora)).isoformat()}
+        if p is not None:
+            lugar.update(operador=self.tabla.feeds[self.tabla.parada_feed[p]].nombre,
+                         parada=str(self.tabla.parada_ids[p]), nombre=str(self.tabla.parada_nombre[p]))
+        return lugar
+
+    def _tramo_pie(self, de, a, t_de, t_a, medianoche):
+        # `de` y `a`: código de parada o punto (lat, lon)
+        desde = self._lugar(de, t_de, medianoche) if isinstance(de, int) else self._lugar(None, t_de, medianoche, de)
+        hasta = self._lugar(a, t_a, medianoche) if isinstance(a, int) else self._lugar(None, t_a, medianoche, a)
+        return {
+            "tipo": "pie",
+            "desde": desde,
+            "hasta": hasta,
+            "segundos": int(t_a - t_de),
+            "puntos": [[desde["lat"], desde["lon"]], [hasta["lat"], hasta["lon"]]],
+        }
+
+    def _tramo_bus(self, c, entrada, i, medianoche):
+        base_entrada, base_i = c["base"][entrada], c["base"][i]
+        viaje = int(self.c_viaje[base_i])
+        paradas = self.horario_parada[self.c_horario[base_entrada]:self.c_horario[base_i] + 2]
+        paradas = paradas[paradas >= 0]
+        return {
+            "tipo": "bus",
+            "operador": self.tabla.feeds[self.tabla.parada_feed[c["desde"][entrada]]].nombre,
+            "linea": str(self.tabla.viaje_linea[viaje]),
+            "destino": str(self.tabla.viaje_destino[viaje]),
+            "desde": self._lugar(c["desde"][entrada], c["salida"][entrada], medianoche),
+            "hasta": self._lugar(c["hasta"][i], c["llegada"][i], medianoche),
+            "segundos": int(c["llegada"][i] - c["salida"][entrada]),
+            "puntos": np.column_stack([self.tabla.parada_lat[paradas], self.tabla.parada_lon[paradas]]).tolist(),
+        }
+
+    @staticmethod
+    def _itinerario(tramos):
+        salida, llegada = tramos[0]["desde"]["hora"], tramos[-1]["hasta"]["hora"]
+        return {
+            "salida": salida,
+            "llegada": llegada,
+            "minutos": round((datetime.fromisoformat(llegada) - datetime.fromisoformat(salida)).total_seconds() / 60),
+            "transbordos": max(sum(t["tipo"] == "bus" for t in tramos) - 1, 0),
+            "tramos": tramos,
+        }
+
+
+_red = None
+_lock = threading.Lock()
+
+
+def red():
+    """Red actual; se reconstruye cuando se reconstruye la tabla de salidas."""
+    global _red
+    tabla = salidas.tabla()
+    if _red is None or _red.tabla is not tabla:
+        with _lock:
+            if _red is None or _red.tabla is not tabla:
+                _red = Red(tabla)
+    return _red
+
+
+def planificar(origen, destino, momento=None):
+    """
+    Itinerario más rápido entre dos extremos, cada uno (lat, lon) o
+    (operador, stop_id), saliendo a partir de `momento` (por defecto ahora).
+    None si no hay conexión ese día; KeyError si una parada no existe.
+    """
+    return red().llegada_temprana(origen, destino, momento or salidas.ahora())
+
+
+def perfil(origen, destino, desde, hasta):
+    """Opciones (salida, llegada) no dominadas para salir entre `desde` y `hasta`."""
+    medianoche = datetime.combine(desde.date(), datetime.min.time())
+    return [
+        {"salida": (medianoche + timedelta(seconds=s)).isoformat(),
+         "llegada": (medianoche + timedelta(seconds=a)).isoformat(),
+         "minutos": round((a - s) / 60)}
+        for s, a in red().perfil(origen, destino, desde, hasta)
+    ]
+
+
+def leer_extremo(valor):
+    # "lat,lon" o "operador:stop_id"
+    if ":" in valor:
+        operador, _, stop_id = valor.partition(":")
+        return operador, stop_id
+    lat, lon = valor.split(",")
+    return float(lat), float(lon)
+
+
+def registrar_rutas(server):
+    @server.route(PREFIJO)
+    def servir_itinerario():
+        # ?origen=43.31,-1.98&destino=l_goierri:7600&momento=2025-06-02T08:00[&hasta=2025-06-02T12:00]
+        try:
+            origen = leer_extremo(request.args["origen"])
+            destino = leer_extremo(request.args["destino"])
+            momento = salidas.ahora()
+            if "momento" in request.args:
+                momento = datetime.fromisoformat(request.args["momento"]).replace(tzinfo=None)
+            if "hasta" in request.args:
+                hasta = datetime.fromisoformat(request.args["hasta"]).replace(tzinfo=None)
+                if hasta.date() != momento.date() or hasta < momento:
+                    raise ValueError("ventana fuera del día")
+                cuerpo = {"opciones": perfil(origen, destino, momento, hasta)}
+            else:
+                cuerpo = {"itinerario": planificar(origen, destino, momento)}
+        except KeyError as e:
+            abort(400 if e.args and e.args[0] in ("origen", "destino") else 404)
+        except ValueError:
+            abort(400)
+        return Response(json.dumps(cuerpo, ensure_ascii=False, separators=(",", ":")),
+                        mimetype="application/json", headers={"Cache-Control": "public, max-age=60"})
+
+    return servir_itinerario
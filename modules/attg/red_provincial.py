@@ -0,0 +1,263 @@
+"""
+Red de autobuses de toda Gipuzkoa en un solo mapa.
+
+Fusiona todos los feeds ATTG:
+- Paradas: las de distintos operadores a menos de RADIO_FUSION metros se
+  agrupan en una sola (rejilla de celdas del tamaño del radio: solo se
+  comparan puntos de celdas vecinas). Dos paradas del mismo operador no se
+  unen directamente, aunque pueden acabar en el mismo grupo a través de una
+  de otro operador cercana a las dos.
+- Recorridos: los vértices de todas las formas (o la secuencia de paradas
+  de los viajes, en los feeds sin shapes.txt) se ajustan a una rejilla de
+  REJILLA metros, los tramos repetidos entre operadores y viajes se
+  eliminan y lo que queda se encadena en polilíneas simplificadas. Los
+  feeds sin shapes.txt ni stop_times.txt (ekialdebus, euskotrenbus,
+  gipuzkoana y lbh) no aportan recorridos: solo sus paradas.
+
+El resultado se guarda comprimido en ARTEFACTOS_DIR, con la versión de los
+feeds en el nombre; se regenera al cambiar algún feed o con
+
+    python -m modules.attg.red_provincial
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from modules.attg.gtfs import almacen
+from modules.attg.isocronas import desproyectar, proyectar
+from modules.comun.artefactos import ARTEFACTOS_DIR, escribir_atomico
+
+RADIO_FUSION = float(os.environ.get("RED_RADIO_FUSION", 15))
+# Cambia con el criterio de fusión: invalida las redes guardadas
+FORMATO = 2
+# Lado de la rejilla de ajuste de los recorridos y tolerancia de la simplificación, en metros
+REJILLA = float(os.environ.get("RED_REJILLA", 10))
+TOLERANCIA = float(os.environ.get("RED_TOLERANCIA", 8))
+
+
+def agrupar_paradas(x, y, radio=RADIO_FUSION, operador=None):
+    """
+    Etiqueta de grupo por punto: componentes conexas de los pares a menos de
+    `radio` (y, si se da `operador`, de distinto operador). Los pares
+    candidatos salen de la rejilla (celda = radio) comparando cada celda con
+    ella misma y con sus vecinas, todo con arrays.
+    """
+    n = len(x)
+    etiqueta = np.arange(n)
+    if n == 0:
+        return etiqueta
+    cx, cy = np.floor(x / radio).astype(np.int64), np.floor(y / radio).astype(np.int64)
+    clave = (cx << 32) + (cy & 0xFFFFFFFF)
+    orden = np.argsort(clave, kind="stable")
+    ordenadas = clave[orden]
+    pares_i, pares_j = [], []
+    for dx, dy in ((0, 0), (1, -1), (1, 0), (1, 1), (0, 1)):
+        vecina = ((cx + dx) << 32) + ((cy + dy) & 0xFFFFFFFF)
+        inicio = np.searchsorted(ordenadas, vecina, side="left")
+        fin = np.searchsorted(ordenadas, vecina, side="right")
+        cuantos = fin - inicio
+        i = np.repeat(np.arange(n), cuantos)
+        j = orden[np.repeat(inicio - np.cumsum(cuantos) + cuantos, cuantos) + np.arange(cuantos.sum())]
+        if (dx, dy) == (0, 0):
+            i, j = i[i < j], j[i < j]
+        cerca = np.hypot(x[i] - x[j], y[i] - y[j]) <= radio
+        if operador is not None:
+            cerca &= operador[i] != operador[j]
+        pares_i.append(i[cerca])
+        pares_j.append(j[cerca])
+    i, j = np.concatenate(pares_i), np.concatenate(pares_j)
+    # Propagación de la etiqueta mínima hasta que no cambia (componentes conexas)
+    while len(i):
+        minimo = np.minimum(etiqueta[i], etiqueta[j])
+        anterior = etiqueta.copy()
+        np.minimum.at(etiqueta, i, minimo)
+        np.minimum.at(etiqueta, j, minimo)
+        etiqueta = etiqueta[etiqueta]
+        if np.array_equal(etiqueta, anterior):
+            break
+    return etiqueta
+
+
+def _paradas(feeds):
+    operador = np.concatenate([np.full(len(f.parada_ids), f.nombre, dtype=object) for f in feeds])
+    ids = np.concatenate([f.parada_ids.astype(object) for f in feeds])
+    nombre = np.concatenate([f.parada_nombre.astype(object) for f in feeds])
+    lat = np.concatenate([f.parada_lat for f in feeds]).astype(float)
+    lon = np.concatenate([f.parada_lon for f in feeds]).astype(float)
+    validas = ~(np.isnan(lat) | np.isnan(lon))
+    operador, ids, nombre, lat, lon = operador[validas], ids[validas], nombre[validas], lat[validas], lon[validas]
+    grupo = agrupar_paradas(*proyectar(lat, lon), operador=pd.factorize(operador)[0])
+
+    df = pd.DataFrame({"grupo": grupo, "operador": operador, "stop_id": ids, "nombre": nombre, "lat": lat, "lon": lon})
+    df["clave"] = df["operador"] + ":" + df["stop_id"]
+    return df.groupby("grupo", sort=False).agg(
+        nombre=("nombre", "first"),
+        lat=("lat", "mean"),
+        lon=("lon", "mean"),
+        operadores=("operador", lambda v: ", ".join(sorted(set(v)))),
+        paradas=("clave", lambda v: " ".join(v)),
+        n_paradas=("clave", "size"),
+    ).reset_index(drop=True)
+
+
+def _tramos(feeds):
+    # Vértices consecutivos de cada recorrido: formas y, sin shapes.txt, secuencias de paradas
+    a_lat, a_lon, b_lat, b_lon = [], [], [], []
+    for f in feeds:
+        if len(f.forma_lat):
+            forma = np.repeat(np.arange(len(f.forma_inicio) - 1), np.diff(f.forma_inicio))
+            i = np.flatnonzero(forma[:-1] == forma[1:])
+            lat, lon = f.forma_lat.astype(float), f.forma_lon.astype(float)
+        elif len(f.horario_parada):
+            viaje = np.repeat(np.arange(len(f.horario_inicio) - 1), np.diff(f.horario_inicio))
+            i = np.flatnonzero((viaje[:-1] == viaje[1:]) & (f.horario_parada[:-1] >= 0) & (f.horario_parada[1:] >= 0))
+            lat, lon = f.parada_lat[f.horario_parada].astype(float), f.parada_lon[f.horario_parada].astype(float)
+        else:
+            continue
+        a_lat.append(lat[i]), a_lon.append(lon[i]), b_lat.append(lat[i + 1]), b_lon.append(lon[i + 1])
+    if not a_lat:
+        return np.zeros((0, 2), dtype=np.int64), np.zeros((0, 2), dtype=np.int64), np.zeros(0, dtype=np.int64)
+    ax, ay = proyectar(np.concatenate(a_lat), np.concatenate(a_lon))
+    bx, by = proyectar(np.concatenate(b_lat), np.concatenate(b_lon))
+    coordenadas = np.column_stack([ax, ay, bx, by])
+    coordenadas = coordenadas[~np.isnan(coordenadas).any(axis=1)]
+    # Ajuste a la rejilla: los recorridos que pasan por la misma calle comparten vértices
+    nodos = np.round(coordenadas / REJILLA).astype(np.int64).reshape(-1, 2)
+    vertices, nodo = np.unique(nodos, axis=0, return_inverse=True)
+    nodo = nodo.reshape(-1, 2)
+    nodo = nodo[nodo[:, 0] != nodo[:, 1]]
+    # Tramo no dirigido y único
+    tramos, veces = np.unique(np.sort(nodo, axis=1), axis=0, return_counts=True)
+    return vertices, tramos, veces
+
+
+def _encadenar(tramos, n_nodos):
+    """Une los tramos en cadenas que se cortan en los cruces y extremos (grado distinto de 2)."""
+    extremos = np.concatenate([tramos[:, 0], tramos[:, 1]])
+    otros = np.concatenate([tramos[:, 1], tramos[:, 0]])
+    aristas = np.concatenate([np.arange(len(tramos))] * 2)
+    orden = np.argsort(extremos, kind="stable")
+    inicio = np.searchsorted(extremos[orden], np.arange(n_nodos + 1))
+    vecino, arista = otros[orden].tolist(), aristas[orden].tolist()
+    grado = np.diff(inicio).tolist()
+    inicio = inicio.tolist()
+    usada = [False] * len(tramos)
+
+    cadenas = []
+
+    def seguir(nodo, k):
+        cadena = [nodo]
+        while True:
+            usada[arista[k]] = True
+            nodo = vecino[k]
+            cadena.append(nodo)
+            if grado[nodo] != 2:
+                return cadena
+            siguiente = [m for m in range(inicio[nodo], inicio[nodo + 1]) if not usada[arista[m]]]
+            if not siguiente:
+                return cadena
+            k = siguiente[0]
+
+    # Primero desde cruces y extremos; lo que quede son anillos
+    for nodo in sorted(range(n_nodos), key=lambda v: grado[v] == 2):
+        for k in range(inicio[nodo], inicio[nodo + 1]):
+            if not usada[arista[k]]:
+                cadenas.append(seguir(nodo, k))
+    return cadenas
+
+
+def simplificar(x, y, tolerancia=TOLERANCIA):
+    """Douglas-Peucker sin recursión: máscara de los vértices que se conservan."""
+    n = len(x)
+    mantener = np.zeros(n, dtype=bool)
+    mantener[[0, n - 1]] = True
+    pendientes = [(0, n - 1)]
+    while pendientes:
+        a, b = pendientes.pop()
+        if b - a < 2:
+            continue
+        dx, dy = x[b] - x[a], y[b] - y[a]
+        largo = np.hypot(dx, dy)
+        px, py = x[a + 1:b] - x[a], y[a + 1:b] - y[a]
+        if largo == 0:
+            distancias = np.hypot(px, py)
+        else:
+            distancias = np.abs(dx * py - dy * px) / largo
+        k = int(np.argmax(distancias))
+        if distancias[k] > tolerancia:
+            mantener[a + 1 + k] = True
+            pendientes.extend(((a, a + 1 + k), (a + 1 + k, b)))
+    return mantener
+
+
+def fusionar(feeds=None):
+    """
+    Paradas agrupadas (DataFrame) y recorridos de toda la red como GeoJSON
+    con una sola MultiLineString.
+    """
+    feeds = almacen.feeds() if feeds is None else feeds
+    paradas = _paradas(feeds)
+    vertices, tramos, _ = _tramos(feeds)
+    lineas = []
+    if len(tramos):
+        x, y = vertices[:, 0] * REJILLA, vertices[:, 1] * REJILLA
+        lat, lon = desproyectar(x, y)
+        for cadena in _encadenar(tramos, len(vertices)):
+            cadena = np.array(cadena)
+            cadena = cadena[simplificar(x[cadena], y[cadena])]
+            lineas.append(np.round(np.column_stack([lon[cadena], lat[cadena]]), 5).tolist())
+    geojson = {
+        "type": "FeatureCollection",
+        "features": [{"type": "Feature", "properties": {"tramos": int(len(tramos))},
+                      "geometry": {"type": "MultiLineString", "coordinates": lineas}}],
+    }
+    return paradas, geojson
+
+
+def _ruta(version):
+    digest = hashlib.sha1(repr((FORMATO, version)).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(ARTEFACTOS_DIR, f"red_provincial-{digest}.json.gz")
+
+
+_red = (None, None)
+_lock = threading.Lock()
+
+
+def red_provincial():
+    """(paradas, geojson) de la versión actual de los feeds: de disco si ya está fusionada."""
+    global _red
+    version = almacen.version()
+    if _red[0] == version:
+        return _red[1]
+    with _lock:
+        if _red[0] == version:
+            return _red[1]
+        ruta = _ruta(version)
+        try:
+            with open(ruta, "rb") as f:
+                datos = json.loads(gzip.decompress(f.read()))
+            resultado = pd.DataFrame(datos["paradas"]), datos["lineas"]
+        except (OSError, ValueError):
+            resultado = fusionar()
+            try:
+                os.makedirs(ARTEFACTOS_DIR, exist_ok=True)
+                datos = {"paradas": resultado[0].to_dict("records"), "lineas": resultado[1]}
+                escribir_atomico(ruta, gzip.compress(json.dumps(datos, separators=(",", ":")).encode("utf-8")))
+            except OSError as e:
+                print(f"No se pudo guardar la red provincial: {e}")
+        _red = (version, resultado)
+    return resultado
+
+
+if __name__ == "__main__":
+    inicio = time.perf_counter()
+    paradas, lineas = red_provincial()
+    print(f"{len(paradas)} paradas agrupadas ({paradas['n_paradas'].sum()} de los feeds), "
+          f"{len(lineas['features'][0]['geometry']['coordinates'])} polilíneas "
+          f"({time.perf_counter() - inicio:.1f} s)")
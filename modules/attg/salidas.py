@@ -0,0 +1,271 @@
+"""
+Próximas salidas en las paradas de todos los operadores ATTG.
+
+Las salidas de todos los feeds con stop_times.txt se agrupan por parada y se
+ordenan por hora, así que "las próximas N salidas después de t" es un
+searchsorted por parada más la máscara de viajes que circulan ese día (el
+bitset de calendario de cada feed). Las paradas de distintos operadores en
+el mismo sitio tienen ids distintos: se consultan juntas todas las que estén
+a menos de `radio` metros.
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from html import escape
+from zoneinfo import ZoneInfo
+
+import numpy as np
+from flask import Response, abort, request
+
+from modules.attg.gtfs import COMPROBAR_CADA, a_dia, almacen, de_dia
+from modules.comun.cercania import ArbolKD
+
+PREFIJO = "/api/salidas"
+# Paradas a menos de esta distancia se consideran la misma (marquesinas de distintos operadores)
+RADIO_PARADA = float(os.environ.get("SALIDAS_RADIO", 75))
+SALIDAS_MAXIMO = 50
+ZONA = ZoneInfo(os.environ.get("GTFS_ZONA", "Europe/Madrid"))
+DIA = 86400
+
+
+def ahora():
+    # Hora local de Gipuzkoa aunque el servidor esté en UTC
+    return datetime.now(ZONA).replace(tzinfo=None)
+
+
+class TablaSalidas:
+    """
+    Salidas de todos los feeds. Las paradas y los viajes llevan un código
+    global (el del feed más el desplazamiento del feed); las salidas se
+    ordenan por (parada, hora) y `inicio` marca el tramo de cada parada.
+    La última parada de cada viaje no es una salida y no se incluye.
+    """
+
+    def __init__(self, feeds):
+        self.feeds = feeds
+        self.firma = tuple((f.nombre, f.firma) for f in feeds)
+        paradas, salidas, viajes = [], [], []
+        desfase_parada = desfase_viaje = 0
+        for f in feeds:
+            por_viaje = np.diff(f.horario_inicio)
+            viaje = np.repeat(np.arange(len(por_viaje)), por_viaje)
+            validas = (f.horario_parada >= 0) & (f.horario_salida >= 0)
+            validas[f.horario_inicio[1:][por_viaje > 0] - 1] = False
+            paradas.append(f.horario_parada[validas] + desfase_parada)
+            salidas.append(f.horario_salida[validas])
+            viajes.append(viaje[validas] + desfase_viaje)
+            desfase_parada += len(f.parada_ids)
+            desfase_viaje += len(f.viaje_ids)
+
+        parada = np.concatenate(paradas) if paradas else np.zeros(0, dtype=np.int64)
+        salida = np.concatenate(salidas) if salidas else np.zeros(0, dtype=np.int32)
+        viaje = np.concatenate(viajes) if viajes else np.zeros(0, dtype=np.int64)
+        orden = np.lexsort((salida, parada))
+        self.salida = salida[orden]
+        self.viaje = viaje[orden]
+        self.inicio = np.searchsorted(parada[orden], np.arange(desfase_parada + 1))
+
+        # Paradas y viajes globales
+        self.parada_feed = np.concatenate([np.full(len(f.parada_ids), i) for i, f in enumerate(feeds)] or [[]]).astype(int)
+        self.parada_ids = np.concatenate([f.parada_ids for f in feeds] or [[]])
+        self.parada_nombre = np.concatenate([f.parada_nombre for f in feeds] or [[]])
+        self.parada_lat = np.concatenate([f.parada_lat for f in feeds] or [[]]).astype(float)
+        self.parada_lon = np.concatenate([f.parada_lon for f in feeds] or [[]]).astype(float)
+        self._parada = {
+            (feeds[i].nombre, stop_id): p
+            for p, (i, stop_id) in enumerate(zip(self.parada_feed.tolist(), self.parada_ids.tolist()))
+        }
+        self.arbol = ArbolKD(self.parada_lat, self.parada_lon)
+        self.viaje_linea = np.concatenate([
+            np.where(f.viaje_ruta >= 0, f.ruta_nombre[np.maximum(f.viaje_ruta, 0)], "") for f in feeds
+        ] or [[]])
+        self.viaje_destino = np.concatenate([self._destinos(f) for f in feeds] or [[]])
+        # Feeds sin stop_times.txt (dbus, lbh, gipuzkoana...): sus paradas nunca tienen salidas
+        self.feed_con_horario = np.array([len(f.horario_parada) > 0 for f in feeds], dtype=bool)
+        self._activos = {}
+
+    @staticmethod
+    def _destinos(feed):
+        # Nombre de la última parada de cada viaje
+        fin = feed.horario_inicio[1:]
+        con_paradas = fin > feed.horario_inicio[:-1]
+        ultima = np.full(len(fin), -1)
+        ultima[con_paradas] = feed.horario_parada[fin[con_paradas] - 1]
+        return np.where(ultima >= 0, feed.parada_nombre[np.maximum(ultima, 0)], "")
+
+    def parada(self, feed, stop_id):
+        """Código global de la parada o None."""
+        return self._parada.get((feed, stop_id))
+
+    def cercanas(self, lat, lon, radio=RADIO_PARADA):
+        return self.arbol.en_radio(lat, lon, radio)[0]
+
+    def agrupadas(self, parada, radio=RADIO_PARADA):
+        """La parada y las de otros operadores a menos de `radio` metros."""
+        if not radio or np.isnan(self.parada_lat[parada]):
+            return np.array([parada])
+        return np.union1d(self.cercanas(self.parada_lat[parada], self.parada_lon[parada], radio), [parada])
+
+    def sin_horarios(self, paradas):
+        """True si ninguna de las paradas es de un operador que publique horarios."""
+        paradas = np.asarray(paradas, dtype=int)
+        return len(paradas) > 0 and not self.feed_con_horario[self.parada_feed[paradas]].any()
+
+    def activos(self, dia):
+        """Máscara global de viajes que circulan el día `dia` (días desde 1970-01-01)."""
+        mascara = self._activos.get(dia)
+        if mascara is None:
+            fecha = de_dia(dia)
+            mascara = np.concatenate([f.viajes_activos(fecha) for f in self.feeds] or [np.zeros(0, dtype=bool)])
+            if len(self._activos) > 16:
+                self._activos.clear()
+            self._activos[dia] = mascara
+        return mascara
+
+    def proximas(self, paradas, momento, n=10):
+        """
+        Las `n` primeras salidas desde `momento` en cualquiera de `paradas`.
+        Los viajes de un día de servicio pueden pasar de las 24:00, así que se
+        miran también los del día anterior (y los del siguiente, por si no hay
+        más ese día).
+        """
+        dia = a_dia(momento.date())
+        t = momento.hour * 3600 + momento.minute * 60 + momento.second
+        horas, indices = [], []
+        for desfase in (-1, 0, 1):
+            activos = self.activos(dia + desfase)
+            desde = t - desfase * DIA
+            for p in paradas:
+                a, b = self.inicio[p], self.inicio[p + 1]
+                idx = np.arange(a + np.searchsorted(self.salida[a:b], desde), b)
+                idx = idx[activos[self.viaje[idx]]][:n]
+                horas.append(self.salida[idx].astype(np.int64) + desfase * DIA)
+                indices.append(idx)
+        if not indices:
+            return []
+        horas, indices = np.concatenate(horas), np.concatenate(indices)
+        orden = np.argsort(horas, kind="stable")[:n]
+        medianoche = datetime.combine(momento.date(), datetime.min.time())
+        resultado = []
+        for hora, i in zip(horas[orden].tolist(), indices[orden].tolist()):
+            viaje = int(self.viaje[i])
+            parada = int(np.searchsorted(self.inicio, i, side="right") - 1)
+            salida = medianoche + timedelta(seconds=hora)
+            resultado.append({
+                "operador": self.feeds[self.parada_feed[parada]].nombre,
+                "parada": str(self.parada_ids[parada]),
+                "parada_nombre": str(self.parada_nombre[parada]),
+                "linea": str(self.viaje_linea[viaje]),
+                "destino": str(self.viaje_destino[viaje]),
+                "salida": salida.isoformat(),
+                "hora": salida.strftime("%H:%M"),
+                "minutos": max(int((salida - momento).total_seconds() // 60), 0),
+            })
+        return resultado
+
+
+_tabla = None
+_comprobada = 0
+_lock = threading.Lock()
+
+
+def tabla():
+    """Tabla de salidas actual; se reconstruye solo si cambia algún feed."""
+    global _tabla, _comprobada
+    if _tabla is not None and time.monotonic() - _comprobada < COMPROBAR_CADA:
+        return _tabla
+    feeds = almacen.feeds()
+    firma = tuple((f.nombre, f.firma) for f in feeds)
+    with _lock:
+        if _tabla is None or _tabla.firma != firma:
+            _tabla = TablaSalidas(feeds)
+        _comprobada = time.monotonic()
+    return _tabla
+
+
+def proximas_salidas(feed, stop_id, momento=None, n=10, radio=RADIO_PARADA):
+    """
+    Próximas `n` salidas en la parada `stop_id` del feed y en las de otros
+    operadores a menos de `radio` metros. KeyError si la parada no existe.
+    """
+    t = tabla()
+    parada = t.parada(feed, stop_id)
+    if parada is None:
+        raise KeyError(stop_id)
+    return t.proximas(t.agrupadas(parada, radio), momento or ahora(), n)
+
+
+def salidas_cercanas(lat, lon, momento=None, n=10, radio=RADIO_PARADA):
+    """Próximas `n` salidas en todas las paradas a menos de `radio` metros del punto."""
+    t = tabla()
+    return t.proximas(t.cercanas(lat, lon, radio), momento or ahora(), n)
+
+
+def sin_horarios(feed=None, stop_id=None, lat=None, lon=None, radio=RADIO_PARADA):
+    """
+    True si la parada (y las cercanas de otros operadores) o las paradas
+    alrededor del punto son todas de operadores sin stop_times.txt.
+    """
+    t = tabla()
+    if stop_id is not None:
+        parada = t.parada(feed, stop_id)
+        return parada is not None and t.sin_horarios(t.agrupadas(parada, radio))
+    return t.sin_horarios(t.cercanas(lat, lon, radio))
+
+
+def tabla_html(salidas, titulo=None, sin_horario=False):
+    # Fragmento para el popup de las paradas en el mapa
+    partes = [f"<b>{escape(titulo)}</b>"] if titulo else []
+    if not salidas and sin_horario:
+        partes.append("<p>El operador no publica horarios de paso.</p>")
+    elif not salidas:
+        partes.append("<p>Sin salidas próximas.</p>")
+    else:
+        filas = "".join(
+            f"<tr><td><b>{s['hora']}</b></td><td>{escape(s['linea'])}</td><td>{escape(s['destino'])}</td></tr>"
+            for s in salidas
+        )
+        partes.append(f'<table style="font-size: 12px; border-spacing: 6px 2px;">{filas}</table>')
+    return "".join(partes)
+
+
+def registrar_rutas(server):
+    @server.route(PREFIJO)
+    def servir_salidas():
+        # ?operador=l_goierri&parada=7600 o ?lat=43.05&lon=-2.18; &n=, &radio=, &momento= o &fecha=, &formato=html
+        try:
+            n = min(max(request.args.get("n", 10, type=int), 1), SALIDAS_MAXIMO)
+            radio = min(max(request.args.get("radio", RADIO_PARADA, type=float), 0), 1000)
+            momento = ahora()
+            if "momento" in request.args:
+                momento = datetime.fromisoformat(request.args["momento"]).replace(tzinfo=None)
+            elif "fecha" in request.args:
+                momento = datetime.combine(datetime.fromisoformat(request.args["fecha"]).date(), momento.time())
+            if "parada" in request.args:
+                salidas = proximas_salidas(request.args.get("operador"), request.args["parada"], momento, n, radio)
+                titulo = request.args.get("nombre")
+            else:
+                salidas = salidas_cercanas(float(request.args["lat"]), float(request.args["lon"]), momento, n, radio)
+                titulo = None
+        except KeyError as e:
+            # Parada desconocida; sin parada ni coordenadas es una petición mal formada
+            abort(400 if e.args and e.args[0] in ("lat", "lon") else 404)
+        except ValueError:
+            abort(400)
+
+        if request.args.get("formato") == "html":
+            sin_horario = False
+            if not salidas:
+                if "parada" in request.args:
+                    sin_horario = sin_horarios(request.args.get("operador"), request.args["parada"], radio=radio)
+                else:
+                    sin_horario = sin_horarios(lat=float(request.args["lat"]), lon=float(request.args["lon"]), radio=radio)
+            return Response(tabla_html(salidas, titulo, sin_horario), mimetype="text/html",
+                            headers={"Cache-Control": "public, max-age=30"})
+        cuerpo = json.dumps({"momento": momento.isoformat(), "salidas": salidas},
+                            ensure_ascii=False, separators=(",", ":"))
+        return Response(cuerpo, mimetype="application/json", headers={"Cache-Control": "public, max-age=30"})
+
+    return servir_salidas
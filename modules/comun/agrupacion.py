@@ -0,0 +1,219 @@
+import gzip
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from flask import Response, abort, request
+
+from modules.comun.artefactos import ARTEFACTOS_DIR, escribir_atomico, registrar_referencias, tocar
+
+PREFIJO = "/api/clusters"
+_HASH_VALIDO = re.compile(r"^[0-9a-f]{32}$")
+# Índices de agrupación que se mantienen en memoria a la vez
+MAX_INDICES = int(os.environ.get("AGRUPACION_MAX_INDICES", 16))
+
+
+def _proyectar(lon, lat):
+    # Web Mercator normalizado a [0, 1]
+    x = lon / 360.0 + 0.5
+    s = np.clip(np.sin(np.radians(lat)), -0.9999, 0.9999)
+    y = 0.5 - 0.25 * np.log((1 + s) / (1 - s)) / np.pi
+    return x, np.clip(y, 0.0, 1.0)
+
+
+def _desproyectar(x, y):
+    lon = (x - 0.5) * 360.0
+    lat = np.degrees(2 * np.arctan(np.exp((0.5 - y) * 2 * np.pi))) - 90.0
+    return lon, lat
+
+
+class IndiceAgrupado:
+    """
+    Agrupación jerárquica de puntos por rejilla, al estilo de Supercluster.
+
+    Para cada zoom entre `zoom_min` y `zoom_max` los puntos se agrupan en
+    celdas de `radio` píxeles (sobre teselas de `extension` píxeles). Las
+    celdas de un zoom están contenidas exactamente en las del zoom anterior,
+    así que cada grupo se divide en los del zoom siguiente. Por encima de
+    `zoom_max` se devuelven los puntos sueltos.
+    """
+
+    def __init__(self, lon, lat, radio=60, extension=512, zoom_min=0, zoom_max=16):
+        self.zoom_min = zoom_min
+        self.zoom_max = zoom_max
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        self.n = len(lon)
+        x, y = _proyectar(lon, lat)
+
+        orden = np.argsort(lon, kind="stable")
+        self.niveles = {zoom_max + 1: {
+            "lon": lon[orden], "lat": lat[orden],
+            "n": np.ones(self.n, dtype=np.int32),
+            "punto": orden.astype(np.int32),
+            "expansion": np.full(self.n, zoom_max + 1, dtype=np.int8),
+        }}
+
+        # Del zoom más alto al más bajo, enlazando cada celda con su hija única
+        # para calcular a qué zoom hay que ir para que el grupo se divida
+        inversa_hija = None
+        expansion_hija = None
+        for z in range(zoom_max, zoom_min - 1, -1):
+            escala = extension * 2 ** z / radio
+            clave = (np.floor(x * escala).astype(np.int64) << 32) | np.floor(y * escala).astype(np.int64)
+            _, primero, inversa, cuenta = np.unique(clave, return_index=True, return_inverse=True, return_counts=True)
+            celdas = len(cuenta)
+
+            cx, cy = _desproyectar(
+                np.bincount(inversa, weights=x, minlength=celdas) / cuenta,
+                np.bincount(inversa, weights=y, minlength=celdas) / cuenta,
+            )
+            if inversa_hija is None:
+                # Por debajo están los puntos: el grupo se deshace en el zoom siguiente
+                expansion = np.full(celdas, z + 1, dtype=np.int8)
+            else:
+                padre = inversa[primero_hija]
+                hijos = np.bincount(padre, minlength=celdas)
+                unica = np.zeros(celdas, dtype=np.int64)
+                unica[padre] = np.arange(len(padre))
+                expansion = np.where(hijos > 1, z + 1, expansion_hija[unica]).astype(np.int8)
+
+            orden = np.argsort(cx, kind="stable")
+            self.niveles[z] = {
+                "lon": cx[orden], "lat": cy[orden],
+                "n": cuenta[orden].astype(np.int32),
+                "punto": primero[orden].astype(np.int32),
+                "expansion": expansion[orden],
+            }
+            inversa_hija, primero_hija, expansion_hija = inversa, primero, expansion
+
+    def consultar(self, bbox, zoom):
+        """
+        Devuelve los grupos visibles en `bbox` (oeste, sur, este, norte) al zoom
+        dado como dicts con lon, lat, n, punto (índice si n == 1), expansión e id.
+        """
+        z = min(max(int(math.floor(zoom)), self.zoom_min), self.zoom_max + 1)
+        nivel = self.niveles[z]
+        oeste, sur, este, norte = bbox
+        ini = np.searchsorted(nivel["lon"], oeste, side="left")
+        fin = np.searchsorted(nivel["lon"], este, side="right")
+        lat = nivel["lat"][ini:fin]
+        dentro = np.flatnonzero((lat >= sur) & (lat <= norte)) + ini
+        return [
+            {
+                "id": int(i) * 32 + z,
+                "lon": float(nivel["lon"][i]),
+                "lat": float(nivel["lat"][i]),
+                "n": int(nivel["n"][i]),
+                "punto": int(nivel["punto"][i]),
+                "expansion": int(nivel["expansion"][i]),
+            }
+            for i in dentro
+        ]
+
+
+class _Conjunto:
+    def __init__(self, geojson):
+        self.features = geojson["features"]
+        coords = np.array([f["geometry"]["coordinates"] for f in self.features], dtype=float).reshape(-1, 2)
+        self.indice = IndiceAgrupado(coords[:, 0], coords[:, 1])
+
+
+_conjuntos = OrderedDict()
+_lock = threading.Lock()
+# Conjuntos publicados por este proceso: los enlazan mapas que pueden seguir en caché
+_publicados = set()
+registrar_referencias(lambda: list(_publicados))
+
+
+def _ruta(digest):
+    return os.path.join(ARTEFACTOS_DIR, f"{digest}.puntos.json.gz")
+
+
+def publicar_puntos(geojson):
+    """
+    Guarda una FeatureCollection de puntos direccionada por contenido y
+    devuelve la URL del endpoint de grupos. El índice se construye una vez
+    por conjunto de datos, en la primera consulta.
+    """
+    os.makedirs(ARTEFACTOS_DIR, exist_ok=True)
+    datos = json.dumps(geojson, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+    digest = hashlib.sha256(datos).hexdigest()[:32]
+    if not os.path.exists(_ruta(digest)):
+        escribir_atomico(_ruta(digest), gzip.compress(datos, compresslevel=6))
+    else:
+        tocar(_ruta(digest))
+    _publicados.add(digest)
+    return f"{PREFIJO}/{digest}"
+
+
+def obtener_conjunto(digest):
+    with _lock:
+        conjunto = _conjuntos.get(digest)
+        if conjunto is not None:
+            _conjuntos.move_to_end(digest)
+    if conjunto is not None:
+        # Servido desde memoria, pero el fichero sigue en uso
+        tocar(_ruta(digest))
+        return conjunto
+    try:
+        with open(_ruta(digest), "rb") as f:
+            geojson = json.loads(gzip.decompress(f.read()))
+    except FileNotFoundError:
+        return None
+    tocar(_ruta(digest))
+    conjunto = _Conjunto(geojson)
+    with _lock:
+        _conjuntos[digest] = conjunto
+        while len(_conjuntos) > MAX_INDICES:
+            _conjuntos.popitem(last=False)
+    return conjunto
+
+
+def leer_bbox(texto):
+    partes = [float(v) for v in texto.split(",")]
+    if len(partes) != 4:
+        raise ValueError("bbox debe ser oeste,sur,este,norte")
+    # float() acepta "nan" e "inf", que no se pueden pasar a celdas
+    if not all(math.isfinite(v) for v in partes):
+        raise ValueError("bbox con valores no finitos")
+    return partes
+
+
+def registrar_rutas(server):
+    @server.route(f"{PREFIJO}/<digest>")
+    def servir_grupos(digest):
+        if not _HASH_VALIDO.match(digest):
+            abort(404)
+        try:
+            bbox = leer_bbox(request.args.get("bbox", "-180,-90,180,90"))
+            zoom = float(request.args.get("zoom", 0))
+            if not math.isfinite(zoom):
+                raise ValueError("zoom no finito")
+        except ValueError:
+            abort(400)
+
+        conjunto = obtener_conjunto(digest)
+        if conjunto is None:
+            abort(404)
+
+        features = []
+        for grupo in conjunto.indice.consultar(bbox, zoom):
+            if grupo["n"] == 1:
+                features.append(conjunto.features[grupo["punto"]])
+                continue
+            features.append({
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [grupo["lon"], grupo["lat"]]},
+                "properties": {"cluster": True, "id": grupo["id"], "n": grupo["n"], "expansion": grupo["expansion"]},
+            })
+        cuerpo = json.dumps({"type": "FeatureCollection", "features": features}, ensure_ascii=False, separators=(",", ":"))
+        # El conjunto es inmutable: la misma consulta siempre da la misma respuesta
+        return Response(cuerpo, mimetype="application/json", headers={"Cache-Control": "public, max-age=86400"})
+
+    return servir_grupos
@@ -0,0 +1,163 @@
+import gzip
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+from flask import Response, abort, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Los mapas renderizados se guardan en disco direccionados por contenido, así
+# cualquier worker puede servirlos y el navegador/proxy puede cachearlos para siempre
+ARTEFACTOS_DIR = os.environ.get("ARTEFACTOS_DIR", os.path.join(tempfile.gettempdir(), "gipuzkoa-move-mapas"))
+ARTEFACTOS_DIAS = int(os.environ.get("ARTEFACTOS_DIAS", 7))
+PREFIJO = "/mapas"
+
+_HASH_VALIDO = re.compile(r"^[0-9a-f]{32}$")
+# Lo único que borra la limpieza: artefactos direccionados por contenido (mapas y puntos) y
+# temporales. Índices, manifiestos y cachés con nombre propio los gestiona su módulo
+_BORRABLES = re.compile(r"^([0-9a-f]{32})\.(html\.gz|html\.br|puntos\.json\.gz)$")
+_DIGEST = re.compile(r"([0-9a-f]{32})")
+# Un artefacto publicado o servido se "toca" (mtime) como mucho una vez por este intervalo
+TOCAR_CADA = 3600
+_publicados = 0
+_tocados = {}
+_referencias = []
+
+
+def escribir_atomico(ruta, datos):
+    # Escritura atómica para que otro proceso nunca lea un fichero a medias
+    fd, tmp = tempfile.mkstemp(dir=ARTEFACTOS_DIR, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(datos)
+    os.replace(tmp, ruta)
+
+
+def tocar(ruta):
+    """Actualiza el mtime de un artefacto en uso para que la limpieza no lo borre."""
+    ahora = time.time()
+    if ahora - _tocados.get(ruta, 0) < TOCAR_CADA:
+        return
+    _tocados[ruta] = ahora
+    try:
+        os.utime(ruta)
+    except OSError:
+        pass
+
+
+def registrar_referencias(funcion):
+    """
+    `funcion()` devuelve las URL (o digests) de artefactos que siguen
+    enlazados (cachés de URL, layouts, índices): la limpieza no los borra
+    aunque sean antiguos.
+    """
+    _referencias.append(funcion)
+    return funcion
+
+
+def existe(url):
+    """False si la URL es de un mapa publicado cuyo fichero ya no está."""
+    digest = _DIGEST.search(url or "")
+    if not url or not url.startswith(PREFIJO) or digest is None:
+        return True
+    return os.path.exists(os.path.join(ARTEFACTOS_DIR, f"{digest.group(1)}.html.gz"))
+
+
+def limpiar_artefactos(max_dias=ARTEFACTOS_DIAS):
+    limite = time.time() - max_dias * 86400
+    en_uso = set()
+    for funcion in _referencias:
+        try:
+            for url in funcion():
+                digest = _DIGEST.search(url or "")
+                if digest:
+                    en_uso.add(digest.group(1))
+        except Exception as e:
+            # Sin saber qué está en uso no se borra nada
+            print(f"No se pudieron leer las referencias de artefactos: {e}")
+            return
+    with os.scandir(ARTEFACTOS_DIR) as it:
+        for entrada in it:
+            nombre = _BORRABLES.match(entrada.name)
+            if nombre is None and not entrada.name.endswith(".tmp"):
+                continue
+            if nombre is not None and nombre.group(1) in en_uso:
+                continue
+            if entrada.is_file() and entrada.stat().st_mtime < limite:
+                try:
+                    os.remove(entrada.path)
+                except OSError:
+                    pass
+    _tocados.clear()
+
+
+def publicar(html):
+    """
+    Guarda el HTML comprimido (gzip y, si está disponible, brotli) y devuelve
+    la URL corta con la que el iframe puede cargarlo.
+    """
+    global _publicados
+    os.makedirs(ARTEFACTOS_DIR, exist_ok=True)
+    datos = html.encode("utf-8")
+    digest = hashlib.sha256(datos).hexdigest()[:32]
+
+    ruta_gz = os.path.join(ARTEFACTOS_DIR, f"{digest}.html.gz")
+    if not os.path.exists(ruta_gz):
+        escribir_atomico(ruta_gz, gzip.compress(datos, compresslevel=6))
+    else:
+        tocar(ruta_gz)
+    ruta_br = os.path.join(ARTEFACTOS_DIR, f"{digest}.html.br")
+    if brotli is not None:
+        if not os.path.exists(ruta_br):
+            escribir_atomico(ruta_br, brotli.compress(datos, quality=5))
+        else:
+            tocar(ruta_br)
+
+    _publicados += 1
+    if _publicados % 200 == 0:
+        limpiar_artefactos()
+    return f"{PREFIJO}/{digest}.html"
+
+
+def registrar_rutas(server):
+    @server.route(f"{PREFIJO}/<digest>.html")
+    def servir_mapa(digest):
+        if not _HASH_VALIDO.match(digest):
+            abort(404)
+
+        cabeceras = {
+            "ETag": f'"{digest}"',
+            "Cache-Control": "public, max-age=31536000, immutable",
+            "Vary": "Accept-Encoding",
+        }
+        if digest in request.if_none_match:
+            return Response(status=304, headers=cabeceras)
+
+        ruta_gz = os.path.join(ARTEFACTOS_DIR, f"{digest}.html.gz")
+        ruta_br = os.path.join(ARTEFACTOS_DIR, f"{digest}.html.br")
+        aceptadas = request.accept_encodings
+        if brotli is not None and "br" in aceptadas and os.path.exists(ruta_br):
+            ruta, codificacion = ruta_br, "br"
+        elif os.path.exists(ruta_gz):
+            ruta, codificacion = ruta_gz, "gzip" if "gzip" in aceptadas else None
+        else:
+            abort(404)
+        # Las dos codificaciones se mantienen juntas: se sirva la que se sirva, siguen en uso
+        tocar(ruta_gz)
+        if brotli is not None:
+            tocar(ruta_br)
+
+        with open(ruta, "rb") as f:
+            datos = f.read()
+        if codificacion is None:
+            datos = gzip.decompress(datos)
+        else:
+            cabeceras["Content-Encoding"] = codificacion
+        return Response(datos, mimetype="text/html", headers=cabeceras)
+
+    return servir_mapa
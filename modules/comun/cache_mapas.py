@@ -0,0 +1,192 @@
+import functools
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from modules.comun.artefactos import existe, publicar, registrar_referencias
+
+# Presupuesto total de memoria para HTML renderizado (MB)
+CACHE_MAPAS_MB = int(os.environ.get("CACHE_MAPAS_MB", 256))
+
+
+def version_ficheros(*rutas):
+    """
+    Versión de datos a partir de mtime y tamaño de ficheros o carpetas.
+    Las carpetas se recorren (un nivel) para detectar ficheros nuevos o modificados.
+    """
+    partes = []
+    for ruta in rutas:
+        try:
+            st = os.stat(ruta)
+        except OSError:
+            partes.append((ruta, None))
+            continue
+        partes.append((ruta, st.st_mtime_ns, st.st_size))
+        if os.path.isdir(ruta):
+            with os.scandir(ruta) as it:
+                for entrada in it:
+                    st_e = entrada.stat()
+                    partes.append((entrada.name, st_e.st_mtime_ns, st_e.st_size))
+    return hashlib.sha1(repr(sorted(partes, key=repr)).encode("utf-8")).hexdigest()[:16]
+
+
+def version_dataframe(df):
+    import pandas as pd
+    if df is None or df.empty:
+        return "vacio"
+    return hashlib.sha1(pd.util.hash_pandas_object(df, index=False).values.tobytes()).hexdigest()[:16]
+
+
+class CacheMapas:
+    """
+    Caché LRU de HTML de mapas renderizados. La clave es (fuente, parámetros,
+    versión de datos); cada fuente tiene su propio TTL y el total está limitado
+    por un presupuesto en bytes.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.ttl = {}
+        self._entradas = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._en_curso = {}
+        self._stats = {}
+
+    def configurar(self, fuente, ttl):
+        # Permite sobreescribir el TTL por entorno, p. ej. CACHE_MAPAS_TTL_AFORO=3600
+        ttl_env = os.environ.get(f"CACHE_MAPAS_TTL_{fuente.upper()}")
+        self.ttl[fuente] = float(ttl_env) if ttl_env else ttl
+
+    def _stat(self, fuente):
+        return self._stats.setdefault(fuente, {"hits": 0, "misses": 0, "expirados": 0, "desalojados": 0})
+
+    def _buscar(self, clave):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None
+            html, tam, expira = entrada
+            if expira is not None and expira < time.monotonic():
+                del self._entradas[clave]
+                self._bytes -= tam
+                self._stat(clave[0])["expirados"] += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self._stat(clave[0])["hits"] += 1
+            return html
+
+    def _guardar(self, clave, html):
+        tam = len(html.encode("utf-8"))
+        if tam > self.max_bytes:
+            return
+        ttl = self.ttl.get(clave[0])
+        expira = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            anterior = self._entradas.pop(clave, None)
+            if anterior is not None:
+                self._bytes -= anterior[1]
+            self._entradas[clave] = (html, tam, expira)
+            self._bytes += tam
+            while self._bytes > self.max_bytes and self._entradas:
+                clave_vieja, (_, tam_viejo, _) = self._entradas.popitem(last=False)
+                self._bytes -= tam_viejo
+                self._stat(clave_vieja[0])["desalojados"] += 1
+
+    def obtener(self, fuente, parametros, version, generar):
+        clave = (fuente, parametros, version)
+        html = self._buscar(clave)
+        if html is not None:
+            return html
+
+        # Una sola generación por clave aunque lleguen varias peticiones a la vez
+        with self._lock:
+            lock_clave = self._en_curso.setdefault(clave, threading.Lock())
+        with lock_clave:
+            html = self._buscar(clave)
+            if html is not None:
+                return html
+            with self._lock:
+                self._stat(fuente)["misses"] += 1
+            try:
+                html = generar()
+                if isinstance(html, str):
+                    self._guardar(clave, html)
+                return html
+            finally:
+                with self._lock:
+                    self._en_curso.pop(clave, None)
+
+    def descartar(self, clave):
+        with self._lock:
+            entrada = self._entradas.pop(clave, None)
+            if entrada is not None:
+                self._bytes -= entrada[1]
+
+    def urls(self):
+        """URL de artefactos guardadas por `cachear_mapa(...).url`."""
+        with self._lock:
+            return [html for (_, parametros, _), (html, _, _) in self._entradas.items()
+                    if isinstance(parametros, tuple) and parametros[:1] == ("url",)]
+
+    def invalidar(self, fuente=None):
+        with self._lock:
+            for clave in [c for c in self._entradas if fuente is None or c[0] == fuente]:
+                self._bytes -= self._entradas.pop(clave)[1]
+
+    def estadisticas(self):
+        with self._lock:
+            por_fuente = {
+                f: dict(self._stat(f), entradas=0, bytes=0, ttl=self.ttl.get(f))
+                for f in set(self._stats) | set(self.ttl)
+            }
+            for (fuente, _, _), (_, tam, _) in self._entradas.items():
+                por_fuente[fuente]["entradas"] += 1
+                por_fuente[fuente]["bytes"] += tam
+            return {
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "entradas": len(self._entradas),
+                "fuentes": por_fuente,
+            }
+
+
+cache_mapas = CacheMapas(max_bytes=CACHE_MAPAS_MB * 1024 * 1024)
+registrar_referencias(cache_mapas.urls)
+
+
+def cachear_mapa(fuente, ttl=None, version=None, clave=None):
+    """
+    Decorador para funciones que devuelven el HTML de un mapa.
+    - `version(*args, **kwargs)` devuelve la versión de los datos (mtime, hash, ETag...).
+    - `clave(*args, **kwargs)` convierte los argumentos en una clave hashable
+      (por defecto se usan tal cual).
+    """
+    cache_mapas.configurar(fuente, ttl)
+
+    def decorador(func):
+        @functools.wraps(func)
+        def envoltura(*args, **kwargs):
+            parametros = clave(*args, **kwargs) if clave else (args, tuple(sorted(kwargs.items())))
+            v = version(*args, **kwargs) if version else None
+            return cache_mapas.obtener(fuente, parametros, v, lambda: func(*args, **kwargs))
+
+        @functools.wraps(func)
+        def url(*args, **kwargs):
+            # URL del artefacto publicado; se cachea junto al HTML para no
+            # volver a hashear varios MB en cada petición
+            parametros = clave(*args, **kwargs) if clave else (args, tuple(sorted(kwargs.items())))
+            v = version(*args, **kwargs) if version else None
+            publicada = cache_mapas.obtener(fuente, ("url", parametros), v, lambda: publicar(envoltura(*args, **kwargs)))
+            if not existe(publicada):
+                # Otro proceso ha limpiado el fichero: se vuelve a publicar
+                cache_mapas.descartar((fuente, ("url", parametros), v))
+                publicada = cache_mapas.obtener(fuente, ("url", parametros), v, lambda: publicar(envoltura(*args, **kwargs)))
+            return publicada
+
+        envoltura.sin_cache = func
+        envoltura.url = url
+        return envoltura
+    return decorador
@@ -0,0 +1,237 @@
+import json
+import re
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+from branca.element import MacroElement
+from jinja2 import Template
+
+from modules.comun.agrupacion import publicar_puntos
+
+# Capas servidas por modules.comun.capas
+PREFIJO_CAPAS = "/api/layers"
+
+# {campo} se escapa como texto; {!campo} se inserta tal cual (HTML ya preparado)
+_CAMPO = re.compile(r"\{!?([^{}\s!][^{}\s]*)\}")
+
+
+def json_script(obj):
+    # "</" se escapa para que ningún valor pueda cerrar el <script>
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str).replace("</", "<\\/")
+
+
+def _campos(*plantillas):
+    campos = []
+    for plantilla in plantillas:
+        for campo in _CAMPO.findall(plantilla or ""):
+            if campo not in campos:
+                campos.append(campo)
+    return campos
+
+
+def _columna(valor, n):
+    # Constante -> None (va en las opciones de la capa); array/Series -> lista por punto
+    if valor is None or isinstance(valor, str):
+        return None
+    valores = np.asarray(valor, dtype=object)
+    if len(valores) != n:
+        raise ValueError(f"Se esperaban {n} valores y llegaron {len(valores)}")
+    return valores.tolist()
+
+
+def puntos_geojson(df, lat="lat", lon="lon", propiedades=(), extra=None):
+    """
+    Convierte las columnas de `df` en una FeatureCollection de puntos sin
+    recorrer filas con iterrows. `extra` añade propiedades calculadas
+    ({nombre: lista}). Los NaN se convierten en null.
+    """
+    coords = np.column_stack([
+        pd.to_numeric(df[lon], errors="coerce").to_numpy(dtype=float),
+        pd.to_numeric(df[lat], errors="coerce").to_numpy(dtype=float),
+    ])
+    validos = ~np.isnan(coords).any(axis=1)
+
+    columnas = {}
+    for campo in propiedades:
+        if campo in df.columns:
+            serie = df[campo].astype(object)
+            columnas[campo] = serie.where(serie.notna(), None).tolist()
+    for nombre, valores in (extra or {}).items():
+        if valores is not None:
+            columnas[nombre] = valores
+
+    nombres = list(columnas)
+    filas = zip(*columnas.values()) if nombres else repeat(())
+    features = []
+    for (x, y), valido, fila in zip(coords.tolist(), validos, filas):
+        if not valido:
+            continue
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [x, y]},
+            "properties": dict(zip(nombres, fila)),
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+class CapaPuntos(MacroElement):
+    """
+    Capa de marcadores para folium: un único L.geoJSON con todos los puntos en
+    lugar de un folium.Marker por fila. Los popups y tooltips se pintan en el
+    navegador a partir de plantillas con {campo}, solo al abrirlos.
+
+    `color` e `icono` pueden ser una constante o un array con un valor por fila.
+    Con `agrupar=True` los puntos no se incrustan en el HTML: se publican como
+    conjunto de datos y el mapa pide al servidor los grupos de cada vista.
+    Con `capa` se cargan los puntos de la vista desde /api/layers/<capa> (sin
+    `df`; el color y el icono por punto llegan en las propiedades `_color` e
+    `_icono`), refrescando cada `refresco` segundos si se indica.
+    Con `popup_url` (plantilla de URL, los campos se codifican) el popup se
+    pide al servidor al abrirlo; `popup` queda como texto mientras carga.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = (function() {
+            var opciones = {{ this.opciones }};
+            function escapar(v) {
+                return String(v).replace(/[&<>"']/g, function(c) {
+                    return {"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#39;"}[c];
+                });
+            }
+            function pintar(plantilla, p, codificar) {
+                return plantilla.replace(/\\{(!?)([^{}\\s!][^{}\\s]*)\\}/g, function(_, crudo, campo) {
+                    var v = p[campo];
+                    if (v === null || v === undefined) v = opciones.vacio;
+                    return crudo ? String(v) : (codificar || escapar)(v);
+                });
+            }
+            var mapa = {{ this._parent.get_name() }};
+            var capa = L.geoJSON(null, {
+                pointToLayer: function(f, latlng) {
+                    var p = f.properties;
+                    if (p.cluster) {
+                        var lado = p.n < 10 ? 30 : p.n < 100 ? 36 : 44;
+                        return L.marker(latlng, {icon: L.divIcon({
+                            html: '<div style="width:' + lado + 'px;height:' + lado + 'px;line-height:' + lado + 'px;' +
+                                  'border-radius:50%;background:rgba(0,123,255,0.75);color:white;' +
+                                  'text-align:center;font:bold 12px sans-serif;border:3px solid rgba(255,255,255,0.8)">' + p.n + '</div>',
+                            className: "",
+                            iconSize: [lado, lado]
+                        })});
+                    }
+                    return L.marker(latlng, {icon: L.AwesomeMarkers.icon({
+                        markerColor: p._color || opciones.color,
+                        icon: p._icono || opciones.icono,
+                        prefix: opciones.prefijo,
+                        iconColor: "white",
+                        extraClasses: "fa-rotate-0"
+                    })});
+                },
+                onEachFeature: function(f, capa) {
+                    if (f.properties.cluster) {
+                        capa.on("click", function() { mapa.setView(capa.getLatLng(), f.properties.expansion); });
+                        return;
+                    }
+                    if (opciones.popup_url) {
+                        // Contenido pedido al servidor cada vez que se abre (p. ej. próximas salidas)
+                        capa.bindPopup(opciones.popup ? pintar(opciones.popup, f.properties) : "Cargando…",
+                                       {maxWidth: opciones.ancho_popup});
+                        capa.on("popupopen", function(e) {
+                            fetch(pintar(opciones.popup_url, f.properties, encodeURIComponent))
+                                .then(function(r) { return r.ok ? r.text() : Promise.reject(r.status); })
+                                .then(function(texto) { e.popup.setContent(texto); })
+                                .catch(function() { e.popup.setContent("No disponible"); });
+                        });
+                    } else if (opciones.popup) {
+                        capa.bindPopup(function() { return pintar(opciones.popup, f.properties); },
+                                       {maxWidth: opciones.ancho_popup});
+                    }
+                    if (opciones.tooltip) {
+                        capa.bindTooltip(function() { return pintar(opciones.tooltip, f.properties); });
+                    }
+                }
+            }).addTo(mapa);
+            function vista() {
+                var b = mapa.getBounds().pad(0.25);
+                return [b.getWest(), b.getSouth(), b.getEast(), b.getNorth()].map(function(v) { return v.toFixed(4); }).join(",");
+            }
+            var peticion = 0;
+            {% if this.url %}
+            // Grupos calculados en el servidor para la vista y el zoom actuales
+            function actualizar() {
+                var actual = ++peticion;
+                fetch({{ this.url }} + "?bbox=" + vista() + "&zoom=" + mapa.getZoom())
+                    .then(function(r) { return r.json(); })
+                    .then(function(datos) {
+                        if (actual !== peticion) return;
+                        capa.clearLayers();
+                        capa.addData(datos);
+                    });
+            }
+            {% elif this.capa %}
+            // Solo se piden los puntos de la vista, página a página; los ya cargados se conservan
+            var cargados = {}, version = null;
+            function pedir(bbox, pagina, actual) {
+                fetch({{ this.capa }} + "?bbox=" + bbox + "&zoom=" + mapa.getZoom() + "&pagina=" + pagina)
+                    .then(function(r) { return r.json(); })
+                    .then(function(datos) {
+                        if (actual !== peticion) return;
+                        if (datos.version !== version || mapa.getZoom() < datos.zoom_minimo) {
+                            capa.clearLayers();
+                            cargados = {};
+                            version = datos.version;
+                        }
+                        capa.addData(datos.features.filter(function(f) {
+                            if (cargados[f.id]) return false;
+                            cargados[f.id] = true;
+                            return true;
+                        }));
+                        if (pagina + 1 < datos.paginas) pedir(bbox, pagina + 1, actual);
+                    });
+            }
+            function actualizar() {
+                pedir(vista(), 0, ++peticion);
+            }
+            {% if this.refresco %}
+            setInterval(actualizar, {{ this.refresco }} * 1000);
+            {% endif %}
+            {% endif %}
+            {% if this.url or this.capa %}
+            mapa.on("moveend", actualizar);
+            actualizar();
+            {% else %}
+            capa.addData({{ this.datos }});
+            {% endif %}
+            return capa;
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, df=None, popup=None, tooltip=None, color="blue", icono="info-sign", prefijo="glyphicon",
+                 lat="lat", lon="lon", ancho_popup=300, vacio="", agrupar=False, capa=None, refresco=None,
+                 popup_url=None):
+        super().__init__()
+        self._name = "CapaPuntos"
+        self.url = self.capa = self.datos = None
+        self.refresco = refresco
+        if capa is not None:
+            self.capa = json_script(f"{PREFIJO_CAPAS}/{capa}")
+        else:
+            extra = {"_color": _columna(color, len(df)), "_icono": _columna(icono, len(df))}
+            geojson = puntos_geojson(df, lat, lon, _campos(popup, tooltip, popup_url), extra)
+            if agrupar:
+                self.url = json_script(publicar_puntos(geojson))
+            else:
+                self.datos = json_script(geojson)
+        self.opciones = json_script({
+            "popup": popup,
+            "popup_url": popup_url,
+            "tooltip": tooltip,
+            "color": color if isinstance(color, str) else "blue",
+            "icono": icono if isinstance(icono, str) else "info-sign",
+            "prefijo": prefijo,
+            "ancho_popup": ancho_popup,
+            "vacio": vacio,
+        })
@@ -0,0 +1,153 @@
+import json
+import math
+import os
+import threading
+
+import numpy as np
+from flask import Response, abort, request
+
+from modules.comun.agrupacion import leer_bbox
+from modules.comun.capa_puntos import PREFIJO_CAPAS as PREFIJO, puntos_geojson
+
+LIMITE_POR_DEFECTO = int(os.environ.get("CAPAS_LIMITE", 500))
+# Tope de features por petición, aunque el cliente pida más
+LIMITE_MAXIMO = int(os.environ.get("CAPAS_LIMITE_MAXIMO", 2000))
+
+
+class IndiceRejilla:
+    """
+    Índice espacial de rejilla uniforme. Los puntos se ordenan por celda
+    (fila a fila), así que las celdas de una fila del bbox son un tramo
+    contiguo y una consulta solo toca las filas que cruza.
+    """
+
+    def __init__(self, lon, lat, puntos_por_celda=8):
+        self.lon = np.asarray(lon, dtype=float)
+        self.lat = np.asarray(lat, dtype=float)
+        n = len(self.lon)
+        if n == 0:
+            self.orden = np.zeros(0, dtype=np.int64)
+            return
+
+        self.lon0, self.lat0 = self.lon.min(), self.lat.min()
+        ancho = max(self.lon.max() - self.lon0, 1e-9)
+        alto = max(self.lat.max() - self.lat0, 1e-9)
+        # Celda cuadrada con unos `puntos_por_celda` puntos de media
+        # (acotada para que una nube casi lineal no genere millones de celdas)
+        self.celda = max(math.sqrt(ancho * alto * puntos_por_celda / n), max(ancho, alto) / 4096)
+        self.columnas = int(ancho / self.celda) + 1
+        self.filas = int(alto / self.celda) + 1
+
+        cx = ((self.lon - self.lon0) / self.celda).astype(np.int64)
+        cy = ((self.lat - self.lat0) / self.celda).astype(np.int64)
+        clave = cy * self.columnas + cx
+        self.orden = np.argsort(clave, kind="stable")
+        self.inicios = np.searchsorted(clave[self.orden], np.arange(self.columnas * self.filas + 1))
+
+    def consultar(self, bbox):
+        """Índices (ordenados) de los puntos dentro de (oeste, sur, este, norte)."""
+        if len(self.orden) == 0:
+            return self.orden
+        oeste, sur, este, norte = bbox
+        cx0 = max(int((oeste - self.lon0) // self.celda), 0)
+        cx1 = min(int((este - self.lon0) // self.celda), self.columnas - 1)
+        cy0 = max(int((sur - self.lat0) // self.celda), 0)
+        cy1 = min(int((norte - self.lat0) // self.celda), self.filas - 1)
+        if cx0 > cx1 or cy0 > cy1:
+            return np.zeros(0, dtype=np.int64)
+
+        tramos = [
+            self.orden[self.inicios[fila * self.columnas + cx0]:self.inicios[fila * self.columnas + cx1 + 1]]
+            for fila in range(cy0, cy1 + 1)
+        ]
+        candidatos = np.concatenate(tramos)
+        lon, lat = self.lon[candidatos], self.lat[candidatos]
+        dentro = candidatos[(lon >= oeste) & (lon <= este) & (lat >= sur) & (lat <= norte)]
+        return np.sort(dentro)
+
+
+class Capa:
+    def __init__(self, nombre, obtener, version, lat, lon, propiedades, zoom_min):
+        self.nombre = nombre
+        self.obtener = obtener
+        self.version = version
+        self.lat = lat
+        self.lon = lon
+        self.propiedades = propiedades
+        self.zoom_min = zoom_min
+        self._lock = threading.Lock()
+        self._construida = None
+
+    def datos(self):
+        # (versión, features, índice), reconstruido solo cuando cambia la versión
+        version = self.version() if self.version else None
+        construida = self._construida
+        if construida is not None and construida[0] == version:
+            return construida
+        with self._lock:
+            if self._construida is not None and self._construida[0] == version:
+                return self._construida
+            df = self.obtener()
+            if df is None or len(df) == 0:
+                features = []
+            else:
+                propiedades = self.propiedades or [c for c in df.columns if c not in (self.lat, self.lon)]
+                features = puntos_geojson(df, self.lat, self.lon, propiedades)["features"]
+            for i, feature in enumerate(features):
+                feature["id"] = i
+            coords = np.array([f["geometry"]["coordinates"] for f in features], dtype=float).reshape(-1, 2)
+            self._construida = (version, features, IndiceRejilla(coords[:, 0], coords[:, 1]))
+            return self._construida
+
+
+_capas = {}
+
+
+def registrar_capa(nombre, obtener, version=None, lat="lat", lon="lon", propiedades=None, zoom_min=0):
+    """
+    Publica una capa de puntos en /api/layers/<nombre>. `obtener()` devuelve un
+    DataFrame y `version()` cualquier valor que cambie cuando cambian los datos;
+    el índice se reconstruye solo entonces. Sin `propiedades` se envían todas
+    las columnas.
+    """
+    _capas[nombre] = Capa(nombre, obtener, version, lat, lon, propiedades, zoom_min)
+
+
+def obtener_capa(nombre):
+    return _capas.get(nombre)
+
+
+def registrar_rutas(server):
+    @server.route(f"{PREFIJO}/<nombre>")
+    def servir_capa(nombre):
+        capa = obtener_capa(nombre)
+        if capa is None:
+            abort(404)
+        try:
+            bbox = leer_bbox(request.args.get("bbox", "-180,-90,180,90"))
+            zoom = float(request.args.get("zoom", 99))
+            pagina = max(int(request.args.get("pagina", 0)), 0)
+            limite = min(max(int(request.args.get("limite", LIMITE_POR_DEFECTO)), 1), LIMITE_MAXIMO)
+        except ValueError:
+            abort(400)
+
+        version, features, indice = capa.datos()
+        if zoom < capa.zoom_min:
+            seleccion = []
+        else:
+            seleccion = indice.consultar(bbox)
+        total = len(seleccion)
+        trozo = seleccion[pagina * limite:(pagina + 1) * limite]
+
+        cuerpo = json.dumps({
+            "type": "FeatureCollection",
+            "features": [features[i] for i in trozo],
+            "version": str(version),
+            "total": total,
+            "pagina": pagina,
+            "paginas": max(math.ceil(total / limite), 1),
+            "zoom_minimo": capa.zoom_min,
+        }, ensure_ascii=False, separators=(",", ":"), default=str)
+        return Response(cuerpo, mimetype="application/json", headers={"Cache-Control": "public, max-age=60"})
+
+    return servir_capa
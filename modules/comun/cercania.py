@@ -0,0 +1,279 @@
+import heapq
+import json
+import threading
+
+import numpy as np
+import pandas as pd
+from flask import Response, abort, request
+
+from modules.comun import capas
+
+PREFIJO = "/api/cercanos"
+RADIO_TIERRA_M = 6371008.8
+# Parámetros de la URL que no son filtros de atributos
+_RESERVADOS = {"lat", "lon", "puntos", "k", "radio"}
+
+
+def a_vectores(lat, lon):
+    # Puntos sobre la esfera unidad: la distancia euclídea (cuerda) es monótona
+    # con la distancia de círculo máximo, así que el árbol no necesita haversine
+    lat = np.radians(np.asarray(lat, dtype=float))
+    lon = np.radians(np.asarray(lon, dtype=float))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def metros_a_cuerda(metros):
+    return 2 * np.sin(np.minimum(metros / RADIO_TIERRA_M, np.pi) / 2)
+
+
+def cuerda_a_metros(cuerda):
+    return 2 * RADIO_TIERRA_M * np.arcsin(np.minimum(cuerda / 2, 1.0))
+
+
+class ArbolKD:
+    """
+    KD-tree sobre vectores 3D de la esfera unidad. Las hojas guardan hasta
+    `hoja` puntos y se recorren con numpy; cada nodo guarda su caja para
+    podar por distancia mínima. Las consultas aceptan una máscara booleana
+    para filtrar por atributos sin reconstruir el árbol.
+    """
+
+    def __init__(self, lat, lon, hoja=64):
+        self.puntos = a_vectores(lat, lon)
+        self.n = len(self.puntos)
+        self.orden = np.arange(self.n)
+        self.hoja = hoja
+        # Por nodo: (inicio, fin, hijo_izq, hijo_der, caja_min, caja_max)
+        self.nodos = []
+        if self.n:
+            self._construir(0, self.n)
+
+    def _construir(self, inicio, fin):
+        indice = len(self.nodos)
+        pts = self.puntos[self.orden[inicio:fin]]
+        self.nodos.append([inicio, fin, -1, -1, pts.min(axis=0), pts.max(axis=0)])
+        if fin - inicio <= self.hoja:
+            return indice
+        eje = int(np.argmax(self.nodos[indice][5] - self.nodos[indice][4]))
+        medio = (fin - inicio) // 2
+        particion = np.argpartition(pts[:, eje], medio)
+        self.orden[inicio:fin] = self.orden[inicio:fin][particion]
+        self.nodos[indice][2] = self._construir(inicio, inicio + medio)
+        self.nodos[indice][3] = self._construir(inicio + medio, fin)
+        return indice
+
+    def _distancia_caja(self, q, nodo):
+        exceso = np.maximum(np.maximum(nodo[4] - q, q - nodo[5]), 0.0)
+        return float(np.sqrt(exceso @ exceso))
+
+    def _hoja(self, q, nodo, mascara):
+        idx = self.orden[nodo[0]:nodo[1]]
+        if mascara is not None:
+            idx = idx[mascara[idx]]
+        diferencia = self.puntos[idx] - q
+        return idx, np.sqrt(np.einsum("ij,ij->i", diferencia, diferencia))
+
+    def cercanos(self, lat, lon, k=1, radio_m=None, mascara=None):
+        """Índices y distancias (m) de los k puntos más cercanos, ordenados."""
+        if not self.n:
+            return np.zeros(0, dtype=int), np.zeros(0)
+        q = a_vectores([lat], [lon])[0]
+        limite = metros_a_cuerda(radio_m) if radio_m is not None else np.inf
+        mejores_idx = np.zeros(0, dtype=int)
+        mejores_d = np.zeros(0)
+        peor = limite
+        pendientes = [(self._distancia_caja(q, self.nodos[0]), 0)]
+        while pendientes:
+            d_caja, i = heapq.heappop(pendientes)
+            if d_caja > peor:
+                break
+            nodo = self.nodos[i]
+            if nodo[2] >= 0:
+                for hijo in (nodo[2], nodo[3]):
+                    d_hijo = self._distancia_caja(q, self.nodos[hijo])
+                    if d_hijo <= peor:
+                        heapq.heappush(pendientes, (d_hijo, hijo))
+                continue
+            idx, d = self._hoja(q, nodo, mascara)
+            validos = d <= limite
+            mejores_idx = np.concatenate([mejores_idx, idx[validos]])
+            mejores_d = np.concatenate([mejores_d, d[validos]])
+            if len(mejores_d) > k:
+                quedan = np.argpartition(mejores_d, k - 1)[:k]
+                mejores_idx, mejores_d = mejores_idx[quedan], mejores_d[quedan]
+            if len(mejores_d) == k:
+                peor = min(limite, mejores_d.max())
+        orden = np.argsort(mejores_d, kind="stable")
+        return mejores_idx[orden], cuerda_a_metros(mejores_d[orden])
+
+    def en_radio(self, lat, lon, radio_m, mascara=None):
+        """Índices y distancias (m) de todos los puntos a menos de `radio_m`, ordenados."""
+        if not self.n:
+            return np.zeros(0, dtype=int), np.zeros(0)
+        q = a_vectores([lat], [lon])[0]
+        limite = metros_a_cuerda(radio_m)
+        trozos_idx, trozos_d = [], []
+        pendientes = [0]
+        while pendientes:
+            nodo = self.nodos[pendientes.pop()]
+            if self._distancia_caja(q, nodo) > limite:
+                continue
+            if nodo[2] >= 0:
+                pendientes.extend((nodo[2], nodo[3]))
+                continue
+            idx, d = self._hoja(q, nodo, mascara)
+            validos = d <= limite
+            trozos_idx.append(idx[validos])
+            trozos_d.append(d[validos])
+        if not trozos_idx:
+            return np.zeros(0, dtype=int), np.zeros(0)
+        idx, d = np.concatenate(trozos_idx), np.concatenate(trozos_d)
+        orden = np.argsort(d, kind="stable")
+        return idx[orden], cuerda_a_metros(d[orden])
+
+
+class _IndiceCapa:
+    def __init__(self, version, features):
+        self.version = version
+        self.features = features
+        coords = np.array([f["geometry"]["coordinates"] for f in features], dtype=float).reshape(-1, 2)
+        self.arbol = ArbolKD(coords[:, 1], coords[:, 0])
+        self._columnas = {}
+
+    def columna(self, campo, numerica):
+        clave = (campo, numerica)
+        if clave not in self._columnas:
+            valores = pd.Series([f["properties"].get(campo) for f in self.features], dtype=object)
+            if numerica:
+                # Admite decimales con coma, como los precios del Ministerio
+                valores = pd.to_numeric(valores.astype(str).str.replace(",", ".", regex=False), errors="coerce")
+                self._columnas[clave] = valores.to_numpy(dtype=float)
+            else:
+                self._columnas[clave] = valores.astype(str).str.lower().to_numpy()
+        return self._columnas[clave]
+
+    def mascara(self, filtros):
+        """
+        `filtros`: {campo: valor} para igualdad (sin distinguir mayúsculas) o
+        {campo: (mínimo, máximo)} para rangos numéricos; None deja el extremo abierto.
+        """
+        if not filtros:
+            return None
+        mascara = np.ones(len(self.features), dtype=bool)
+        for campo, condicion in filtros.items():
+            if isinstance(condicion, tuple):
+                minimo, maximo = condicion
+                valores = self.columna(campo, numerica=True)
+                with np.errstate(invalid="ignore"):
+                    if minimo is not None:
+                        mascara &= valores >= minimo
+                    if maximo is not None:
+                        mascara &= valores <= maximo
+            else:
+                mascara &= self.columna(campo, numerica=False) == str(condicion).lower()
+        return mascara
+
+
+_indices = {}
+_lock = threading.Lock()
+
+
+def indice_capa(nombre):
+    """Árbol de la capa para su instantánea actual; se reconstruye cuando cambia la versión."""
+    capa = capas.obtener_capa(nombre)
+    if capa is None:
+        raise KeyError(nombre)
+    version, features, _ = capa.datos()
+    indice = _indices.get(nombre)
+    if indice is None or indice.version != version or indice.features is not features:
+        with _lock:
+            indice = _indices.get(nombre)
+            if indice is None or indice.version != version or indice.features is not features:
+                indice = _IndiceCapa(version, features)
+                _indices[nombre] = indice
+    return indice
+
+
+def _resultado(indice, idx, distancias):
+    features = []
+    for i, d in zip(idx.tolist(), distancias.tolist()):
+        feature = dict(indice.features[i])
+        feature["properties"] = dict(feature["properties"], distancia_m=round(d, 1))
+        features.append(feature)
+    return features
+
+
+def cercanos(nombre, lat, lon, k=5, radio_m=None, filtros=None):
+    """
+    Los `k` puntos de la capa más cercanos a (lat, lon), opcionalmente dentro
+    de `radio_m` metros y filtrados por atributos. `lat` y `lon` pueden ser
+    listas para consultar varios puntos a la vez; entonces se devuelve una
+    lista de resultados. Cada feature lleva `distancia_m`.
+    """
+    indice = indice_capa(nombre)
+    mascara = indice.mascara(filtros)
+    if np.ndim(lat) == 0:
+        return _resultado(indice, *indice.arbol.cercanos(lat, lon, k, radio_m, mascara))
+    return [_resultado(indice, *indice.arbol.cercanos(la, lo, k, radio_m, mascara)) for la, lo in zip(lat, lon)]
+
+
+def en_radio(nombre, lat, lon, radio_m, filtros=None):
+    """Todos los puntos de la capa a menos de `radio_m` metros; admite lotes como `cercanos`."""
+    indice = indice_capa(nombre)
+    mascara = indice.mascara(filtros)
+    if np.ndim(lat) == 0:
+        return _resultado(indice, *indice.arbol.en_radio(lat, lon, radio_m, mascara))
+    return [_resultado(indice, *indice.arbol.en_radio(la, lo, radio_m, mascara)) for la, lo in zip(lat, lon)]
+
+
+def _leer_filtros(args):
+    # ?GA__max=1.4&G95__min=1.2&tipo=onStreet
+    filtros = {}
+    for clave, valor in args.items():
+        if clave in _RESERVADOS:
+            continue
+        campo, _, operador = clave.partition("__")
+        if operador in ("min", "max"):
+            minimo, maximo = filtros.get(campo, (None, None))
+            numero = float(valor.replace(",", "."))
+            filtros[campo] = (numero, maximo) if operador == "min" else (minimo, numero)
+        else:
+            filtros[clave] = valor
+    return filtros
+
+
+def registrar_rutas(server):
+    @server.route(f"{PREFIJO}/<nombre>")
+    def servir_cercanos(nombre):
+        if capas.obtener_capa(nombre) is None:
+            abort(404)
+        try:
+            if "puntos" in request.args:
+                # Lote: puntos=lat,lon;lat,lon
+                pares = [p.split(",") for p in request.args["puntos"].split(";") if p]
+                lats = [float(la) for la, lo in pares]
+                lons = [float(lo) for la, lo in pares]
+            else:
+                lats = [float(request.args["lat"])]
+                lons = [float(request.args["lon"])]
+            k = request.args.get("k", type=int)
+            radio = request.args.get("radio", type=float)
+            filtros = _leer_filtros(request.args)
+        except (KeyError, ValueError):
+            abort(400)
+        if k is None and radio is None:
+            k = 5
+
+        if k is None:
+            resultados = [r[:capas.LIMITE_MAXIMO] for r in en_radio(nombre, lats, lons, radio, filtros)]
+        else:
+            resultados = cercanos(nombre, lats, lons, min(max(k, 1), capas.LIMITE_MAXIMO), radio, filtros)
+        colecciones = [{"type": "FeatureCollection", "features": r} for r in resultados]
+        cuerpo = colecciones[0] if "puntos" not in request.args else {"resultados": colecciones}
+        return Response(
+            json.dumps(cuerpo, ensure_ascii=False, separators=(",", ":"), default=str),
+            mimetype="application/json",
+            headers={"Cache-Control": "public, max-age=60"},
+        )
+
+    return servir_cercanos
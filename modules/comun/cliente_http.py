@@ -0,0 +1,216 @@
+import json
+import os
+import random
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Timeout (conexión, lectura) en segundos y peticiones simultáneas por host
+HOSTS = {
+    "infocar.dgt.es": {"timeout": (5, 60), "concurrencia": 2},
+    "opendata.aemet.es": {"timeout": (5, 30), "concurrencia": 2},
+    "donostia.eus": {"timeout": (5, 15), "concurrencia": 4},
+}
+HOST_POR_DEFECTO = {"timeout": (5, 30), "concurrencia": 4}
+
+REINTENTOS = 3
+BACKOFF_BASE = 0.5
+# El circuito de un host se abre tras N fallos seguidos y se reintenta pasado el enfriamiento
+UMBRAL_CIRCUITO = 5
+ENFRIAMIENTO_CIRCUITO = 60
+
+
+class ErrorHTTP(Exception):
+    pass
+
+
+class CircuitoAbierto(ErrorHTTP):
+    pass
+
+
+class Respuesta(namedtuple("Respuesta", ["url", "estado", "contenido", "cabeceras", "modificado", "desde_cache"])):
+    """
+    `modificado` es False cuando el servidor ha contestado 304 y `contenido`
+    es el último recibido; `desde_cache` indica que el circuito estaba abierto
+    o la fuente ha fallado y se sirve la última respuesta buena.
+    """
+
+    @property
+    def texto(self):
+        tipo = self.cabeceras.get("Content-Type", "")
+        charset = tipo.split("charset=")[-1].split(";")[0].strip() if "charset=" in tipo else "utf-8"
+        try:
+            return self.contenido.decode(charset)
+        except (UnicodeDecodeError, LookupError):
+            return self.contenido.decode("iso-8859-15")
+
+    def json(self):
+        return json.loads(self.texto)
+
+    def raise_for_status(self):
+        # Como en requests: los 4xx llegan como respuesta (los 5xx y 429 ya se reintentan en get)
+        if self.estado >= 400:
+            raise ErrorHTTP(f"{self.url}: HTTP {self.estado}")
+        return self
+
+
+def _leer_redirecciones():
+    # HTTP_REDIRECCIONES="infocar.dgt.es=http://127.0.0.1:8765/infocar.dgt.es,..."
+    redirecciones = {}
+    for par in os.environ.get("HTTP_REDIRECCIONES", "").split(","):
+        if "=" in par:
+            host, base = par.split("=", 1)
+            redirecciones[host.strip()] = base.strip().rstrip("/")
+    return redirecciones
+
+
+class ClienteHTTP:
+    """
+    Cliente compartido para las fuentes externas: pool de conexiones keep-alive,
+    timeouts y concurrencia por host, revalidación con ETag/Last-Modified,
+    reintentos con jitter y circuit breaker que sirve la última respuesta buena.
+    """
+
+    def __init__(self, hosts=None, redirecciones=None, grabar_dir=None):
+        self.hosts = dict(HOSTS, **(hosts or {}))
+        self.redirecciones = _leer_redirecciones() if redirecciones is None else redirecciones
+        self.grabar_dir = grabar_dir if grabar_dir is not None else os.environ.get("HTTP_GRABAR_DIR")
+
+        self.sesion = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+        self.sesion.mount("https://", adaptador)
+        self.sesion.mount("http://", adaptador)
+
+        self._lock = threading.Lock()
+        self._semaforos = {}
+        self._circuitos = {}
+        self._ultimas = {}
+        self._procesados = {}
+
+    def _config(self, host):
+        return self.hosts.get(host, HOST_POR_DEFECTO)
+
+    def _semaforo(self, host):
+        with self._lock:
+            if host not in self._semaforos:
+                self._semaforos[host] = threading.BoundedSemaphore(self._config(host)["concurrencia"])
+            return self._semaforos[host]
+
+    def _circuito(self, host):
+        with self._lock:
+            return self._circuitos.setdefault(host, {"fallos": 0, "abierto_hasta": 0.0, "aperturas": 0})
+
+    def _url_real(self, url):
+        partes = urlsplit(url)
+        base = self.redirecciones.get(partes.hostname)
+        if not base:
+            return url
+        resto = partes.path + (f"?{partes.query}" if partes.query else "")
+        return base + resto
+
+    def _grabar(self, url, contenido):
+        partes = urlsplit(url)
+        ruta = os.path.join(self.grabar_dir, partes.hostname, partes.path.lstrip("/") or "index")
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with open(ruta, "wb") as f:
+            f.write(contenido)
+
+    def _registrar_fallo(self, host):
+        circuito = self._circuito(host)
+        with self._lock:
+            circuito["fallos"] += 1
+            if circuito["fallos"] >= UMBRAL_CIRCUITO:
+                circuito["abierto_hasta"] = time.monotonic() + ENFRIAMIENTO_CIRCUITO
+                circuito["aperturas"] += 1
+
+    def _registrar_exito(self, host):
+        circuito = self._circuito(host)
+        with self._lock:
+            circuito["fallos"] = 0
+            circuito["abierto_hasta"] = 0.0
+
+    def _ultima_buena(self, clave, error):
+        ultima = self._ultimas.get(clave)
+        if ultima is None:
+            raise error
+        return ultima._replace(modificado=False, desde_cache=True)
+
+    def get(self, url, params=None, headers=None, condicional=True):
+        # Con condicional=False no se revalida ni se guarda la respuesta (URLs efímeras)
+        host = urlsplit(url).hostname
+        clave = (url, tuple(sorted((params or {}).items())))
+        circuito = self._circuito(host)
+
+        if circuito["abierto_hasta"] > time.monotonic():
+            return self._ultima_buena(clave, CircuitoAbierto(f"Circuito abierto para {host}"))
+
+        cabeceras = dict(headers or {})
+        ultima = self._ultimas.get(clave)
+        if condicional and ultima is not None:
+            if ultima.cabeceras.get("ETag"):
+                cabeceras["If-None-Match"] = ultima.cabeceras["ETag"]
+            if ultima.cabeceras.get("Last-Modified"):
+                cabeceras["If-Modified-Since"] = ultima.cabeceras["Last-Modified"]
+
+        timeout = self._config(host)["timeout"]
+        error = None
+        for intento in range(REINTENTOS + 1):
+            if intento:
+                # Backoff exponencial con jitter completo
+                time.sleep(random.uniform(0, BACKOFF_BASE * 2 ** intento))
+            try:
+                with self._semaforo(host):
+                    r = self.sesion.get(self._url_real(url), params=params, headers=cabeceras, timeout=timeout)
+            except requests.RequestException as e:
+                error = ErrorHTTP(f"{host}: {e}")
+                continue
+            if r.status_code == 429 or r.status_code >= 500:
+                error = ErrorHTTP(f"{host}: HTTP {r.status_code}")
+                continue
+
+            self._registrar_exito(host)
+            if r.status_code == 304 and ultima is not None:
+                return ultima._replace(modificado=False, desde_cache=False)
+            respuesta = Respuesta(url, r.status_code, r.content, r.headers, True, False)
+            if r.status_code == 200:
+                if condicional:
+                    self._ultimas[clave] = respuesta
+                if self.grabar_dir:
+                    self._grabar(url, r.content)
+            return respuesta
+
+        self._registrar_fallo(host)
+        return self._ultima_buena(clave, error)
+
+    def obtener_procesado(self, url, procesar, **kwargs):
+        """
+        Descarga y procesa `url`, reutilizando el último resultado procesado si el
+        contenido no ha cambiado (304) o si se está sirviendo la última respuesta buena.
+        """
+        respuesta = self.get(url, **kwargs)
+        if respuesta.estado != 200:
+            raise ErrorHTTP(f"{url}: HTTP {respuesta.estado}")
+        previo = self._procesados.get(url)
+        if previo is not None and previo[0] is respuesta.contenido:
+            return previo[1]
+        resultado = procesar(respuesta.contenido)
+        self._procesados[url] = (respuesta.contenido, resultado)
+        return resultado
+
+    def estado(self):
+        ahora = time.monotonic()
+        return {
+            host: {
+                "fallos_seguidos": c["fallos"],
+                "abierto": c["abierto_hasta"] > ahora,
+                "aperturas": c["aperturas"],
+            }
+            for host, c in self._circuitos.items()
+        }
+
+
+cliente = ClienteHTTP()
@@ -0,0 +1,102 @@
+import io
+
+import numpy as np
+import pandas as pd
+from lxml import etree
+
+# (lat_min, lat_max, lon_min, lon_max)
+BBOX_GIPUZKOA = (43.0, 43.4, -2.8, -1.7)
+
+
+def iterar_datex2(fuente, etiqueta):
+    """
+    Recorre en streaming los elementos `etiqueta` (nombre local, cualquier
+    namespace) de una publicación DATEX2. Cada elemento se libera al terminar
+    de procesarlo, así la memoria no crece con el tamaño del fichero.
+    `fuente` puede ser bytes, una ruta o un fichero abierto en binario.
+    """
+    if isinstance(fuente, (bytes, bytearray)):
+        fuente = io.BytesIO(fuente)
+    for _, elem in etree.iterparse(fuente, events=("end",), tag=f"{{*}}{etiqueta}", huge_tree=True):
+        try:
+            yield elem
+        finally:
+            _liberar(elem)
+
+
+def _liberar(elem):
+    elem.clear(keep_tail=True)
+    # Se eliminan también los hermanos ya procesados que cuelgan del padre
+    padre = elem.getparent()
+    if padre is not None:
+        while elem.getprevious() is not None:
+            del padre[0]
+
+
+def _texto(elem, ruta, por_defecto=None):
+    hijo = elem.find(ruta)
+    return hijo.text if hijo is not None else por_defecto
+
+
+def leer_datex2(fuente, etiqueta, lat="latitude", lon="longitude", campos=None, bbox=None, como_dataframe=True):
+    """
+    Extrae en columnas los elementos `etiqueta` de una publicación DATEX2 v3.
+
+    - `lat`/`lon`: nombre local de los elementos de coordenadas; se toma la
+      primera aparición dentro de cada elemento (las que aparecen fuera de
+      uno se ignoran). Se leen en los propios eventos del parser, sin
+      búsquedas en el árbol.
+    - `campos`: {columna: ruta} o {columna: (ruta, valor_por_defecto)}, con
+      `{*}` para cualquier namespace. Solo se leen si pasa el filtro de `bbox`.
+    - `bbox`: (lat_min, lat_max, lon_min, lon_max).
+
+    Devuelve un DataFrame o, con `como_dataframe=False`, un dict de arrays.
+    """
+    if isinstance(fuente, (bytes, bytearray)):
+        fuente = io.BytesIO(fuente)
+    campos = {
+        nombre: ruta if isinstance(ruta, tuple) else (ruta, None)
+        for nombre, ruta in (campos or {}).items()
+    }
+    lats, lons = [], []
+    columnas = {nombre: [] for nombre in campos}
+
+    lat_txt = lon_txt = None
+    abiertos = 0
+    etiquetas = [f"{{*}}{etiqueta}", f"{{*}}{lat}", f"{{*}}{lon}"]
+    for evento, elem in etree.iterparse(fuente, events=("start", "end"), tag=etiquetas, huge_tree=True):
+        local = elem.tag.rpartition("}")[2]
+        if local != etiqueta:
+            # Solo cuentan las coordenadas dentro de un elemento abierto: las que hay entre dos se ignoran
+            if evento == "start" or abiertos == 0:
+                continue
+            if local == lat and lat_txt is None:
+                lat_txt = elem.text
+            elif local == lon and lon_txt is None:
+                lon_txt = elem.text
+            continue
+        if evento == "start":
+            if abiertos == 0:
+                lat_txt = lon_txt = None
+            abiertos += 1
+            continue
+        abiertos -= 1
+
+        try:
+            lat_val = float(lat_txt)
+            lon_val = float(lon_txt)
+        except (TypeError, ValueError):
+            lat_val = None
+        if lat_val is not None and (bbox is None or (bbox[0] <= lat_val <= bbox[1] and bbox[2] <= lon_val <= bbox[3])):
+            lats.append(lat_val)
+            lons.append(lon_val)
+            for nombre, (ruta, por_defecto) in campos.items():
+                columnas[nombre].append(_texto(elem, ruta, por_defecto))
+        lat_txt = lon_txt = None
+        _liberar(elem)
+
+    resultado = {"lat": np.array(lats, dtype=float), "lon": np.array(lons, dtype=float)}
+    resultado.update({nombre: np.array(valores, dtype=object) for nombre, valores in columnas.items()})
+    if como_dataframe:
+        return pd.DataFrame(resultado)
+    return resultado
@@ -0,0 +1,132 @@
+"""
+Servicio de imágenes estáticas (gráficas) con caché HTTP de larga duración y
+miniaturas WebP.
+
+Las URL llevan la versión del fichero (?v=...), así que el navegador puede
+guardarlas como inmutables. Las miniaturas se generan una vez y se guardan en
+disco; para generarlas por adelantado:
+
+    python -m modules.comun.imagenes data/estaciones
+"""
+import argparse
+import fnmatch
+import hashlib
+import io
+import os
+from urllib.parse import quote
+
+from flask import abort, request, send_file
+from PIL import Image
+from werkzeug.security import safe_join
+
+from modules.comun.artefactos import ARTEFACTOS_DIR, escribir_atomico
+
+ANCHO_MINIATURA = 400
+# Lo único que se publica: imágenes (el resto de ficheros del directorio puede ser privado)
+EXTENSIONES = (".png", ".jpg", ".jpeg", ".webp")
+MINIATURAS_DIR = os.path.join(ARTEFACTOS_DIR, "miniaturas")
+UN_AÑO = 365 * 24 * 3600
+
+
+def version_stat(tamaño, mtime_ns):
+    return hashlib.sha1(f"{mtime_ns}:{tamaño}".encode()).hexdigest()[:12]
+
+
+def version_imagen(ruta):
+    st = os.stat(ruta)
+    return version_stat(st.st_size, st.st_mtime_ns)
+
+
+def ruta_miniatura(ruta):
+    clave = f"{os.path.abspath(ruta)}:{version_imagen(ruta)}:{ANCHO_MINIATURA}"
+    return os.path.join(MINIATURAS_DIR, hashlib.sha1(clave.encode("utf-8")).hexdigest()[:32] + ".webp")
+
+
+def generar_miniatura(ruta):
+    """Devuelve la ruta de la miniatura WebP, creándola si no existe."""
+    destino = ruta_miniatura(ruta)
+    if not os.path.exists(destino):
+        os.makedirs(MINIATURAS_DIR, exist_ok=True)
+        with Image.open(ruta) as img:
+            img.thumbnail((ANCHO_MINIATURA, ANCHO_MINIATURA * 4))
+            buffer = io.BytesIO()
+            img.save(buffer, "WEBP", quality=80, method=4)
+        escribir_atomico(destino, buffer.getvalue())
+    return destino
+
+
+def pregenerar_miniaturas(directorio, extensiones=(".png", ".jpg", ".jpeg")):
+    generadas = 0
+    for carpeta, _, ficheros in os.walk(directorio):
+        for nombre in ficheros:
+            if nombre.lower().endswith(extensiones):
+                generar_miniatura(os.path.join(carpeta, nombre))
+                generadas += 1
+    return generadas
+
+
+class Imagenes:
+    """
+    Publica las imágenes de `directorio` bajo `prefijo`:
+
+    - {prefijo}/<ruta>            imagen original
+    - {prefijo}/miniatura/<ruta>  miniatura WebP
+
+    Solo se sirven ficheros con extensión de imagen y, con `carpetas` (patrón
+    fnmatch), solo los de las subcarpetas que lo cumplen; el resto da 404.
+    """
+
+    def __init__(self, prefijo, directorio, carpetas=None, extensiones=EXTENSIONES):
+        self.prefijo = prefijo.rstrip("/")
+        self.directorio = os.path.abspath(directorio)
+        self.carpetas = carpetas
+        self.extensiones = extensiones
+
+    def url(self, ruta, miniatura=False, version=None):
+        # `version` (p. ej. de version_stat con datos de un manifiesto) evita el stat
+        relativa = os.path.relpath(os.path.abspath(ruta), self.directorio).replace(os.sep, "/")
+        base = f"{self.prefijo}/miniatura" if miniatura else self.prefijo
+        return f"{base}/{quote(relativa)}?v={version or version_imagen(ruta)}"
+
+    def _fichero(self, relativa):
+        partes = relativa.split("/")
+        if not relativa.lower().endswith(self.extensiones):
+            abort(404)
+        if self.carpetas is not None and (len(partes) < 2 or not fnmatch.fnmatchcase(partes[0], self.carpetas)):
+            abort(404)
+        ruta = safe_join(self.directorio, relativa)
+        if ruta is None or not os.path.isfile(ruta):
+            abort(404)
+        return ruta
+
+    def _enviar(self, ruta, mimetype=None):
+        respuesta = send_file(ruta, mimetype=mimetype, conditional=True, etag=True, max_age=UN_AÑO)
+        if request.args.get("v"):
+            # Con la versión en la URL el contenido nunca cambia para esa URL
+            respuesta.headers["Cache-Control"] = f"public, max-age={UN_AÑO}, immutable"
+        return respuesta
+
+    def registrar(self, server):
+        nombre = self.prefijo.strip("/").replace("/", "_")
+
+        def original(relativa):
+            return self._enviar(self._fichero(relativa))
+
+        def miniatura(relativa):
+            ruta = self._fichero(relativa)
+            try:
+                destino = generar_miniatura(ruta)
+            except OSError:
+                # Imagen ilegible (Pillow da UnidentifiedImageError, que es un OSError)
+                abort(404)
+            return self._enviar(destino, mimetype="image/webp")
+
+        server.add_url_rule(f"{self.prefijo}/miniatura/<path:relativa>", f"{nombre}_miniatura", miniatura)
+        server.add_url_rule(f"{self.prefijo}/<path:relativa>", f"{nombre}_original", original)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera las miniaturas WebP de un directorio de imágenes")
+    parser.add_argument("directorio")
+    args = parser.parse_args()
+    print(f"Miniaturas generadas: {pregenerar_miniaturas(args.directorio)}")
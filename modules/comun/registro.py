@@ -0,0 +1,123 @@
+import importlib
+import threading
+import time
+
+from dash import html
+
+from modules.comun.artefactos import PREFIJO as PREFIJO_ARTEFACTOS, existe, registrar_referencias
+
+
+def artefactos_layout(layout):
+    """URL de mapas publicados que enlaza un layout (src de iframes y similares)."""
+    componentes = [layout] + list(layout._traverse()) if hasattr(layout, "_traverse") else []
+    return [c.src for c in componentes
+            if isinstance(getattr(c, "src", None), str) and c.src.startswith(PREFIJO_ARTEFACTOS)]
+
+
+class RegistroPaginas:
+    """
+    Registro de páginas de la app. Cada módulo declara su `RUTA` y una fábrica
+    `layout`; el módulo se importa al arrancar (para registrar sus callbacks),
+    pero el layout solo se construye en la primera visita o en el precalentado.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.paginas = {}
+        registrar_referencias(self.artefactos)
+
+    def registrar(self, nombre_modulo, volver):
+        inicio = time.perf_counter()
+        modulo = importlib.import_module(nombre_modulo)
+        t_import = time.perf_counter() - inicio
+
+        if hasattr(modulo, "register_callbacks"):
+            modulo.register_callbacks(self.app)
+
+        self.paginas[modulo.RUTA] = {
+            "modulo": nombre_modulo,
+            "fabrica": modulo.layout,
+            "volver": volver,
+            "cachear": getattr(modulo, "CACHEAR_LAYOUT", True),
+            "layout": None,
+            "lock": threading.Lock(),
+            "t_import": t_import,
+            "t_build": None,
+            "builds": 0,
+            "error": None,
+        }
+        return modulo
+
+    def _construir(self, pagina):
+        inicio = time.perf_counter()
+        fabrica = pagina["fabrica"]
+        contenido = fabrica() if callable(fabrica) else fabrica
+        pagina["t_build"] = time.perf_counter() - inicio
+        pagina["builds"] += 1
+        pagina["error"] = None
+        return contenido
+
+    def obtener_layout(self, ruta):
+        pagina = self.paginas[ruta]
+        if not pagina["cachear"]:
+            return self._construir(pagina)
+        layout = pagina["layout"]
+        if layout is not None and not all(existe(url) for url in artefactos_layout(layout)):
+            # Algún mapa que enlaza ya no está en disco (limpiado por otro proceso): se reconstruye
+            with pagina["lock"]:
+                if pagina["layout"] is layout:
+                    pagina["layout"] = None
+        if pagina["layout"] is None:
+            with pagina["lock"]:
+                # Otro hilo puede haberlo construido mientras esperábamos
+                if pagina["layout"] is None:
+                    pagina["layout"] = self._construir(pagina)
+        return pagina["layout"]
+
+    def artefactos(self):
+        """URL de los artefactos enlazados por los layouts en caché."""
+        return [url for pagina in list(self.paginas.values()) if pagina["layout"] is not None
+                for url in artefactos_layout(pagina["layout"])]
+
+    def render(self, ruta):
+        pagina = self.paginas[ruta]
+        try:
+            contenido = self.obtener_layout(ruta)
+        except Exception as e:
+            # No se cachea el fallo: la siguiente visita vuelve a intentarlo
+            pagina["error"] = str(e)
+            print(f"Error construyendo la página {ruta}: {e}")
+            contenido = html.H3("No se ha podido cargar esta página. Inténtelo de nuevo más tarde.")
+        return html.Div([
+            html.A("← Volver", href=pagina["volver"], className="volver"),
+            contenido
+        ], className="contenedor-mapa")
+
+    def precalentar(self):
+        def _precalentar():
+            for ruta, pagina in list(self.paginas.items()):
+                if not pagina["cachear"]:
+                    continue
+                try:
+                    self.obtener_layout(ruta)
+                except Exception as e:
+                    pagina["error"] = str(e)
+                    print(f"Error precalentando la página {ruta}: {e}")
+
+        hilo = threading.Thread(target=_precalentar, name="precalentar-paginas", daemon=True)
+        hilo.start()
+        return hilo
+
+    def informe(self):
+        return [
+            {
+                "ruta": ruta,
+                "modulo": pagina["modulo"],
+                "t_import_s": round(pagina["t_import"], 4),
+                "t_build_s": round(pagina["t_build"], 4) if pagina["t_build"] is not None else None,
+                "builds": pagina["builds"],
+                "cacheado": pagina["layout"] is not None,
+                "error": pagina["error"],
+            }
+            for ruta, pagina in self.paginas.items()
+        ]
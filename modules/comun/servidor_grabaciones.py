@@ -0,0 +1,81 @@
+"""
+Servidor HTTP local que reproduce fuentes grabadas, para probar el cliente y
+los módulos sin depender de los servidores reales.
+
+Los ficheros se sirven desde <directorio>/<host>/<ruta>, el mismo formato que
+escribe el cliente con HTTP_GRABAR_DIR. Uso:
+
+    python -m modules.comun.servidor_grabaciones data/grabaciones --puerto 8765
+    HTTP_REDIRECCIONES="infocar.dgt.es=http://127.0.0.1:8765/infocar.dgt.es" python app.py
+"""
+import argparse
+import hashlib
+import mimetypes
+import os
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from werkzeug.utils import safe_join
+
+
+def _crear_manejador(directorio, fallos):
+    class Manejador(BaseHTTPRequestHandler):
+        def do_GET(self):
+            # Fallos simulados: {"/ruta": [503, 503]} contesta 503 dos veces y luego sirve el fichero
+            ruta_url = self.path.split("?")[0]
+            if fallos.get(ruta_url):
+                self.send_response(fallos[ruta_url].pop(0))
+                self.end_headers()
+                return
+
+            # safe_join rechaza "..", rutas absolutas y carpetas hermanas como <directorio>-otro
+            ruta = safe_join(directorio, ruta_url.lstrip("/"))
+            if ruta is None or not os.path.isfile(ruta):
+                self.send_response(404)
+                self.end_headers()
+                return
+
+            with open(ruta, "rb") as f:
+                datos = f.read()
+            etag = '"%s"' % hashlib.sha1(datos).hexdigest()
+            if etag in self.headers.get("If-None-Match", ""):
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", mimetypes.guess_type(ruta)[0] or "application/octet-stream")
+            self.send_header("Content-Length", str(len(datos)))
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", formatdate(os.path.getmtime(ruta), usegmt=True))
+            self.end_headers()
+            self.wfile.write(datos)
+
+        def log_message(self, *args):
+            pass
+
+    return Manejador
+
+
+def iniciar_servidor(directorio, puerto=0, fallos=None):
+    """
+    Arranca el servidor en un hilo y devuelve (servidor, url_base). `fallos`
+    se consulta en cada petición, así que se puede modificar con el servidor
+    en marcha.
+    """
+    directorio = os.path.abspath(directorio)
+    servidor = ThreadingHTTPServer(("127.0.0.1", puerto), _crear_manejador(directorio, {} if fallos is None else fallos))
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reproduce fuentes HTTP grabadas")
+    parser.add_argument("directorio")
+    parser.add_argument("--puerto", type=int, default=8765)
+    args = parser.parse_args()
+    servidor = ThreadingHTTPServer(("127.0.0.1", args.puerto), _crear_manejador(os.path.abspath(args.directorio), {}))
+    print(f"Sirviendo {args.directorio} en http://127.0.0.1:{args.puerto}")
+    servidor.serve_forever()
@@ -0,0 +1,144 @@
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# Foto inmutable de una fuente: los callbacks solo leen, nunca modifican `datos`
+Instantanea = namedtuple("Instantanea", ["datos", "actualizado", "version"])
+
+
+def _no_vacio(datos):
+    return datos is not None and len(datos) > 0
+
+
+def _iguales(a, b):
+    try:
+        return a.equals(b) if hasattr(a, "equals") else a == b
+    except Exception:
+        return False
+
+
+class Sondeador:
+    """
+    Refresca cada fuente en vivo con su propia cadencia en un único pool de
+    hilos y guarda la última instantánea válida (stale-while-revalidate).
+    Si un refresco falla o devuelve datos vacíos se sigue sirviendo la anterior.
+    """
+
+    def __init__(self, max_hilos=5):
+        self.max_hilos = max_hilos
+        self._fuentes = {}
+        self._lock = threading.Lock()
+        self._despertar = threading.Event()
+        self._hilo = None
+
+    def registrar(self, nombre, funcion, intervalo, reintento=60, valida=_no_vacio):
+        self._fuentes[nombre] = {
+            "funcion": funcion,
+            "intervalo": intervalo,
+            "reintento": min(reintento, intervalo),
+            "valida": valida,
+            "instantanea": None,
+            "primer_intento": threading.Event(),
+            "proxima": 0.0,
+            "en_curso": False,
+            "error": None,
+            "duracion": None,
+            "refrescos": 0,
+            "fallos": 0,
+        }
+
+    def _refrescar(self, nombre):
+        fuente = self._fuentes[nombre]
+        inicio = time.monotonic()
+        try:
+            datos = fuente["funcion"]()
+            if not fuente["valida"](datos):
+                raise ValueError("la fuente ha devuelto datos vacíos")
+        except Exception as e:
+            print(f"Error refrescando la fuente '{nombre}': {e}")
+            fuente["error"] = str(e)
+            fuente["fallos"] += 1
+            espera = fuente["reintento"]
+        else:
+            anterior = fuente["instantanea"]
+            if anterior is not None and _iguales(anterior.datos, datos):
+                # Mismos datos: se conserva la versión para no invalidar cachés
+                fuente["instantanea"] = Instantanea(anterior.datos, datetime.now(), anterior.version)
+            else:
+                version = anterior.version + 1 if anterior is not None else 1
+                fuente["instantanea"] = Instantanea(datos, datetime.now(), version)
+            fuente["error"] = None
+            fuente["refrescos"] += 1
+            espera = fuente["intervalo"]
+        finally:
+            fuente["duracion"] = time.monotonic() - inicio
+            # Tras el primer intento (bueno o malo) nadie más espera en frío
+            fuente["primer_intento"].set()
+
+        with self._lock:
+            fuente["proxima"] = time.monotonic() + espera
+            fuente["en_curso"] = False
+        self._despertar.set()
+
+    def _bucle(self, pool):
+        while True:
+            self._despertar.clear()
+            ahora = time.monotonic()
+            espera = 60.0
+            with self._lock:
+                for nombre, fuente in self._fuentes.items():
+                    if fuente["en_curso"]:
+                        continue
+                    if fuente["proxima"] <= ahora:
+                        fuente["en_curso"] = True
+                        pool.submit(self._refrescar, nombre)
+                    else:
+                        espera = min(espera, fuente["proxima"] - ahora)
+            self._despertar.wait(espera)
+
+    def iniciar(self):
+        if self._hilo is not None:
+            return
+        pool = ThreadPoolExecutor(max_workers=self.max_hilos, thread_name_prefix="sondeo")
+        self._hilo = threading.Thread(target=self._bucle, args=(pool,), name="sondeador", daemon=True)
+        self._hilo.start()
+
+    def refrescar_ahora(self, nombre):
+        with self._lock:
+            self._fuentes[nombre]["proxima"] = 0.0
+        self._despertar.set()
+
+    def instantanea(self, nombre, espera=0):
+        fuente = self._fuentes[nombre]
+        if fuente["instantanea"] is None and espera:
+            # Arranque en frío: se espera al primer refresco, sin llamar a la fuente
+            fuente["primer_intento"].wait(espera)
+        return fuente["instantanea"]
+
+    def leer(self, nombre, por_defecto=None, espera=0):
+        inst = self.instantanea(nombre, espera)
+        return inst.datos if inst is not None else por_defecto
+
+    def version(self, nombre):
+        inst = self._fuentes[nombre]["instantanea"]
+        return inst.version if inst is not None else None
+
+    def estado(self):
+        return {
+            nombre: {
+                "intervalo_s": fuente["intervalo"],
+                "actualizado": fuente["instantanea"].actualizado.isoformat() if fuente["instantanea"] else None,
+                "version": self.version(nombre),
+                "en_curso": fuente["en_curso"],
+                "duracion_s": round(fuente["duracion"], 3) if fuente["duracion"] is not None else None,
+                "refrescos": fuente["refrescos"],
+                "fallos": fuente["fallos"],
+                "error": fuente["error"],
+            }
+            for nombre, fuente in self._fuentes.items()
+        }
+
+
+sondeador = Sondeador()
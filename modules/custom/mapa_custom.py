@@ -11,6 +11,9 @@ from dash.exceptions import PreventUpdate
 import traceback
 import smtplib
 from email.message import EmailMessage
+from modules.comun.artefactos import publicar
+
+RUTA = "/mapa/ia"
 
 # -------------------------------
 # Configuración del cliente OpenAI (usando OpenRouter)
@@ -38,6 +41,7 @@ import pandas as pd
 import folium
 from branca.element import Figure
 from dash import html
+from modules.comun.capa_puntos import CapaPuntos
 
 data_folder = os.path.join(os.path.dirname(__file__), "../../data/gasolineras")
 archivo_excel = os.path.join(data_folder, "preciosEESS_es.xlsx")
@@ -61,18 +65,17 @@ def generar_mapa_gasolineras(df):
     m = folium.Map(location=[43.2, -2.2], zoom_start=10)
     fig.add_child(m)
 
-    for _, row in df.iterrows():
-        popup = f"""
-        <b><u>{row['Rótulo']}</u></b><br>
-        {row['Dirección']}<br>
-        <b>Gasolina 95:</b> {row.get('G95', 'N/D')} €/L<br>
-        <b>Gasóleo A:</b> {row.get('GA', 'N/D')} €/L<br>
-        """
-        folium.Marker(
-            location=[row['Latitud'], row['Longitud']],
-            popup=folium.Popup(popup, max_width=250),
-            icon=folium.Icon(color="blue", prefix="fa")
-        ).add_to(m)
+    # Un único CapaPuntos para todas las filas; {columna} se sustituye por su valor
+    popup = """
+    <b><u>{Rótulo}</u></b><br>
+    {Dirección}<br>
+    <b>Gasolina 95:</b> {G95} €/L<br>
+    <b>Gasóleo A:</b> {GA} €/L<br>
+    """
+    CapaPuntos(
+        df, popup=popup, lat="Latitud", lon="Longitud", ancho_popup=250, vacio="N/D",
+        color="blue", icono="info", prefijo="fa", agrupar=True
+    ).add_to(m)
 
     return m.get_root().render()
 
@@ -116,15 +119,15 @@ Por favor genera un módulo Python completo compatible con Dash que:
 - Tenga un `layout = html.Div([...])` que muestre el mapa con `html.Iframe`.
 - Centre el mapa en Gipuzkoa (lat=43.2, lon=-2.2, zoom=10).
 - Use `Figure(width=1000, height=800)` como en el ejemplo.
+- Pinte los marcadores con `CapaPuntos` como en el ejemplo, nunca con un `folium.Marker` por fila: el fichero puede tener decenas de miles de filas.
 - NO incluya rutas fijas, ni manipule carpetas ni `__file__`.
 - Solo devuelva el código Python, sin explicaciones ni comentarios, ni con comillas de ''' python ni nada, la primera fila debe ser el primer import.
 
 El código debe comenzar con las importaciones y ser listo para ejecutar en un entorno donde `archivo_excel` contiene la ruta al archivo.
 
-Solo muestra los puntos cuya latitud esté entre 43.0 y 43.4 y longitud entre -2.49 y -1.7, es decir, filtra las filas con:
+Solo muestra los puntos cuya latitud esté entre 43.0 y 43.4 y longitud entre -2.49 y -1.7, es decir, filtra el DataFrame con:
 
-if not (43.0 <= lat <= 43.4 and -2.49 <= lon <= -1.7):
-    continue
+df = df[df[lat].between(43.0, 43.4) & df[lon].between(-2.49, -1.7)]
 
 El archivo subido ya está guardado en disco y su ruta completa está disponible en la variable archivo_excel, que apunta a {tmp_path}. Según el tipo de archivo ({filename}), el código deberá usar pd.read_excel, pd.read_csv, etc.
 
@@ -425,7 +428,7 @@ def register_callbacks(app):
             else:
                 return (
                     codigo,
-                    html.Iframe(srcDoc=mapa_html, width="100%", height="800"),
+                    html.Iframe(src=publicar(mapa_html), width="100%", height="800"),
                     {"display": "block"}
                 )
 
@@ -455,7 +458,7 @@ def register_callbacks(app):
                 else:
                     return (
                         respuesta_texto,
-                        html.Iframe(srcDoc=mapa_html, width="100%", height="800"),
+                        html.Iframe(src=publicar(mapa_html), width="100%", height="800"),
                         {"display": "block"}
                     )
 
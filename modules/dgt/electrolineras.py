@@ -1,79 +1,58 @@
 import dash
 from dash import dcc, html
+import numpy as np
 import pandas as pd
 import folium
-import requests
 from branca.element import Figure, MacroElement
 from jinja2 import Template
-import xml.etree.ElementTree as ET
+from modules.comun.cache_mapas import cachear_mapa
+from modules.comun.sondeo import sondeador
+from modules.comun.cliente_http import cliente
+from modules.comun.datex2 import leer_datex2, BBOX_GIPUZKOA
+from modules.comun.capa_puntos import CapaPuntos
+from modules.comun.capas import registrar_capa
 
-def obtener_electrolineras():
-    url = "https://infocar.dgt.es/datex2/v3/miterd/EnergyInfrastructureTablePublication/electrolineras.xml"
-    response = requests.get(url)
-    root = ET.fromstring(response.content)
-
-    ns = {
-        'd2': 'http://datex2.eu/schema/3/common',
-        'd3': 'http://datex2.eu/schema/3/energyInfrastructure',
-        'fac': 'http://datex2.eu/schema/3/facilities',
-        'loc': 'http://datex2.eu/schema/3/locationReferencing'
-    }
-
-    data = []
-
-    for site in root.findall(".//d3:energyInfrastructureSite", ns):
-        tipo = site.find("d3:typeOfSite", ns)
-        tipo_text = tipo.text if tipo is not None else "NO TIPO"
-
-        loc_ref = site.find("fac:locationReference", ns)
-        if loc_ref is None:
-            continue
-
-        coords = loc_ref.find("loc:coordinatesForDisplay", ns)
-        if coords is None:
-            continue
+RUTA = "/mapa/electrolineras"
+# El mapa sale de la última instantánea del sondeador, así que el layout es barato
+CACHEAR_LAYOUT = False
 
-        lat = coords.find("loc:latitude", ns)
-        lon = coords.find("loc:longitude", ns)
-        if lat is None or lon is None:
-            continue
-
-        try:
-            lat_val = float(lat.text)
-            lon_val = float(lon.text)
-        except:
-            continue
-        if not (43.0 <= lat_val <= 43.4 and -2.8 <= lon_val <= -1.7):
-            continue
-
-        name = site.find("fac:name", ns)
-        nombre = name.text if name is not None else "Sin nombre"
-
-        data.append({
-            "nombre": nombre,
-            "lat": lat_val,
-            "lon": lon_val,
-            "tipo": tipo_text
-        })
-
-    return pd.DataFrame(data)
+URL_ELECTROLINERAS = "https://infocar.dgt.es/datex2/v3/miterd/EnergyInfrastructureTablePublication/electrolineras.xml"
 
+def obtener_electrolineras():
+    # Si el XML no ha cambiado (304) se reutiliza el DataFrame ya parseado
+    return cliente.obtener_procesado(URL_ELECTROLINERAS, parsear_electrolineras)
+
+def parsear_electrolineras(contenido):
+    return leer_datex2(
+        contenido,
+        "energyInfrastructureSite",
+        campos={"nombre": ("{*}name", "Sin nombre"), "tipo": ("{*}typeOfSite", "NO TIPO")},
+        bbox=BBOX_GIPUZKOA,
+    )[["nombre", "lat", "lon", "tipo"]]
+
+def con_colores(df):
+    tipo_lower = df["tipo"].str.lower()
+    colores = np.select([tipo_lower == "onstreet", tipo_lower == "openspace"], ["green", "blue"], "orange")
+    return df.assign(_color=colores)
+
+sondeador.registrar("electrolineras", obtener_electrolineras, intervalo=60 * 60)
+registrar_capa(
+    "electrolineras",
+    lambda: con_colores(sondeador.leer("electrolineras", por_defecto=pd.DataFrame(columns=["tipo"]))),
+    version=lambda: sondeador.version("electrolineras"),
+)
+
+@cachear_mapa("electrolineras", version=lambda: sondeador.version("electrolineras"))
 def generar_mapa():
-    df = obtener_electrolineras()
+    df = sondeador.leer("electrolineras", por_defecto=pd.DataFrame(), espera=10)
     fig = Figure(width=1000, height=800)
     m = folium.Map(location=[43.2, -2.2], zoom_start=10)
     folium.TileLayer('OpenStreetMap').add_to(m)
     fig.add_child(m)
 
-    for _, row in df.iterrows():
-        tipo = row["tipo"]
-        tipo_lower = tipo.lower()
-        color = "green" if tipo_lower == "onstreet" else "blue" if tipo_lower == "openspace" else "orange"
-
-        folium.Marker(
-            location=[row["lat"], row["lon"]],
-            icon=folium.Icon(color=color, icon="flash", prefix='fa')
-        ).add_to(m)
+    if not df.empty:
+        df = con_colores(df)
+        CapaPuntos(df, color=df["_color"], icono="flash", prefijo="fa", agrupar=True).add_to(m)
 
     legend_html = """
     <div style="    
@@ -110,42 +89,43 @@ def generar_mapa():
 
     return m.get_root().render()
 
-layout = html.Div([
-    html.Div([
-        html.H1("Mapa de Electrolineras en Gipuzkoa", style={
-            "textAlign": "center",
-            "color": "black",
-            "fontSize": "2rem",
-            "marginBottom": "1px"
-        }),
-        html.P([
-            "Este mapa muestra las electrolineras disponibles en Gipuzkoa, clasificadas según su tipo: ",
-            "en calle (onStreet), en espacio abierto (openSpace) o sin clasificar. ",
-            "Los marcadores están coloreados para facilitar su identificación: verde para electrolineras en calle, azul para espacios abiertos y naranja para las no clasificadas. ",
-            "Para más información, puede encontrar los datos en: ",
-            html.A(
-                "infocar.dgt.es",
-                href="https://infocar.dgt.es/datex2/v3/miterd/EnergyInfrastructureTablePublication/",
-                target="_blank",
-                style={"color": "#007BFF", "textDecoration": "underline"}
+def layout():
+    return html.Div([
+        html.Div([
+            html.H1("Mapa de Electrolineras en Gipuzkoa", style={
+                "textAlign": "center",
+                "color": "black",
+                "fontSize": "2rem",
+                "marginBottom": "1px"
+            }),
+            html.P([
+                "Este mapa muestra las electrolineras disponibles en Gipuzkoa, clasificadas según su tipo: ",
+                "en calle (onStreet), en espacio abierto (openSpace) o sin clasificar. ",
+                "Los marcadores están coloreados para facilitar su identificación: verde para electrolineras en calle, azul para espacios abiertos y naranja para las no clasificadas. ",
+                "Para más información, puede encontrar los datos en: ",
+                html.A(
+                    "infocar.dgt.es",
+                    href="https://infocar.dgt.es/datex2/v3/miterd/EnergyInfrastructureTablePublication/",
+                    target="_blank",
+                    style={"color": "#007BFF", "textDecoration": "underline"}
+                )
+            ], style={
+                "textAlign": "center",
+                "color": "black",
+                "fontSize": "16px",
+                "fontFamily": "'Segoe UI', sans-serif"
+            })
+        ], style={"padding": "5px", "borderBottom": "1px solid #ddd"}),
+        dcc.Loading(
+            id="loading",
+            type="circle",
+            fullscreen=False,
+            children=html.Iframe(
+                id='mapa',
+                src=generar_mapa.url(),
+                width='100%',
+                height='1000px',
+                style={'border': 'none'}
             )
-        ], style={
-            "textAlign": "center",
-            "color": "black",
-            "fontSize": "16px",
-            "fontFamily": "'Segoe UI', sans-serif"
-        })
-    ], style={"padding": "5px", "borderBottom": "1px solid #ddd"}),
-    dcc.Loading(
-        id="loading",
-        type="circle",
-        fullscreen=False,
-        children=html.Iframe(
-            id='mapa',
-            srcDoc=generar_mapa(),
-            width='100%',
-            height='1000px',
-            style={'border': 'none'}
         )
-    )
-], style={"margin": "0", "padding": "0", "position": "relative"})
\ No newline at end of file
+    ], style={"margin": "0", "padding": "0", "position": "relative"})
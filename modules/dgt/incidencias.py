@@ -1,8 +1,15 @@
 import dash
 from dash import dcc, html, Input, Output
+import numpy as np
 import pandas as pd
 import folium
 from branca.element import Figure
+from modules.comun.cache_mapas import cachear_mapa
+from modules.comun.sondeo import sondeador
+from modules.comun.capa_puntos import CapaPuntos
+from modules.comun.capas import registrar_capa
+
+RUTA = "/mapa/incidencias"
 
 EXCEL_PATH = "data/incidencias/camaras-trafico.xlsx"
 
@@ -39,23 +46,34 @@ def obtener_camaras_trafico():
 
     return pd.DataFrame(camaras_data)
 
+def con_imagen(df):
+    url = df["url_image"].fillna("").astype(str)
+    return df.assign(imagen=np.where(
+        url != "",
+        '<img src="' + url.str.replace('"', "&quot;") + '" width="200" '
+        'onerror="this.src=\'https://placehold.co/200x150/cccccc/000000?text=No+Image\'">',
+        "",
+    ))
+
+sondeador.registrar("camaras", obtener_camaras_trafico, intervalo=10 * 60)
+registrar_capa(
+    "camaras",
+    lambda: con_imagen(sondeador.leer("camaras", por_defecto=pd.DataFrame(columns=["url_image"]))),
+    version=lambda: sondeador.version("camaras"),
+)
+
+@cachear_mapa("incidencias", version=lambda: sondeador.version("camaras"))
 def generar_mapa_trafico():
-    df = obtener_camaras_trafico()
+    df = sondeador.leer("camaras", por_defecto=pd.DataFrame(), espera=10)
 
     fig = Figure(width=1000, height=800)
     m = folium.Map(location=[43.268, -2.195], zoom_start=10)
     fig.add_child(m)
 
-    for _, row in df.iterrows():
-        popup = f"<b>{row['name']}</b><br>"
-        if row["url_image"]:
-            popup += f'<img src="{row["url_image"]}" width="200" onerror="this.src=\'https://placehold.co/200x150/cccccc/000000?text=No+Image\'">'
-        popup += f"<br>Lat: {row['lat']}<br>Lon: {row['lon']}"
-        folium.Marker(
-            location=[row["lat"], row["lon"]],
-            tooltip=row["name"],
-            popup=folium.Popup(popup, max_width=300),
-            icon=folium.Icon(color="blue", icon="video-camera", prefix='fa')
+    if not df.empty:
+        CapaPuntos(
+            con_imagen(df), popup="<b>{name}</b><br>{!imagen}<br>Lat: {lat}<br>Lon: {lon}", tooltip="{name}",
+            color="blue", icono="video-camera", prefijo="fa", agrupar=True
         ).add_to(m)
 
     return m.get_root().render()
@@ -96,7 +114,7 @@ def layout():
             children=[
                 html.Iframe(
                     id='mapa-trafico',
-                    srcDoc=generar_mapa_trafico(),
+                    src="about:blank",
                     width='100%',
                     height='800px',
                     style={'border': 'none'}
@@ -111,9 +129,9 @@ def layout():
     ])
 def register_callbacks(app):
     @app.callback(
-        Output('mapa-trafico', 'srcDoc'),
+        Output('mapa-trafico', 'src'),
         Input('interval-traffic-component', 'n_intervals')
     )
     def update_map(_):
-        return generar_mapa_trafico()
+        return generar_mapa_trafico.url()
 
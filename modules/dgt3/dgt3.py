@@ -9,6 +9,8 @@ import folium
 from branca.element import Figure
 from dash.exceptions import PreventUpdate
 
+RUTA = "/pages/dgt3"
+
 REMOTE_HOST = "82.116.171.111"
 REMOTE_PATH = "/received_data"
 
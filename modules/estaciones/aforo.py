@@ -1,89 +1,79 @@
-from dash import dcc, html, Output, Input
+from dash import dcc, html, Output, Input, ALL, ctx
 import pandas as pd
 import folium
-import dash
 import os
-import base64
+from urllib.parse import quote
 from branca.element import Figure
 from branca.element import Figure, MacroElement
 from jinja2 import Template
+from modules.comun.cache_mapas import cachear_mapa
+from modules.comun.capa_puntos import CapaPuntos, json_script, puntos_geojson
+from modules.comun.imagenes import Imagenes, version_stat
+from modules.comun.sondeo import sondeador
+from modules.estaciones.manifiesto import BASE_PATH, manifiesto
+from modules.estaciones.precalculo import TODAS, clave_semana, url_precalculada
 
-BASE_PATH = os.path.join(os.path.dirname(__file__), "../../data/estaciones")
+RUTA = "/mapa/aforo"
+# Los botones de semana salen del manifiesto: se reconstruye en cada visita
+CACHEAR_LAYOUT = False
 
-estaciones_df = pd.read_csv(os.path.join(BASE_PATH, "estaciones.csv"), sep=";", encoding="ISO-8859-1")
-estaciones_df["Latitud"] = estaciones_df["Latitud"].str.replace(",", ".").astype(float)
-estaciones_df["Longitud"] = estaciones_df["Longitud"].str.replace(",", ".").astype(float)
-estaciones_df = estaciones_df.rename(columns={"ETD code": "Estacion"})
+# Las carpetas nuevas de FlujoVehiculos_Semana_* se incorporan sin reiniciar
+sondeador.registrar("aforo_manifiesto", manifiesto.actualizar, intervalo=10 * 60)
 
-rsu_info = pd.read_excel(os.path.join(BASE_PATH, "RSU_data.xlsx"))
-rsu_info["latitude"] = rsu_info["latitude"].astype(str).str.replace(",", ".").astype(float)
-rsu_info["longitude"] = rsu_info["longitude"].astype(str).str.replace(",", ".").astype(float)
+_estaciones = None
 
-def generar_mapa_html(semana_num):
-    año = 2025
-    semana = f"Semana_{semana_num}-{año}"
-    output_dir_estaciones = os.path.join(BASE_PATH, f"FlujoVehiculos_{semana}")
-    output_dir_rsu = os.path.join(BASE_PATH, f"FlujoVehiculos_Semana_{semana_num}-{año}")
+def cargar_estaciones():
+    # Se relee solo cuando cambian estaciones.csv o RSU_data.xlsx según el manifiesto
+    global _estaciones
+    firma = manifiesto.firma_base()
+    if _estaciones is not None and _estaciones[0] == firma:
+        return _estaciones[1]
+    estaciones_df = pd.read_csv(os.path.join(BASE_PATH, "estaciones.csv"), sep=";", encoding="ISO-8859-1")
+    estaciones_df["Latitud"] = estaciones_df["Latitud"].str.replace(",", ".").astype(float)
+    estaciones_df["Longitud"] = estaciones_df["Longitud"].str.replace(",", ".").astype(float)
+    estaciones_df = estaciones_df.rename(columns={"ETD code": "Estacion"})
 
+    rsu_info = pd.read_excel(os.path.join(BASE_PATH, "RSU_data.xlsx"))
+    rsu_info["latitude"] = rsu_info["latitude"].astype(str).str.replace(",", ".").astype(float)
+    rsu_info["longitude"] = rsu_info["longitude"].astype(str).str.replace(",", ".").astype(float)
+    _estaciones = (firma, (estaciones_df, rsu_info))
+    return estaciones_df, rsu_info
+
+def version_semana(semana_num, año):
+    return manifiesto.firma_semana(semana_num, año)
+
+def semana_por_defecto():
+    semanas = manifiesto.semanas()
+    return semanas[-1] if semanas else (2025, 12)
+
+# Las gráficas se sirven como ficheros con caché larga; el popup muestra
+# primero la miniatura WebP y la cambia por el PNG completo al cargarse
+graficas = Imagenes("/graficas/aforo", BASE_PATH, carpetas="FlujoVehiculos_Semana_*")
+
+POPUP_GRAFICA = (
+    '<a href="{grafica}" target="_blank">'
+    '<img src="{miniatura}" data-completa="{grafica}" width="400" '
+    'onload="var c = this.dataset.completa; if (c) { this.dataset.completa = \'\'; this.src = c; }" '
+    'style="display:block; max-width:100%; height:auto;"></a>'
+)
+
+def con_urls(df, graficas_semana, clave):
+    # (ruta, tamaño, mtime) del manifiesto: la versión de la URL no necesita stat
+    info = [graficas_semana[str(c)] for c in df[clave]]
+    versiones = [version_stat(tamaño, mtime) for _, tamaño, mtime in info]
+    return df.assign(
+        grafica=[graficas.url(r, version=v) for (r, _, _), v in zip(info, versiones)],
+        miniatura=[graficas.url(r, miniatura=True, version=v) for (r, _, _), v in zip(info, versiones)],
+    )
+
+def mapa_base():
     fig = Figure(width=1000, height=800)
     m = folium.Map(location=[43.0, -2.0], zoom_start=8, control_scale=False, tiles=None)
     folium.TileLayer(tiles='OpenStreetMap', attr='', name='OSM', control=False).add_to(m)
     fig.add_child(m)
+    return m
 
-    for est in estaciones_df.itertuples():
-        lat = est.Latitud
-        lon = est.Longitud
-        estacion_id = est.Estacion
-        municipio = est.Municipality
-        carretera = est.System
-
-        nombre_archivo = f"Estacion_{estacion_id}_{carretera}_{municipio}.png"
-        nombre_archivo = nombre_archivo.replace(" ", "_").replace("/", "-").replace("\\", "-")
-        ruta_imagen = os.path.join(output_dir_estaciones, nombre_archivo)
-
-        if os.path.exists(ruta_imagen):
-            with open(ruta_imagen, 'rb') as img_file:
-                img_base64 = base64.b64encode(img_file.read()).decode('utf-8')
-            html_img = f'<img src="data:image/png;base64,{img_base64}" style="display:block; max-width:100%; height:auto;">'
-            iframe = folium.IFrame(html_img, width=800, height=700)
-            popup = folium.Popup(iframe, max_width=410, max_height=300)
-
-            folium.Marker(
-                location=[lat, lon],
-                popup=popup,
-                tooltip=f'Estación {estacion_id}',
-                icon=folium.Icon(color="blue")
-            ).add_to(m)
-        else:
-            folium.Marker(
-                location=[lat, lon],
-                tooltip=f'Estación {estacion_id} (Sin datos esta semana.)',
-                icon=folium.Icon(color="red")
-            ).add_to(m)
-
-    for _, rsu in rsu_info.iterrows():
-        lat = rsu["latitude"]
-        lon = rsu["longitude"]
-        rsu_id = rsu["RSU"]
-        nombre = rsu.get("Name", rsu_id)
-
-        nombre_archivo = f"RSU_{rsu_id}_Semana_{semana_num}.png"
-        ruta_imagen = os.path.join(output_dir_rsu, nombre_archivo)
-        print(f"Comprobando imagen RSU: {ruta_imagen} - Existe? {os.path.exists(ruta_imagen)}")
-
-        if os.path.exists(ruta_imagen):
-            with open(ruta_imagen, 'rb') as img_file:
-                img_base64 = base64.b64encode(img_file.read()).decode('utf-8')
-            html_img = f'<img src="data:image/png;base64,{img_base64}" style="display:block; max-width:100%; height:auto;">'
-            iframe = folium.IFrame(html_img, width=800, height=700)
-            popup = folium.Popup(iframe, max_width=410, max_height=300)
-
-            folium.Marker(
-                location=[lat, lon],
-                popup=popup,
-                tooltip=f'{rsu_id} - {nombre}',
-                icon=folium.Icon(color="green")
-            ).add_to(m)
+def añadir_leyenda(m):
     legend_html = """
     <div style="    
         position: fixed;
@@ -116,67 +106,311 @@ def generar_mapa_html(semana_num):
     legend._template = Template(f"""{{% macro html(this, kwargs) %}}{legend_html}{{% endmacro %}}""")
     m.get_root().add_child(legend)
 
+@cachear_mapa("aforo", version=version_semana)
+def generar_mapa_html(semana_num, año):
+    estaciones_df, rsu_info = cargar_estaciones()
+    graficas_semana = manifiesto.graficas(semana_num, año)
+    m = mapa_base()
+
+    tiene_grafica = estaciones_df["Estacion"].astype(str).isin(graficas_semana["estaciones"].keys())
+    con_grafica = estaciones_df[tiene_grafica]
+    sin_grafica = estaciones_df[~tiene_grafica]
+
+    rsus = rsu_info.assign(nombre=rsu_info["Name"] if "Name" in rsu_info else rsu_info["RSU"])
+    rsus = rsus[rsus["RSU"].astype(str).isin(graficas_semana["rsu"].keys())]
+
+    if not con_grafica.empty:
+        CapaPuntos(
+            con_urls(con_grafica, graficas_semana["estaciones"], "Estacion"), popup=POPUP_GRAFICA, tooltip="Estación {Estacion}",
+            lat="Latitud", lon="Longitud", ancho_popup=410, color="blue"
+        ).add_to(m)
+    if not sin_grafica.empty:
+        CapaPuntos(
+            sin_grafica, tooltip="Estación {Estacion} (Sin datos esta semana.)",
+            lat="Latitud", lon="Longitud", color="red"
+        ).add_to(m)
+    if not rsus.empty:
+        CapaPuntos(
+            con_urls(rsus, graficas_semana["rsu"], "RSU"), popup=POPUP_GRAFICA, tooltip="{RSU} - {nombre}",
+            lat="latitude", lon="longitude", ancho_popup=410, color="green"
+        ).add_to(m)
+
+    añadir_leyenda(m)
+    return m.get_root().render()
+
+
+def series_graficas(ids, tipo, semanas):
+    """
+    Por punto, el fichero de su gráfica (con {semana} donde va el número de
+    semana) y la versión de la gráfica en cada semana de `semanas` (0 si no
+    hay). Si una semana usa otro nombre de fichero, va [fichero, versión].
+    """
+    carpetas = [manifiesto.carpeta(semana, año)[1] or {} for año, semana in semanas]
+    archivos, versiones = [], []
+    for clave in ids:
+        archivo, fila = None, []
+        for (año, semana), carpeta in zip(semanas, carpetas):
+            info = carpeta.get(tipo, {}).get(clave)
+            if info is None:
+                fila.append(0)
+                continue
+            nombre = quote(info[0].replace(f"_Semana_{semana}.", "_Semana_{semana}."), safe="{}")
+            archivo = archivo or nombre
+            version = version_stat(info[1], info[2])
+            fila.append(version if nombre == archivo else [nombre, version])
+        archivos.append(archivo)
+        versiones.append(fila)
+    return archivos, versiones
+
+
+class SelectorSemanas(MacroElement):
+    """
+    Estaciones y RSU dibujadas una sola vez con las gráficas de todas las
+    semanas. Un control del mapa cambia la semana en el navegador (color,
+    tooltip y popup de cada marcador) y puede reproducirlas en bucle.
+
+    `grupos`: [{"datos": FeatureCollection con _archivo y _v, "color",
+    "color_sin" (None oculta el punto sin gráfica), "tooltip", "tooltip_sin"}].
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = (function() {
+            var o = {{ this.opciones }};
+            var mapa = {{ this._parent.get_name() }};
+            var actual = o.inicial, marcadores = [], animacion = null;
+            function escapar(v) {
+                return String(v).replace(/[&<>"']/g, function(c) {
+                    return {"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#39;"}[c];
+                });
+            }
+            function pintar(plantilla, p) {
+                return plantilla.replace(/\\{([^{}\\s]+)\\}/g, function(_, campo) {
+                    var v = p[campo];
+                    return v === null || v === undefined ? "" : escapar(v);
+                });
+            }
+            function url(f, i, miniatura) {
+                var semana = o.semanas[i], v = f.properties._v[i], archivo = f.properties._archivo;
+                if (Array.isArray(v)) { archivo = v[0]; v = v[1]; }
+                return o.prefijo + (miniatura ? "/miniatura" : "") + "/FlujoVehiculos_Semana_" + semana[1] + "-" + semana[0] +
+                       "/" + archivo.replace("{semana}", semana[1]) + "?v=" + v;
+            }
+            var iconos = {};
+            function icono(color) {
+                return iconos[color] || (iconos[color] = L.AwesomeMarkers.icon({
+                    markerColor: color, icon: "info-sign", prefix: "glyphicon", iconColor: "white", extraClasses: "fa-rotate-0"
+                }));
+            }
+            o.grupos.forEach(function(g) {
+                g.datos.features.forEach(function(f) {
+                    var c = f.geometry.coordinates;
+                    var x = {f: f, g: g, color: null, m: L.marker([c[1], c[0]])};
+                    x.m.bindTooltip(function() {
+                        return pintar(f.properties._v[actual] ? g.tooltip : g.tooltip_sin, f.properties);
+                    });
+                    x.popup = function() {
+                        return pintar(o.popup, {grafica: url(f, actual, false), miniatura: url(f, actual, true)});
+                    };
+                    marcadores.push(x);
+                });
+            });
+            function mostrar(i) {
+                actual = i;
+                var siguiente = (i + 1) % o.semanas.length;
+                marcadores.forEach(function(x) {
+                    var hay = !!x.f.properties._v[i];
+                    var color = hay ? x.g.color : x.g.color_sin;
+                    if (!color) {
+                        mapa.removeLayer(x.m);
+                        return;
+                    }
+                    if (x.color !== color) {
+                        x.m.setIcon(icono(color));
+                        x.color = color;
+                    }
+                    if (!hay) {
+                        x.m.unbindPopup();
+                    } else if (!x.m.getPopup()) {
+                        x.m.bindPopup(x.popup, {maxWidth: o.ancho_popup});
+                    } else if (x.m.isPopupOpen()) {
+                        x.m.getPopup().update();
+                        // Durante la reproducción se adelanta la miniatura de la semana siguiente
+                        if (animacion && x.f.properties._v[siguiente]) new Image().src = url(x.f, siguiente, true);
+                    }
+                    x.m.addTo(mapa);
+                });
+                rango.value = i;
+                etiqueta.textContent = "Semana " + o.semanas[i][1] + " (" + o.semanas[i][0] + ")";
+            }
+            var control = L.control({position: "bottomleft"});
+            var rango, etiqueta, boton;
+            control.onAdd = function() {
+                var div = L.DomUtil.create("div", "leaflet-bar");
+                div.style.cssText = "background:white;padding:6px 10px;font:14px 'Segoe UI',sans-serif;display:flex;align-items:center;gap:8px";
+                boton = L.DomUtil.create("button", "", div);
+                boton.type = "button";
+                boton.title = "Reproducir semanas";
+                boton.textContent = "\u25B6";
+                rango = L.DomUtil.create("input", "", div);
+                rango.type = "range";
+                rango.min = 0;
+                rango.max = o.semanas.length - 1;
+                rango.step = 1;
+                rango.style.width = "240px";
+                etiqueta = L.DomUtil.create("span", "", div);
+                L.DomEvent.disableClickPropagation(div);
+                L.DomEvent.disableScrollPropagation(div);
+                rango.addEventListener("input", function() { mostrar(parseInt(rango.value, 10)); });
+                boton.addEventListener("click", function() {
+                    if (animacion) {
+                        clearInterval(animacion);
+                        animacion = null;
+                        boton.textContent = "\u25B6";
+                        return;
+                    }
+                    boton.textContent = "\u275A\u275A";
+                    animacion = setInterval(function() { mostrar((actual + 1) % o.semanas.length); }, o.paso_ms);
+                });
+                return div;
+            };
+            control.addTo(mapa);
+            if (o.semanas.length) mostrar(actual);
+            return control;
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, semanas, grupos, popup, inicial=None, ancho_popup=410, paso_ms=1500, prefijo=""):
+        super().__init__()
+        self._name = "SelectorSemanas"
+        self.opciones = json_script({
+            "semanas": [list(s) for s in semanas],
+            "grupos": grupos,
+            "popup": popup,
+            "inicial": len(semanas) - 1 if inicial is None else inicial,
+            "ancho_popup": ancho_popup,
+            "paso_ms": paso_ms,
+            "prefijo": prefijo,
+        })
+
+def version_semanas():
+    return manifiesto.firma()
+
+@cachear_mapa("aforo_semanas", version=version_semanas)
+def generar_mapa_semanas():
+    estaciones_df, rsu_info = cargar_estaciones()
+    semanas = manifiesto.semanas()
+    m = mapa_base()
+
+    archivos, versiones = series_graficas(estaciones_df["Estacion"].astype(str), "estaciones", semanas)
+    estaciones = puntos_geojson(estaciones_df, "Latitud", "Longitud", ["Estacion"], {"_archivo": archivos, "_v": versiones})
+
+    rsus = rsu_info.assign(nombre=rsu_info["Name"] if "Name" in rsu_info else rsu_info["RSU"])
+    archivos, versiones = series_graficas(rsus["RSU"].astype(str), "rsu", semanas)
+    rsus = puntos_geojson(rsus, "latitude", "longitude", ["RSU", "nombre"], {"_archivo": archivos, "_v": versiones})
+
+    SelectorSemanas(semanas, [
+        {"datos": estaciones, "color": "blue", "color_sin": "red",
+         "tooltip": "Estación {Estacion}", "tooltip_sin": "Estación {Estacion} (Sin datos esta semana.)"},
+        {"datos": rsus, "color": "green", "color_sin": None,
+         "tooltip": "{RSU} - {nombre}", "tooltip_sin": "{RSU} - {nombre}"},
+    ], popup=POPUP_GRAFICA, prefijo=graficas.prefijo).add_to(m)
+
+    añadir_leyenda(m)
     return m.get_root().render()
 
-layout = html.Div([
+def url_semana(semana_num, año):
+    # Artefacto precalculado en el despliegue; si falta, se renderiza bajo demanda
+    clave = clave_semana(semana_num, año)
+    return url_precalculada(clave, version_semana(semana_num, año)) or generar_mapa_html.url(semana_num, año)
+
+def url_semanas():
+    return url_precalculada(TODAS, version_semanas()) or generar_mapa_semanas.url()
+
+ESTILO_BOTONES = {"display": "flex", "flexWrap": "wrap", "gap": "10px", "marginBottom": "20px"}
+
+def layout():
+    return html.Div([
     
-    html.Div([
-            html.H1("Mapa de Flujo de Vehiculos", style={
-                "textAlign": "center",
-                "color": "black",
-                "fontSize": "2rem",
-                "marginBottom": "15px",
-            }),
-            html.P([
-            "Este mapa muestra la ubicación de las estaciones de aforo de tráfico (espiras) y las RSU desplegadas en Gipuzkoa "
-            "Cada marcador representa una estación o unidad concreta: las estaciones de aforo (en azul) y  las RSU (en verde). "
-            "Al hacer clic en cada marcador, se visualiza una gráfica correspondiente a esa semana específica, con los patrones de tráfico registrados. Las espiras sin datos disponibles en la semana seleccionada aparecen en rojo. Puedes seleccionar distintas semanas para explorar cómo varía el tráfico en el territorio. ",
-            "Para más información, puede encontrar los datos relacionados con las espiras (los datos de las RSU son privados) en: ",
-                html.A(
-                    "gipuzkoairekia.eus",
-                    href="https://urretxu.gipuzkoairekia.eus/es/web/guest/datu-irekien-katalogoa/-/openDataSearcher/detail/detailView/07c8a249-c1ba-4a77-bed3-d174980f652e",
-                    target="_blank",
-                    style={"color": "#007BFF", "textDecoration": "underline"}
-                )],
+        html.Div([
+                html.H1("Mapa de Flujo de Vehiculos", style={
+                    "textAlign": "center",
+                    "color": "black",
+                    "fontSize": "2rem",
+                    "marginBottom": "15px",
+                }),
+                html.P([
+                "Este mapa muestra la ubicación de las estaciones de aforo de tráfico (espiras) y las RSU desplegadas en Gipuzkoa "
+                "Cada marcador representa una estación o unidad concreta: las estaciones de aforo (en azul) y  las RSU (en verde). "
+                "Al hacer clic en cada marcador, se visualiza una gráfica correspondiente a esa semana específica, con los patrones de tráfico registrados. Las espiras sin datos disponibles en la semana seleccionada aparecen en rojo. Puedes seleccionar distintas semanas para explorar cómo varía el tráfico en el territorio. ",
+                "Para más información, puede encontrar los datos relacionados con las espiras (los datos de las RSU son privados) en: ",
+                    html.A(
+                        "gipuzkoairekia.eus",
+                        href="https://urretxu.gipuzkoairekia.eus/es/web/guest/datu-irekien-katalogoa/-/openDataSearcher/detail/detailView/07c8a249-c1ba-4a77-bed3-d174980f652e",
+                        target="_blank",
+                        style={"color": "#007BFF", "textDecoration": "underline"}
+                    )],
             
-                    style={
-                        "textAlign": "center",
-                        "color": "black",
-                        "fontSize": "16px",
-                        "fontFamily": "'Segoe UI', sans-serif",
-                        "marginTop": "15px",
-                        "marginBottom": "15px",
-                    }
-                ),
-            ]),    
+                        style={
+                            "textAlign": "center",
+                            "color": "black",
+                            "fontSize": "16px",
+                            "fontFamily": "'Segoe UI', sans-serif",
+                            "marginTop": "15px",
+                            "marginBottom": "15px",
+                        }
+                    ),
+                ]),    
     
-    html.Div([
-        html.Button(f"Semana {i}", id=f"btn-{i}", n_clicks=0) for i in range(2, 22)
-    ], style={"display": "flex", "flexWrap": "wrap", "gap": "10px", "marginBottom": "20px"}),
-
-    dcc.Loading(
-        id="loading",
-        type="circle",
-        fullscreen=False,
-        children=html.Iframe(
-            id='mapa-aforo',
-            srcDoc=generar_mapa_html(2),
-            width='100%',
-            height='1000px',
-            style={'border': 'none'}
+        # Por defecto un único mapa con todas las semanas (se cambian en el navegador);
+        # el modo semanal carga un mapa por semana
+        dcc.RadioItems(
+            id="aforo-modo",
+            options=[
+                {"label": " Todas las semanas", "value": "interactivo"},
+                {"label": " Semana a semana", "value": "semanal"},
+            ],
+            value="interactivo",
+            inline=True,
+            inputStyle={"marginLeft": "12px"},
+            style={"marginBottom": "10px"},
+        ),
+        html.Div([
+            html.Button(f"Semana {semana}", id={"type": "btn-semana", "semana": semana, "año": año}, n_clicks=0)
+            for año, semana in manifiesto.semanas()
+        ], id="aforo-botones", style=dict(ESTILO_BOTONES, display="none")),
+
+        dcc.Loading(
+            id="loading",
+            type="circle",
+            fullscreen=False,
+            children=html.Iframe(
+                id='mapa-aforo',
+                src=url_semanas(),
+                width='100%',
+                height='1000px',
+                style={'border': 'none'}
+            )
         )
-    )
-])
+    ])
 
 def register_callbacks(app):
+    graficas.registrar(app.server)
+
     @app.callback(
-        Output('mapa-aforo', 'srcDoc'),
-        [Input(f'btn-{i}', 'n_clicks') for i in range(2, 22)]
+        Output('mapa-aforo', 'src'),
+        Output('aforo-botones', 'style'),
+        Input('aforo-modo', 'value'),
+        Input({"type": "btn-semana", "semana": ALL, "año": ALL}, 'n_clicks'),
+        prevent_initial_call=True
     )
-    def actualizar_mapa(*n_clicks):
-        ctx = dash.callback_context
-        semana_activa = 12  
-        if ctx.triggered:
-            boton_id = ctx.triggered[0]['prop_id'].split('.')[0]
-            semana_activa = int(boton_id.split('-')[1])
-        return generar_mapa_html(semana_activa)
+    def actualizar_mapa(modo, n_clicks):
+        if modo != "semanal":
+            return url_semanas(), dict(ESTILO_BOTONES, display="none")
+        boton = ctx.triggered_id
+        if isinstance(boton, dict) and any(n_clicks):
+            año, semana = boton["año"], boton["semana"]
+        else:
+            año, semana = semana_por_defecto()
+        return url_semana(semana, año), ESTILO_BOTONES
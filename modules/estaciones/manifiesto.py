@@ -0,0 +1,154 @@
+"""
+Índice de las carpetas semanales de aforo (FlujoVehiculos_Semana_<n>-<año>).
+
+Se recorre data/estaciones una vez y se guarda en disco un manifiesto con,
+por semana, la gráfica de cada estación y RSU (fichero, tamaño y mtime).
+Las actualizaciones solo vuelven a listar las carpetas cuyo mtime ha
+cambiado, así que pintar un mapa no toca el sistema de ficheros.
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+
+from modules.comun.artefactos import ARTEFACTOS_DIR, escribir_atomico
+
+BASE_PATH = os.path.join(os.path.dirname(__file__), "../../data/estaciones")
+MANIFIESTO_PATH = os.environ.get("AFORO_MANIFIESTO", os.path.join(ARTEFACTOS_DIR, "aforo_manifiesto.json.gz"))
+FICHEROS_BASE = ("estaciones.csv", "RSU_data.xlsx")
+
+_CARPETA = re.compile(r"^FlujoVehiculos_Semana_(\d+)-(\d{4})$")
+_ESTACION = re.compile(r"^Estacion_([^_]+)_.*\.png$")
+_RSU = re.compile(r"^RSU_(.+)_Semana_\d+\.png$")
+
+
+def _firma(datos):
+    return hashlib.sha1(json.dumps(datos, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def _escanear_carpeta(ruta):
+    estaciones, rsus = {}, {}
+    with os.scandir(ruta) as it:
+        for entrada in it:
+            st = entrada.stat()
+            info = [entrada.name, st.st_size, st.st_mtime_ns]
+            if (m := _ESTACION.match(entrada.name)):
+                estaciones[m.group(1)] = info
+            elif (m := _RSU.match(entrada.name)):
+                rsus[m.group(1)] = info
+    return {"estaciones": estaciones, "rsu": rsus}
+
+
+class Manifiesto:
+    def __init__(self, base=BASE_PATH, ruta=MANIFIESTO_PATH):
+        self.base = os.path.abspath(base)
+        self.ruta = ruta
+        self._datos = None
+        self._firma = (None, None)
+        self._lock = threading.Lock()
+
+    def _cargar(self):
+        try:
+            with open(self.ruta, "rb") as f:
+                datos = json.loads(gzip.decompress(f.read()))
+            if datos.get("base") == self.base:
+                return datos
+        except (OSError, ValueError):
+            pass
+        return {"base": self.base, "ficheros": {}, "carpetas": {}}
+
+    def actualizar(self):
+        """
+        Reescanea solo las carpetas nuevas o modificadas, elimina las que ya
+        no existen y guarda el manifiesto si ha cambiado. Devuelve las semanas.
+        """
+        with self._lock:
+            datos = self._datos if self._datos is not None else self._cargar()
+            cambiado = self._datos is None
+
+            ficheros = {}
+            for nombre in FICHEROS_BASE:
+                try:
+                    st = os.stat(os.path.join(self.base, nombre))
+                    ficheros[nombre] = [st.st_size, st.st_mtime_ns]
+                except OSError:
+                    ficheros[nombre] = None
+            if ficheros != datos["ficheros"]:
+                datos = dict(datos, ficheros=ficheros)
+                cambiado = True
+
+            carpetas = {}
+            with os.scandir(self.base) as it:
+                for entrada in it:
+                    m = _CARPETA.match(entrada.name)
+                    if not m or not entrada.is_dir():
+                        continue
+                    mtime = entrada.stat().st_mtime_ns
+                    previa = datos["carpetas"].get(entrada.name)
+                    if previa is not None and previa["mtime_ns"] == mtime:
+                        carpetas[entrada.name] = previa
+                        continue
+                    carpetas[entrada.name] = dict(
+                        _escanear_carpeta(entrada.path),
+                        semana=int(m.group(1)), año=int(m.group(2)), mtime_ns=mtime,
+                    )
+                    cambiado = True
+            if carpetas.keys() != datos["carpetas"].keys():
+                cambiado = True
+
+            if cambiado:
+                datos = dict(datos, carpetas=carpetas)
+                try:
+                    os.makedirs(os.path.dirname(self.ruta), exist_ok=True)
+                    escribir_atomico(self.ruta, gzip.compress(json.dumps(datos, separators=(",", ":")).encode("utf-8")))
+                except OSError as e:
+                    print(f"No se pudo guardar el manifiesto de aforo: {e}")
+                # Se sustituye el dict entero: los lectores nunca ven uno a medias
+                self._datos = datos
+            return self.semanas()
+
+    def _obtener(self):
+        if self._datos is None:
+            self.actualizar()
+        return self._datos
+
+    def semanas(self):
+        """[(año, semana), ...] ordenadas."""
+        return sorted((c["año"], c["semana"]) for c in self._obtener()["carpetas"].values())
+
+    def carpeta(self, semana, año):
+        nombre = f"FlujoVehiculos_Semana_{semana}-{año}"
+        return nombre, self._obtener()["carpetas"].get(nombre)
+
+    def graficas(self, semana, año):
+        """
+        {"estaciones": {id: (ruta, tamaño, mtime_ns)}, "rsu": {...}} de la semana,
+        sin tocar disco.
+        """
+        nombre, carpeta = self.carpeta(semana, año)
+        if carpeta is None:
+            return {"estaciones": {}, "rsu": {}}
+        directorio = os.path.join(self.base, nombre)
+        return {
+            tipo: {clave: (os.path.join(directorio, archivo), tamaño, mtime) for clave, (archivo, tamaño, mtime) in carpeta[tipo].items()}
+            for tipo in ("estaciones", "rsu")
+        }
+
+    def firma_base(self):
+        return _firma(self._obtener()["ficheros"])
+
+    def firma(self):
+        """Cambia con cualquier fichero base o gráfica de cualquier semana."""
+        datos = self._obtener()
+        if self._firma[0] is not datos:
+            self._firma = (datos, _firma([datos["ficheros"], datos["carpetas"]]))
+        return self._firma[1]
+
+    def firma_semana(self, semana, año):
+        _, carpeta = self.carpeta(semana, año)
+        return _firma([self._obtener()["ficheros"], carpeta])
+
+
+manifiesto = Manifiesto()
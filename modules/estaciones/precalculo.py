@@ -0,0 +1,116 @@
+"""
+Precálculo de los mapas semanales de aforo.
+
+Renderiza todas las semanas del manifiesto (y el mapa con selector de semanas)
+en un pool de procesos, publica el HTML comprimido como artefacto y apunta la
+URL de cada mapa en un índice en disco. La página de aforo sirve directamente esos artefactos y solo renderiza
+bajo demanda las semanas que falten o cuyos datos hayan cambiado. Se ejecuta
+en cada despliegue:
+
+    python -m modules.estaciones.precalculo [--procesos 4] [--forzar]
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from modules.comun.artefactos import ARTEFACTOS_DIR, escribir_atomico, registrar_referencias
+from modules.estaciones.manifiesto import manifiesto
+
+INDICE_PATH = os.path.join(ARTEFACTOS_DIR, "aforo_semanas.json")
+# Clave del mapa con todas las semanas en el índice
+TODAS = "todas"
+
+_indice = (None, {})
+_lock = threading.Lock()
+
+
+def clave_semana(semana, año):
+    return f"{año}-{semana}"
+
+
+def leer_indice():
+    # Se relee solo si otro proceso (el precálculo) lo ha reescrito
+    global _indice
+    try:
+        mtime = os.stat(INDICE_PATH).st_mtime_ns
+    except OSError:
+        return {}
+    if _indice[0] != mtime:
+        with _lock:
+            if _indice[0] != mtime:
+                try:
+                    with open(INDICE_PATH, encoding="utf-8") as f:
+                        _indice = (mtime, json.load(f))
+                except (OSError, ValueError) as e:
+                    print(f"No se pudo leer el índice de mapas de aforo: {e}")
+                    _indice = (mtime, {})
+    return _indice[1]
+
+
+# Los mapas del índice se mantienen aunque nadie los pida en ARTEFACTOS_DIAS
+registrar_referencias(lambda: [entrada["url"] for entrada in leer_indice().values()])
+
+
+def url_precalculada(clave, version):
+    """URL del artefacto `clave` si está precalculado para esta versión de datos."""
+    entrada = leer_indice().get(clave)
+    if entrada is None or entrada["version"] != version:
+        return None
+    # Si el artefacto ya no está (borrado a mano, otro ARTEFACTOS_DIR...), se renderiza
+    digest = entrada["url"].rsplit("/", 1)[-1].removesuffix(".html")
+    if not os.path.exists(os.path.join(ARTEFACTOS_DIR, f"{digest}.html.gz")):
+        return None
+    return entrada["url"]
+
+
+def _renderizar(clave, semana, año):
+    # Se ejecuta en un proceso del pool: importa aforo allí para no compartir estado
+    from modules.comun.artefactos import publicar
+    from modules.estaciones import aforo
+
+    inicio = time.perf_counter()
+    if clave == TODAS:
+        version, html = aforo.version_semanas(), aforo.generar_mapa_semanas.sin_cache()
+    else:
+        version, html = aforo.version_semana(semana, año), aforo.generar_mapa_html.sin_cache(semana, año)
+    return clave, version, publicar(html), time.perf_counter() - inicio
+
+
+def precalcular(procesos=None, forzar=False):
+    manifiesto.actualizar()
+    indice = dict(leer_indice())
+    mapas = [(TODAS, None, None, manifiesto.firma())] + [
+        (clave_semana(semana, año), semana, año, manifiesto.firma_semana(semana, año))
+        for año, semana in manifiesto.semanas()
+    ]
+    pendientes = [m[:3] for m in mapas if forzar or url_precalculada(m[0], m[3]) is None]
+    if not pendientes:
+        return indice, 0
+
+    os.makedirs(ARTEFACTOS_DIR, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=procesos) as pool:
+        futuros = [pool.submit(_renderizar, *pendiente) for pendiente in pendientes]
+        for futuro in as_completed(futuros):
+            try:
+                clave, version, url, duracion = futuro.result()
+            except Exception as e:
+                print(f"Error precalculando un mapa de aforo: {e}")
+                continue
+            indice[clave] = {"version": version, "url": url}
+            print(f"{clave}: {url} ({duracion:.1f} s)")
+
+    escribir_atomico(INDICE_PATH, json.dumps(indice, indent=1, sort_keys=True).encode("utf-8"))
+    return indice, len(pendientes)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precalcula los mapas semanales de aforo")
+    parser.add_argument("--procesos", type=int, default=None, help="procesos del pool (por defecto, uno por CPU)")
+    parser.add_argument("--forzar", action="store_true", help="vuelve a renderizar aunque los datos no hayan cambiado")
+    args = parser.parse_args()
+    inicio = time.perf_counter()
+    indice, renderizadas = precalcular(args.procesos, args.forzar)
+    print(f"{renderizadas} mapas renderizados, {len(indice)} en el índice ({time.perf_counter() - inicio:.1f} s)")
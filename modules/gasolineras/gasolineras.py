@@ -3,6 +3,12 @@ import pandas as pd
 import folium
 from branca.element import Figure
 from dash import html
+from modules.comun.artefactos import publicar
+from modules.comun.capa_puntos import CapaPuntos
+from modules.comun.capas import registrar_capa
+from modules.comun.cache_mapas import version_ficheros
+
+RUTA = "/mapa/gasolineras"
 
 data_folder = os.path.join(os.path.dirname(__file__), "../../data/gasolineras")
 archivo_excel = os.path.join(data_folder, "preciosEESS_es.xlsx")
@@ -18,58 +24,64 @@ def cargar_datos_gasolineras(ruta_excel):
     })
     return df
 
+registrar_capa(
+    "gasolineras",
+    lambda: cargar_datos_gasolineras(archivo_excel),
+    version=lambda: version_ficheros(archivo_excel),
+    lat="Latitud",
+    lon="Longitud",
+    propiedades=["Rótulo", "Dirección", "Municipio", "G95", "GA"],
+)
+
 def generar_mapa_gasolineras(df):
     fig = Figure(width=1000, height=800)
     m = folium.Map(location=[43.2, -2.2], zoom_start=10)
     fig.add_child(m)
 
-    for _, row in df.iterrows():
-        popup = f"""
-        <b><u>{row['Rótulo']}</u></b><br>
-        {row['Dirección']}<br>
-        <b>Gasolina 95:</b> {row.get('G95', 'N/D')} €/L<br>
-        <b>Gasóleo A:</b> {row.get('GA', 'N/D')} €/L<br>
-        """
-
-        folium.Marker(
-            location=[row['Latitud'], row['Longitud']],
-            popup=folium.Popup(popup, max_width=250),
-            icon=folium.Icon(color="red", icon="tint", prefix="fa")
-        ).add_to(m)
+    popup = """
+    <b><u>{Rótulo}</u></b><br>
+    {Dirección}<br>
+    <b>Gasolina 95:</b> {G95} €/L<br>
+    <b>Gasóleo A:</b> {GA} €/L<br>
+    """
+    CapaPuntos(
+        df, popup=popup, lat="Latitud", lon="Longitud", ancho_popup=250, vacio="N/D",
+        color="red", icono="tint", prefijo="fa", agrupar=True
+    ).add_to(m)
 
     return m.get_root().render()
 
+def layout():
+    try:
+        df_gasolineras = cargar_datos_gasolineras(archivo_excel)
+        mapa_html = generar_mapa_gasolineras(df_gasolineras)
+    except Exception as e:
+        mapa_html = f"<p>Error al cargar los datos de gasolineras: {str(e)}</p>"
 
-try:
-    df_gasolineras = cargar_datos_gasolineras(archivo_excel)
-    mapa_html = generar_mapa_gasolineras(df_gasolineras)
-except Exception as e:
-    mapa_html = f"<p>Error al cargar los datos de gasolineras: {str(e)}</p>"
-
-layout = html.Div([
-    html.Div([
-        html.H1("Mapa de Gasolineras en Gipuzkoa", style={
-            "textAlign": "center",
-            "color": "black",
-            "fontSize": "2rem",
-            "marginBottom": "1px"
-        }),
-        html.P([
-        "Este mapa interactivo muestra las gasolineras disponibles en Gipuzkoa, incluyendo su ubicación y los precios actuales de gasolina 95 y gasóleo A. ",
-        "Para más información, puede encontrar los datos en: ",
-            html.A(
-                "geoportalgasolineras.es",
-                href="https://geoportalgasolineras.es/geoportal-instalaciones/DescargarFicheros",
-                target="_blank",
-                style={"color": "#007BFF", "textDecoration": "underline"}
-            )
-        ], style={
-            "textAlign": "center",
-            "color": "black",
-            "fontSize": "16px",
-            "fontFamily": "'Segoe UI', sans-serif"
-        })
-    ], style={"padding": "5px", "borderBottom": "1px solid #ddd"}),
+    return html.Div([
+        html.Div([
+            html.H1("Mapa de Gasolineras en Gipuzkoa", style={
+                "textAlign": "center",
+                "color": "black",
+                "fontSize": "2rem",
+                "marginBottom": "1px"
+            }),
+            html.P([
+            "Este mapa interactivo muestra las gasolineras disponibles en Gipuzkoa, incluyendo su ubicación y los precios actuales de gasolina 95 y gasóleo A. ",
+            "Para más información, puede encontrar los datos en: ",
+                html.A(
+                    "geoportalgasolineras.es",
+                    href="https://geoportalgasolineras.es/geoportal-instalaciones/DescargarFicheros",
+                    target="_blank",
+                    style={"color": "#007BFF", "textDecoration": "underline"}
+                )
+            ], style={
+                "textAlign": "center",
+                "color": "black",
+                "fontSize": "16px",
+                "fontFamily": "'Segoe UI', sans-serif"
+            })
+        ], style={"padding": "5px", "borderBottom": "1px solid #ddd"}),
 
-    html.Iframe(srcDoc=mapa_html, width="100%", height="800")
-])
+        html.Iframe(src=publicar(mapa_html), width="100%", height="800")
+    ])
@@ -0,0 +1,248 @@
+"""
+Acceso a la base de datos de las RSU (conteos Bluetooth).
+
+- Un pool de conexiones por conjunto de credenciales: el pool se crea al
+  primer uso y solo si las credenciales son válidas.
+- Consultas con parámetros (nada de fechas interpoladas en el SQL). La de
+  conteos filtra por el epoch sin transformar y por la clase de dispositivo
+  con el mismo predicado que el índice parcial INDICES, así que puede usar
+  el índice; los intervalos sin detecciones se rellenan con ceros en el
+  cliente en lugar de con un CROSS JOIN en la base de datos.
+- Caché de resultados por rango de fechas y credenciales: un rango contenido
+  en otro ya consultado se sirve recortando el resultado guardado. Los
+  rangos que llegan hasta hoy caducan a los CACHE_TTL segundos, porque siguen
+  entrando datos.
+
+Los parámetros de conexión se pueden cambiar por variables de entorno (por
+ejemplo, para probar contra un PostgreSQL local con una tabla data_bluetooth
+sintética: python -m benchmarks.bench_rsu).
+"""
+import argparse
+import getpass
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+DB_HOST = os.environ.get("RSU_DB_HOST", "34.245.188.222")
+DB_PORT = os.environ.get("RSU_DB_PORT", "5432")
+DB_NAME = os.environ.get("RSU_DB_NAME", "gll_data")
+MAX_CONEXIONES = int(os.environ.get("RSU_MAX_CONEXIONES", 4))
+# Filas guardadas entre todos los rangos y vida de los que incluyen el día de hoy
+CACHE_FILAS = int(os.environ.get("RSU_CACHE_FILAS", 2_000_000))
+CACHE_TTL = float(os.environ.get("RSU_CACHE_TTL", 300))
+INTERVALO = timedelta(minutes=5)
+
+# Filtro de vehículos (class_of_device acabado en 0408): el mismo texto en la consulta y en el índice
+# parcial, para que el planificador pueda usarlo
+FILTRO_VEHICULOS = "class_of_device::text LIKE '%%0408'"
+# Índice parcial con solo las detecciones de vehículos: el filtro por clase queda precalculado y
+# el rango de epoch y la RSU se leen del índice (python -m modules.rsu.datos --crear-indices)
+INDICES = (
+    "CREATE INDEX IF NOT EXISTS data_bluetooth_vehiculos_timestamp "
+    "ON public.data_bluetooth (timestamp, rsu) WHERE " + FILTRO_VEHICULOS.replace("%%", "%"),
+)
+
+# Filtro sobre el epoch tal cual (los límites se pasan a epoch una sola vez, en la zona de la
+# sesión) y agrupación por el número de intervalo; los huecos se rellenan en el cliente
+CONSULTA_CONTEOS = """
+SELECT
+  rsu,
+  to_timestamp(intervalo * 300)::timestamp AS intervalo_5min,
+  vehiculos_contados
+FROM (
+  SELECT rsu, floor(timestamp / 300) AS intervalo, COUNT(*) AS vehiculos_contados
+  FROM public.data_bluetooth
+  WHERE
+    timestamp >= extract(epoch FROM %(desde)s::timestamptz)::bigint
+    AND timestamp < extract(epoch FROM %(hasta)s::timestamptz)::bigint
+    AND """ + FILTRO_VEHICULOS + """
+  GROUP BY 1, 2
+) c;
+"""
+CONSULTA_RSUS = "SELECT DISTINCT rsu FROM public.data_bluetooth ORDER BY rsu;"
+# La lista de RSU (toda la tabla) cambia muy de vez en cuando
+RSUS_TTL = float(os.environ.get("RSU_RSUS_TTL", 3600))
+
+
+def _credenciales(usuario, contraseña):
+    # La contraseña no se guarda en claro en las claves del pool ni de la caché
+    return (DB_HOST, str(DB_PORT), DB_NAME, usuario, hashlib.sha256(contraseña.encode("utf-8")).hexdigest())
+
+
+_pools = {}
+_lock_pools = threading.Lock()
+
+
+def _pool(usuario, contraseña):
+    clave = _credenciales(usuario, contraseña)
+    pool = _pools.get(clave)
+    if pool is None:
+        with _lock_pools:
+            pool = _pools.get(clave)
+            if pool is None:
+                # minconn=1: la primera conexión se abre ya y unas credenciales malas no dejan pool
+                pool = ThreadedConnectionPool(1, MAX_CONEXIONES, host=DB_HOST, port=DB_PORT, dbname=DB_NAME,
+                                              user=usuario, password=contraseña, connect_timeout=10)
+                _pools[clave] = pool
+    return pool
+
+
+@contextmanager
+def conexion(usuario, contraseña):
+    """Conexión del pool de esas credenciales, de solo lectura; se devuelve al pool al salir."""
+    pool = _pool(usuario, contraseña)
+    conn = pool.getconn()
+    rota = False
+    try:
+        if not conn.autocommit:
+            conn.set_session(readonly=True, autocommit=True)
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        rota = True
+        raise
+    finally:
+        pool.putconn(conn, close=rota or conn.closed != 0)
+
+
+def consultar(usuario, contraseña, sql, parametros=None):
+    """DataFrame con el resultado de una consulta con parámetros."""
+    # Con credenciales malas falla aquí, sin reintentar
+    _pool(usuario, contraseña)
+    for intento in range(2):
+        try:
+            with conexion(usuario, contraseña) as conn, conn.cursor() as cursor:
+                cursor.execute(sql, parametros)
+                columnas = [c[0] for c in cursor.description]
+                return pd.DataFrame(cursor.fetchall(), columns=columnas)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # Una conexión del pool caída (reinicio del servidor, timeout): se reintenta una vez con otra
+            if intento:
+                raise
+
+
+def _dia(valor):
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    return date.fromisoformat(str(valor)[:10])
+
+
+_rsus = {}
+
+
+def rsus(usuario, contraseña):
+    """Todas las RSU de la tabla (con o sin detecciones en el rango), ordenadas."""
+    credenciales = _credenciales(usuario, contraseña)
+    guardadas = _rsus.get(credenciales)
+    if guardadas is not None and guardadas[1] > time.monotonic():
+        return guardadas[0]
+    lista = consultar(usuario, contraseña, CONSULTA_RSUS)["rsu"].to_numpy(dtype=object)
+    _rsus[credenciales] = (lista, time.monotonic() + RSUS_TTL)
+    return lista
+
+
+def rellenar(df, rsus, desde, ultimo):
+    """
+    Una fila por RSU e intervalo de 5 minutos entre `desde` y `ultimo`, con
+    los conteos de `df` (rsu, intervalo_5min, vehiculos_contados) y 0 en el resto.
+    """
+    intervalos = pd.date_range(desde, ultimo, freq=INTERVALO)
+    conteos = np.zeros(len(rsus) * len(intervalos), dtype=np.int64)
+    if len(df):
+        fila = pd.Index(rsus).get_indexer(df["rsu"])
+        columna = intervalos.get_indexer(pd.to_datetime(df["intervalo_5min"]))
+        validas = (fila >= 0) & (columna >= 0)
+        # Con el cambio de hora dos intervalos reales caen en la misma hora local: se suman
+        np.add.at(conteos, fila[validas] * len(intervalos) + columna[validas],
+                  df["vehiculos_contados"].to_numpy(dtype=np.int64)[validas])
+    return pd.DataFrame({
+        "rsu": np.repeat(np.asarray(rsus, dtype=object), len(intervalos)),
+        "intervalo_5min": np.tile(intervalos.to_numpy(), len(rsus)),
+        "vehiculos_contados": conteos,
+    })
+
+
+def _conteos(usuario, contraseña, inicio, fin):
+    desde = datetime.combine(inicio, datetime.min.time())
+    hasta = datetime.combine(fin, datetime.min.time()) + timedelta(days=1)
+    df = consultar(usuario, contraseña, CONSULTA_CONTEOS, {"desde": desde, "hasta": hasta})
+    return rellenar(df, rsus(usuario, contraseña), desde, hasta - INTERVALO)
+
+
+def recortar(df, inicio, fin):
+    """Filas de los intervalos de 5 minutos de los días `inicio` a `fin` (incluidos)."""
+    desde = pd.Timestamp(inicio)
+    hasta = pd.Timestamp(fin) + pd.Timedelta(days=1)
+    intervalos = df["intervalo_5min"]
+    return df[(intervalos >= desde) & (intervalos < hasta)].reset_index(drop=True)
+
+
+# (credenciales, inicio, fin) -> (DataFrame, caduca o None)
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def _buscar(credenciales, inicio, fin):
+    ahora = time.monotonic()
+    with _lock:
+        for clave, (df, caduca) in list(_cache.items()):
+            if caduca is not None and caduca < ahora:
+                del _cache[clave]
+                continue
+            if clave[0] == credenciales and clave[1] <= inicio and fin <= clave[2]:
+                _cache.move_to_end(clave)
+                return df, clave[1:] == (inicio, fin)
+    return None, False
+
+
+def _guardar(credenciales, inicio, fin, df):
+    caduca = time.monotonic() + CACHE_TTL if fin >= date.today() else None
+    with _lock:
+        # Los rangos guardados que quedan dentro del nuevo ya no hacen falta
+        for clave in [c for c in _cache if c[0] == credenciales and inicio <= c[1] and c[2] <= fin]:
+            del _cache[clave]
+        _cache[(credenciales, inicio, fin)] = (df, caduca)
+        while len(_cache) > 1 and sum(len(d) for d, _ in _cache.values()) > CACHE_FILAS:
+            _cache.popitem(last=False)
+
+
+def conteos(inicio, fin, usuario, contraseña):
+    """
+    Vehículos contados por RSU e intervalo de 5 minutos entre los días
+    `inicio` y `fin` (incluidos), con ceros en los intervalos sin detecciones.
+    """
+    inicio, fin = _dia(inicio), _dia(fin)
+    credenciales = _credenciales(usuario, contraseña)
+    df, exacto = _buscar(credenciales, inicio, fin)
+    if df is not None:
+        return df.copy() if exacto else recortar(df, inicio, fin)
+    df = _conteos(usuario, contraseña, inicio, fin)
+    _guardar(credenciales, inicio, fin, df)
+    return df.copy()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crea en la base de datos RSU los índices que usa la consulta de conteos")
+    parser.add_argument("--crear-indices", action="store_true")
+    parser.add_argument("--usuario", required=True)
+    args = parser.parse_args()
+    if args.crear_indices:
+        conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, dbname=DB_NAME, user=args.usuario,
+                                password=getpass.getpass(f"Contraseña de {args.usuario}: "))
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            for sql in INDICES:
+                inicio = time.perf_counter()
+                cursor.execute(sql)
+                print(f"{sql} ({time.perf_counter() - inicio:.1f} s)")
+        conn.close()
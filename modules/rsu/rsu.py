@@ -1,66 +1,15 @@
 import dash
 from dash import html, dcc, dash_table, Input, Output, State
-import pandas as pd
-import psycopg2
 import datetime
 
-# Parámetros de conexión fijos
-DB_HOST = '34.245.188.222'
-DB_PORT = '5432'
-DB_NAME = 'gll_data'
+from modules.rsu.datos import conteos
 
+RUTA = "/pages/rsu"
 
-def get_data(start_date, end_date, db_user, db_pass):
-    conn = psycopg2.connect(
-        host=DB_HOST,
-        port=DB_PORT,
-        dbname=DB_NAME,
-        user=db_user,
-        password=db_pass
-    )
 
-    query = f"""
-    WITH intervalos AS ( 
-      SELECT generate_series(
-        '{start_date} 00:00:00'::timestamp,
-        '{end_date} 23:55:00'::timestamp,
-        interval '5 minutes'
-      ) AS intervalo_5min
-    ),
-    rsus AS (
-      SELECT DISTINCT rsu FROM public.data_bluetooth
-    ),
-    conteos AS (
-      SELECT 
-        rsu,
-        date_trunc('hour', to_timestamp(timestamp)) + 
-          interval '5 minutes' * floor(extract(minute from to_timestamp(timestamp)) / 5) AS intervalo_5min,
-        COUNT(*) AS vehiculos_contados
-      FROM 
-        public.data_bluetooth
-      WHERE 
-        class_of_device::text LIKE '%0408'
-        AND to_timestamp(timestamp) BETWEEN '{start_date} 00:00:00' AND '{end_date} 23:59:59'
-      GROUP BY 
-        rsu, intervalo_5min
-    )
-    SELECT 
-      r.rsu,
-      i.intervalo_5min,
-      COALESCE(c.vehiculos_contados, 0) AS vehiculos_contados
-    FROM 
-      rsus r
-    CROSS JOIN 
-      intervalos i
-    LEFT JOIN 
-      conteos c ON c.rsu = r.rsu AND c.intervalo_5min = i.intervalo_5min
-    ORDER BY 
-      r.rsu, i.intervalo_5min;
-    """
-
-    df = pd.read_sql(query, conn)
-    conn.close()
-    return df
+def get_data(start_date, end_date, db_user, db_pass):
+    # Pool de conexiones, consulta con parámetros y caché por rango (modules.rsu.datos)
+    return conteos(start_date, end_date, db_user, db_pass)
 
 
 layout = html.Div([
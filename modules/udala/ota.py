@@ -9,9 +9,14 @@ import folium
 import requests
 from jinja2 import Template
 import xml.etree.ElementTree as ET
+from modules.comun.cache_mapas import cachear_mapa, version_ficheros
 
+RUTA = "/mapa/ota"
+DATA_FOLDER = os.path.join(os.path.dirname(__file__), '../../data/udala')
+
+@cachear_mapa("ota", version=lambda: version_ficheros(DATA_FOLDER))
 def crear_mapa_ota():
-    data_folder = os.path.join(os.path.dirname(__file__), '../../data/udala')
+    data_folder = DATA_FOLDER
 
     gdf1 = gpd.read_file(os.path.join(data_folder, "TAO_Bertakoak.shp")).to_crs(epsg=4326)
     gdf2 = gpd.read_file(os.path.join(data_folder, "TAO_Elkarbanatua.shp")).to_crs(epsg=4326)
@@ -110,46 +115,47 @@ def crear_mapa_ota():
 
     return m.get_root().render() 
 
-layout = html.Div([
-    html.Div([
-    html.H1("Mapa de Zonas OTA en Donostia", style={
-        "textAlign": "center",
-        "color": "black",
-        "fontSize": "2rem",
-        "marginBottom": "1px"
-    }),
-    html.P([
-        "Este mapa interactivo muestra las diferentes zonas de la OTA (Ordenanza de Tráfico y Aparcamiento) en Donostia, ",
-        "clasificadas en cuatro tipos: zonas para residentes (Bertakoak), zonas compartidas (Elkarbanatua), ",
-        "zonas comerciales (Merkataritza) y zonas de aparcamiento de pago (Ordaintzekoa). ",
-        "Cada tipo está representado con un color distinto para facilitar su identificación. ",
-        "Al pasar el cursor sobre cada zona, se muestra información relevante como el nombre del área o la tarifa aplicable. ",
-        "Esta herramienta te ayuda a conocer las restricciones y condiciones de aparcamiento en la ciudad. ",
-        "Para más información, puede encontrar los datos en: ",
-        html.A(
-            "donostia.eus - Transporte OTA",
-            href="https://www.donostia.eus/datosabiertos/catalogo/transporte-ota",
-            target="_blank",
-            style={"color": "#007BFF", "textDecoration": "underline"}
-        )
-    ], style={
-        "textAlign": "center",
-        "color": "black",
-        "fontSize": "16px",
-        "fontFamily": "'Segoe UI', sans-serif"
-    })
-    ], style={"padding": "5px", "borderBottom": "1px solid #ddd"}),
+def layout():
+    return html.Div([
+        html.Div([
+        html.H1("Mapa de Zonas OTA en Donostia", style={
+            "textAlign": "center",
+            "color": "black",
+            "fontSize": "2rem",
+            "marginBottom": "1px"
+        }),
+        html.P([
+            "Este mapa interactivo muestra las diferentes zonas de la OTA (Ordenanza de Tráfico y Aparcamiento) en Donostia, ",
+            "clasificadas en cuatro tipos: zonas para residentes (Bertakoak), zonas compartidas (Elkarbanatua), ",
+            "zonas comerciales (Merkataritza) y zonas de aparcamiento de pago (Ordaintzekoa). ",
+            "Cada tipo está representado con un color distinto para facilitar su identificación. ",
+            "Al pasar el cursor sobre cada zona, se muestra información relevante como el nombre del área o la tarifa aplicable. ",
+            "Esta herramienta te ayuda a conocer las restricciones y condiciones de aparcamiento en la ciudad. ",
+            "Para más información, puede encontrar los datos en: ",
+            html.A(
+                "donostia.eus - Transporte OTA",
+                href="https://www.donostia.eus/datosabiertos/catalogo/transporte-ota",
+                target="_blank",
+                style={"color": "#007BFF", "textDecoration": "underline"}
+            )
+        ], style={
+            "textAlign": "center",
+            "color": "black",
+            "fontSize": "16px",
+            "fontFamily": "'Segoe UI', sans-serif"
+        })
+        ], style={"padding": "5px", "borderBottom": "1px solid #ddd"}),
 
-    dcc.Loading(
-        id="loading-ota",
-        type="circle",
-        fullscreen=False,
-        children=html.Iframe(
-            id='mapa-ota',
-            srcDoc=crear_mapa_ota(),
-            width='100%',
-            height='900px',
-            style={'border': 'none'}
+        dcc.Loading(
+            id="loading-ota",
+            type="circle",
+            fullscreen=False,
+            children=html.Iframe(
+                id='mapa-ota',
+                src=crear_mapa_ota.url(),
+                width='100%',
+                height='900px',
+                style={'border': 'none'}
+            )
         )
-    )
-], style={"margin": "0", "padding": "0", "position": "relative"})
+    ], style={"margin": "0", "padding": "0", "position": "relative"})
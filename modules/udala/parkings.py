@@ -3,14 +3,20 @@ from dash import dcc, html
 from dash.dependencies import Output, Input
 import pandas as pd
 import folium
-import requests
 from branca.element import Figure
 from pyproj import Transformer
+from modules.comun.cache_mapas import cachear_mapa
+from modules.comun.artefactos import publicar
+from modules.comun.sondeo import sondeador
+from modules.comun.cliente_http import cliente
+from modules.comun.capa_puntos import CapaPuntos
+from modules.comun.capas import registrar_capa
+
+RUTA = "/mapa/parkings"
 
 def obtener_parkings():
     url = "https://donostia.eus/info/ciudadano/camaras_trafico.nsf/getParkings.xsp"
-    response = requests.get(url)
-    data = response.json()
+    data = cliente.get(url).raise_for_status().json()
     parkings_data = []
     transformer = Transformer.from_crs("EPSG:25830", "EPSG:4326")
 
@@ -28,25 +34,30 @@ def obtener_parkings():
         })
     return pd.DataFrame(parkings_data)
 
-def generar_mapa_parkings(df_parkings):
-    if df_parkings.empty:
-        return "<h3>No hay datos de parkings para mostrar.</h3>"
+def con_total(df):
+    return df.assign(total=df["rotatorias"] + df["residentes"])
+
+sondeador.registrar("parkings", obtener_parkings, intervalo=5 * 60)
+registrar_capa(
+    "parkings",
+    lambda: con_total(sondeador.leer("parkings", por_defecto=pd.DataFrame(columns=["rotatorias", "residentes"]))),
+    version=lambda: sondeador.version("parkings"),
+    propiedades=["nombre", "libres", "total"],
+)
 
+# Los datos llegan de /api/layers/parkings y se refrescan en el navegador,
+# así que el HTML del mapa no cambia con cada lectura
+@cachear_mapa("parkings")
+def generar_mapa_parkings():
     fig = Figure(width=1000, height=800)
     m = folium.Map(location=[43.3187, -1.9805], zoom_start=14)
     folium.TileLayer('OpenStreetMap').add_to(m)
     fig.add_child(m)
 
-    for _, row in df_parkings.iterrows():
-        nombre = row["nombre"]
-        libres = row["libres"]
-        total = row["rotatorias"] + row["residentes"]
-        popup_text = f"<b>{nombre}</b><br>Libres: {libres} / {total} plazas"
-        folium.Marker(
-            location=[row["lat"], row["lon"]],
-            popup=folium.Popup(popup_text, max_width=300),
-            icon=folium.Icon(color="blue", icon="car", prefix='fa')
-        ).add_to(m)
+    CapaPuntos(
+        capa="parkings", popup="<b>{nombre}</b><br>Libres: {libres} / {total} plazas",
+        color="blue", icono="car", prefijo="fa", refresco=5 * 60
+    ).add_to(m)
     return m.get_root().render()
 
 def layout():
@@ -89,7 +100,7 @@ def layout():
             fullscreen=False,
             children=html.Iframe(
                 id='mapa-parkings',
-                srcDoc="",
+                src="about:blank",
                 width='100%',
                 height='1000px',
                 style={'border': 'none'}
@@ -99,9 +110,11 @@ def layout():
 
 def register_callbacks(app):
     @app.callback(
-        Output('mapa-parkings', 'srcDoc'),
+        Output('mapa-parkings', 'src'),
         Input('interval-component-parkings', 'n_intervals')
     )
     def update_map(n):
-        df_parkings = obtener_parkings()
-        return generar_mapa_parkings(df_parkings)
+        df_parkings = sondeador.leer("parkings", por_defecto=pd.DataFrame(), espera=10)
+        if df_parkings.empty:
+            return publicar("<h3>No hay datos de parkings para mostrar.</h3>")
+        return generar_mapa_parkings.url()
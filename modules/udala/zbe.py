@@ -1,34 +1,41 @@
-import requests
-from lxml import etree
 import folium
 import dash
 from dash import dcc, html
 from branca.element import Figure
 import pandas as pd
+from modules.comun.cache_mapas import cachear_mapa
+from modules.comun.sondeo import sondeador
+from modules.comun.cliente_http import cliente, ErrorHTTP
+from modules.comun.datex2 import leer_datex2
+
+RUTA = "/mapa/zbe"
+CACHEAR_LAYOUT = False
+
+
+URL_ZBE = "https://infocar.dgt.es/datex2/v3/dgt/zbe/ControledZonePublication/Donostia-SanSebastian.xml"
 
 
 def obtener_poligono_zbe():
-    url = "https://infocar.dgt.es/datex2/v3/dgt/zbe/ControledZonePublication/Donostia-SanSebastian.xml"
-    response = requests.get(url)
-    if response.status_code != 200:
-        print("No se pudo descargar el XML")
+    # Si el XML no ha cambiado (304) el cliente devuelve el polígono ya parseado
+    try:
+        return cliente.obtener_procesado(URL_ZBE, parsear_poligono_zbe)
+    except ErrorHTTP as e:
+        print(f"No se pudo descargar el XML: {e}")
         return []
 
-    root = etree.fromstring(response.content)
 
-    coords_elements = root.xpath('//*[local-name()="openlrCoordinates"]')
-    coords = []
-    for elem in coords_elements:
-        lat_nodes = elem.xpath('.//*[local-name()="latitude"]')
-        lon_nodes = elem.xpath('.//*[local-name()="longitude"]')
-        if lat_nodes and lon_nodes:
-            lat = float(lat_nodes[0].text)
-            lon = float(lon_nodes[0].text)
-            coords.append((lat, lon))
+def parsear_poligono_zbe(contenido):
+    coords = leer_datex2(
+        contenido,
+        "openlrCoordinates",
+        como_dataframe=False,
+    )
+    return list(zip(coords["lat"].tolist(), coords["lon"].tolist()))
 
-    return coords
+sondeador.registrar("zbe", obtener_poligono_zbe, intervalo=60 * 60)
 
 
+@cachear_mapa("zbe", clave=lambda coords: (), version=lambda coords: hash(tuple(coords)))
 def crear_mapa_zbe(coords):
     if not coords:
         return None
@@ -51,49 +58,47 @@ def crear_mapa_zbe(coords):
 
     return m.get_root().render()
 
-
-coords_zbe = obtener_poligono_zbe()
-mapa_html = crear_mapa_zbe(coords_zbe)
-
-layout = html.Div([
-    html.Div([
-        html.H1("Mapa de Zona de Bajas Emisiones (ZBE) en Donostia", style={
+def layout():
+    coords_zbe = sondeador.leer("zbe", por_defecto=[], espera=10)
+    return html.Div([
+        html.Div([
+            html.H1("Mapa de Zona de Bajas Emisiones (ZBE) en Donostia", style={
+                "textAlign": "center",
+                "color": "black",
+                "fontSize": "2rem",
+                "marginBottom": "1px"
+            }),
+            html.P([
+            "Este mapa muestra la Zona de Bajas Emisiones (ZBE) de Donostia. "
+            "El polígono en verde representa los límites de la zona controlada. "
+            "Los vehículos que no cumplen con los requisitos de emisiones establecidos tienen restringido el acceso o el aparcamiento en esta zona. ",
+            "Para más información, puede encontrar los datos en: ",
+            html.A(
+                    "infocar.dgt.es",
+                    href="https://infocar.dgt.es/datex2/v3/dgt/zbe/ControledZonePublication/",
+                    target="_blank",
+                    style={"color": "#007BFF", "textDecoration": "underline"}
+                )
+        ], style={
             "textAlign": "center",
             "color": "black",
-            "fontSize": "2rem",
-            "marginBottom": "1px"
-        }),
-        html.P([
-        "Este mapa muestra la Zona de Bajas Emisiones (ZBE) de Donostia. "
-        "El polígono en verde representa los límites de la zona controlada. "
-        "Los vehículos que no cumplen con los requisitos de emisiones establecidos tienen restringido el acceso o el aparcamiento en esta zona. ",
-        "Para más información, puede encontrar los datos en: ",
-        html.A(
-                "infocar.dgt.es",
-                href="https://infocar.dgt.es/datex2/v3/dgt/zbe/ControledZonePublication/",
-                target="_blank",
-                style={"color": "#007BFF", "textDecoration": "underline"}
+            "fontSize": "16px",
+            "fontFamily": "'Segoe UI', sans-serif"
+        })
+        ], style={"padding": "5px", "borderBottom": "1px solid #ddd"}),
+        dcc.Loading(
+            id="loading-zbe",
+            type="circle",
+            fullscreen=False,
+            children=html.Iframe(
+                id='mapa-zbe',
+                src=crear_mapa_zbe.url(coords_zbe) if coords_zbe else "about:blank",
+                width='100%',
+                height='900px',
+                style={'border': 'none'}
             )
-    ], style={
-        "textAlign": "center",
-        "color": "black",
-        "fontSize": "16px",
-        "fontFamily": "'Segoe UI', sans-serif"
-    })
-    ], style={"padding": "5px", "borderBottom": "1px solid #ddd"}),
-    dcc.Loading(
-        id="loading-zbe",
-        type="circle",
-        fullscreen=False,
-        children=html.Iframe(
-            id='mapa-zbe',
-            srcDoc=mapa_html,
-            width='100%',
-            height='900px',
-            style={'border': 'none'}
         )
-    )
-], style={"margin": "0", "padding": "0", "position": "relative"})
+    ], style={"margin": "0", "padding": "0", "position": "relative"})
 
 def obtener_zbe_coords():
     coords = obtener_poligono_zbe()
@@ -0,0 +1,67 @@
+import pytest
+
+from modules.comun import cliente_http
+from modules.comun.cliente_http import ClienteHTTP, ErrorHTTP
+from modules.comun.servidor_grabaciones import iniciar_servidor
+
+HOST = "fuente.test"
+URL = f"http://{HOST}/datos.json"
+
+
+@pytest.fixture
+def fuente(tmp_path, monkeypatch):
+    monkeypatch.setattr(cliente_http, "BACKOFF_BASE", 0)
+    (tmp_path / HOST).mkdir()
+    (tmp_path / HOST / "datos.json").write_text('{"libres": 12}', encoding="utf-8")
+    fallos = {}
+    servidor, base = iniciar_servidor(tmp_path, fallos=fallos)
+    cliente = ClienteHTTP(redirecciones={HOST: f"{base}/{HOST}"})
+    yield cliente, fallos
+    cliente.sesion.close()
+    servidor.shutdown()
+    servidor.server_close()
+
+
+def test_revalidacion_304_devuelve_el_mismo_contenido(fuente):
+    cliente, _ = fuente
+    primera = cliente.get(URL)
+    segunda = cliente.get(URL)
+    assert primera.estado == 200 and primera.modificado
+    assert segunda.json() == {"libres": 12}
+    assert not segunda.modificado and not segunda.desde_cache
+    assert segunda.contenido is primera.contenido
+
+
+def test_reintenta_tras_503(fuente):
+    cliente, fallos = fuente
+    fallos["/fuente.test/datos.json"] = [503, 503]
+    respuesta = cliente.get(URL)
+    assert respuesta.estado == 200 and respuesta.json() == {"libres": 12}
+    assert fallos["/fuente.test/datos.json"] == []
+
+
+def test_circuito_abierto_sirve_la_ultima_buena(fuente):
+    cliente, fallos = fuente
+    buena = cliente.get(URL)
+    intentos = cliente_http.REINTENTOS + 1
+    fallos["/fuente.test/datos.json"] = [503] * (intentos * cliente_http.UMBRAL_CIRCUITO)
+    for _ in range(cliente_http.UMBRAL_CIRCUITO):
+        respuesta = cliente.get(URL)
+        assert respuesta.desde_cache and respuesta.contenido is buena.contenido
+    assert fallos["/fuente.test/datos.json"] == []
+    assert cliente._circuito(HOST)["aperturas"] == 1
+
+    # Con el circuito abierto no se llega al servidor
+    fallos["/fuente.test/datos.json"] = [503]
+    respuesta = cliente.get(URL)
+    assert respuesta.desde_cache and respuesta.contenido is buena.contenido
+    assert fallos["/fuente.test/datos.json"] == [503]
+
+
+def test_raise_for_status_en_404(fuente):
+    cliente, _ = fuente
+    respuesta = cliente.get(f"http://{HOST}/no-existe.json")
+    assert respuesta.estado == 404
+    with pytest.raises(ErrorHTTP):
+        respuesta.raise_for_status()
+    assert cliente.get(URL).raise_for_status().estado == 200
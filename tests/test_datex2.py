@@ -0,0 +1,34 @@
+from modules.comun.datex2 import leer_datex2
+
+PUBLICACION = b"""<?xml version="1.0" encoding="UTF-8"?>
+<d2:payload xmlns:d2="http://datex2.eu/schema/3/d2Payload" xmlns:loc="http://datex2.eu/schema/3/locationReferencing">
+  <d2:site id="a">
+    <d2:name>A</d2:name>
+    <loc:latitude>43.1</loc:latitude>
+    <loc:longitude>-2.1</loc:longitude>
+  </d2:site>
+  <loc:latitude>1.0</loc:latitude>
+  <loc:longitude>1.0</loc:longitude>
+  <d2:site id="b">
+    <d2:name>B</d2:name>
+    <loc:latitude>43.2</loc:latitude>
+    <loc:longitude>-2.2</loc:longitude>
+  </d2:site>
+  <d2:site id="c">
+    <d2:name>C</d2:name>
+  </d2:site>
+</d2:payload>
+"""
+
+
+def test_coordenadas_entre_elementos_se_ignoran():
+    df = leer_datex2(PUBLICACION, "site", campos={"nombre": "{*}name"})
+    assert df["nombre"].tolist() == ["A", "B"]
+    assert df["lat"].tolist() == [43.1, 43.2]
+    assert df["lon"].tolist() == [-2.1, -2.2]
+
+
+def test_coordenadas_antes_del_elemento_no_pasan_al_siguiente():
+    publicacion = PUBLICACION.replace(b'<d2:site id="a">', b'<loc:latitude>1.0</loc:latitude><d2:site id="a">')
+    df = leer_datex2(publicacion, "site", campos={"nombre": "{*}name"})
+    assert df["lat"].tolist() == [43.1, 43.2]